@@ -2,6 +2,7 @@ const mqtt = require('mqtt');
 const fs = require('fs');
 const path = require('path');
 const tls = require('tls');
+const { cloudConfigVersion } = require('./utils/cloud-config.js');
 
 // MQTT Topic Path Constants
 const MQTT_ROOT = 'local';
@@ -78,6 +79,7 @@ class MqttService {
             console.log('Connected to MQTT broker');
             this.connected = true;
             this.subscribeToTopics();
+            this.publishCurrentCloudConfigVersion();
         });
 
         this.client.on('error', (error) => {
@@ -583,20 +585,32 @@ class MqttService {
         return true;
     }
 
-    // Notify local services that cloud configuration has changed
-    publishCloudConfigChanged() {
+    // Notify local services that cloud configuration has changed. Retained, so
+    // the deployment watcher learns the current version whenever it connects.
+    publishCloudConfigChanged(version) {
         if (!this.connected) {
             console.warn('MQTT not connected, cannot publish cloud config notification');
             return false;
         }
 
         const topic = TOPICS.CLOUD_CONFIG_CHANGED;
-        const payload = { timestamp: new Date().toISOString() };
+        const payload = { timestamp: new Date().toISOString(), version };
         console.log(`Publishing cloud config changed to ${topic}`);
-        this.client.publish(topic, JSON.stringify(payload), { qos: 1 });
+        this.client.publish(topic, JSON.stringify(payload), { qos: 1, retain: true });
         return true;
     }
 
+    // Publish the version of the stored cloud config (e.g. after a broker restart lost the retained one)
+    async publishCurrentCloudConfigVersion() {
+        if (!this.db) return;
+        try {
+            const config = await this.db.collection('system_config').findOne({ _id: 'main' });
+            this.publishCloudConfigChanged(cloudConfigVersion(config));
+        } catch (error) {
+            console.error('Error publishing cloud config version:', error);
+        }
+    }
+
     disconnect() {
         if (this.client) {
             this.client.end();
@@ -1,6 +1,7 @@
 const express = require('express');
 const router = express.Router();
 const { encrypt, decrypt } = require('../utils/crypto.js');
+const { cloudConfigVersion } = require('../utils/cloud-config.js');
 const { injectWithRetry, removeWithRetry } = require('../services/nodered-cloud-workflow.js');
 const { syncPdmChannelsToLights } = require('../services/pdm-channel-sync.js');
 
@@ -235,8 +236,10 @@ module.exports = (db) => {
             // Notify local services if cloud config changed
             if (cloud_enabled !== undefined || cloud_url !== undefined || cloud_mqtt_username !== undefined || cloud_mqtt_password !== undefined || cloud_api_key !== undefined) {
                 const mqttService = require('../mqtt');
+                // Re-read saved config to get the full set of cloud fields
+                const saved = await systemConfig.findOne({ _id: 'main' });
                 try {
-                    mqttService.publishCloudConfigChanged();
+                    mqttService.publishCloudConfigChanged(cloudConfigVersion(saved));
                 } catch (error) {
                     console.error('[System Config] Error publishing cloud config notification:', error);
                 }
@@ -246,8 +249,6 @@ module.exports = (db) => {
                     removeWithRetry().catch(err =>
                         console.error('[System Config] Cloud workflow removal failed:', err.message));
                 } else {
-                    // Re-read saved config to get the full set of cloud fields
-                    const saved = await systemConfig.findOne({ _id: 'main' });
                     if (saved && saved.cloud_enabled) {
                         let mqttPass = '';
                         if (saved.cloud_mqtt_password_encrypted && saved.cloud_mqtt_password_iv) {
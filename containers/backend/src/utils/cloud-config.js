@@ -0,0 +1,21 @@
+const crypto = require('crypto');
+
+/**
+ * Version of the stored cloud configuration: a SHA256 over the cloud fields as
+ * they are stored (secrets in encrypted form). Published on
+ * local/config/cloud_updated so the deployment watcher re-reads the config
+ * only when it changed. local_code/deployment-watcher.py computes the same
+ * hash in read_cloud_config(); keep the two in step.
+ * @param {Object|null} config - system_config document
+ * @returns {string} Hex digest
+ */
+function cloudConfigVersion(config) {
+    const c = config || {};
+    return crypto.createHash('sha256').update(JSON.stringify([
+        c.cloud_enabled || false, c.cloud_url || '', c.cloud_mqtt_username || '',
+        c.cloud_mqtt_password_encrypted || '', c.cloud_mqtt_password_iv || '',
+        c.cloud_api_key_encrypted || '', c.cloud_api_key_iv || ''
+    ])).digest('hex');
+}
+
+module.exports = { cloudConfigVersion };
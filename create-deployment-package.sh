@@ -7,13 +7,17 @@ set -e
 # Usage:
 #   ./create-deployment-package.sh                    # No version injection
 #   ./create-deployment-package.sh --version=1.0.0    # With version injection + firmware fetch
+#   ./create-deployment-package.sh --delta            # Also write a content-addressed delta package
 #
 
 # Parse parameters
 VERSION=""
+DELTA=""
 for arg in "$@"; do
     if [[ $arg == --version=* ]]; then
         VERSION="${arg#--version=}"
+    elif [[ $arg == --delta ]]; then
+        DELTA="yes"
     fi
 done
 
@@ -146,6 +150,15 @@ cd "$STAGING_DIR"
 zip -r "../$ZIP_NAME" . > /dev/null
 cd ..
 
+# Step 5.5: Write the same tree as a manifest plus content-addressed blobs
+if [ -n "$DELTA" ]; then
+    DELTA_DIR="${ZIP_NAME%.zip}-delta"
+    echo ""
+    echo "Step 5.5: Creating content-addressed delta package..."
+    rm -rf "$DELTA_DIR"
+    python3 local_code/delta_package.py build "$STAGING_DIR" "$DELTA_DIR"
+fi
+
 # Step 6: Clean up staging
 echo "Step 6: Cleaning up..."
 rm -rf "$STAGING_DIR"
@@ -158,6 +171,11 @@ echo "=========================================="
 echo ""
 echo "Package: $ZIP_NAME"
 ls -lh "$ZIP_NAME"
+if [ -n "$DELTA" ]; then
+    echo "Delta package: $DELTA_DIR/ (manifest.json + blobs/)"
+    echo "  Upload blobs/ to the cloud blob store (existing blobs can be skipped) and"
+    echo "  publish manifest.json with the deployment as manifestUrl/manifestSha256."
+fi
 echo ""
 echo "Package contents:"
 echo "  images/*.tar           (7 pre-built Docker images including MongoDB)"
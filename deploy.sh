@@ -5,10 +5,10 @@ set -e
 # Deploys the TrailCurrent system on a Raspberry Pi from a deployment package
 #
 # This script:
-#   1. Stops existing services
-#   2. Loads Docker images from tar files
-#   3. Sets up environment files
-#   4. Starts Docker services
+#   1. Loads Docker images from tar files (services keep running)
+#   2. Sets up environment files
+#   3. Stops existing services (only with DEPLOY_FULL_RESTART=yes)
+#   4. Starts Docker services, recreating the containers that changed (the cut-over)
 #   5. Installs Python dependencies
 #   6. Restarts the CAN-to-MQTT service
 #   7. Deploys MCU firmware via OTA (if firmware is included)
@@ -20,67 +20,23 @@ set -e
 VENV_PATH="$HOME/local_code/cantomqtt"
 LOCAL_CODE_DEST="$HOME/local_code"
 
-# Function to deploy firmware to a device via OTA
-deploy_firmware() {
-    local hostname=$1
-    local firmware_path=$2
-    local device_name=$3
+# Cut-over downtime record, reported by the deployment watcher with 'completed'
+DOWNTIME_FILE="$HOME/.deployment-downtime.json"
 
-    # Step 1: Trigger OTA mode via MQTT
-    echo "  Triggering OTA mode for $device_name ($hostname)..."
-    "$VENV_PATH/bin/python3" local_code/trigger_ota_mqtt.py "$hostname"
-
-    if [ $? -ne 0 ]; then
-        echo "  Failed to send OTA trigger to $hostname"
-        return 1
-    fi
-
-    # Step 2: Wait for device to enter OTA mode (8-10 seconds)
-    echo "  Waiting for $hostname to enter OTA mode..."
-    sleep 8
-
-    # Step 3: Use bundled espota.py
-    ESPOTA="local_code/espota.py"
-    if [ ! -f "$ESPOTA" ]; then
-        echo "  espota.py not found at $ESPOTA"
-        return 1
-    fi
-
-    # Step 4: Determine the Pi's IP address for OTA upload
-    UPLOAD_IP=$(python3 -c "
-import socket
-try:
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    s.connect(('8.8.8.8', 80))
-    ip = s.getsockname()[0]
-    s.close()
-    print(ip)
-except:
-    try:
-        print(socket.gethostbyname(socket.gethostname()))
-    except:
-        print('127.0.0.1')
-" 2>/dev/null)
-
-    if [ -z "$UPLOAD_IP" ] || [ "$UPLOAD_IP" = "127.0.0.1" ]; then
-        echo "  Warning: Could not determine Pi IP, using hostname: $TLS_HOSTNAME"
-        UPLOAD_IP="$TLS_HOSTNAME"
-    fi
-
-    # Step 5: Push firmware using espota.py
-    echo "  Uploading firmware to $hostname (using $UPLOAD_IP as upload server)..."
-    python3 "$ESPOTA" -i "$hostname" -I "$UPLOAD_IP" -f "$firmware_path" -d
-
-    # Step 6: Verify (check exit code)
-    if [ $? -eq 0 ]; then
-        echo "  Successfully deployed firmware to $device_name"
-        return 0
+# Milliseconds since the epoch (bash 5 EPOCHREALTIME, else whole seconds)
+now_ms() {
+    if [ -n "$EPOCHREALTIME" ]; then
+        local t="${EPOCHREALTIME/[.,]/}"
+        echo "${t:0:${#t}-3}"
     else
-        echo "  Failed to deploy firmware to $device_name"
-        return 1
+        echo "$(date +%s)000"
     fi
 }
 
+ms_to_s() {
+    printf '%d.%03d' $(($1 / 1000)) $(($1 % 1000))
+}
+
 echo "=========================================="
 echo "TrailCurrent Deployment Script"
 echo "=========================================="
@@ -152,44 +108,33 @@ if [ -f "data/keys/ca.crt" ]; then
     fi
 fi
 
-# Step 1: Stop existing services
+# Step 1: Load Docker images from tar files while the current release keeps running
 echo ""
-echo "Step 1: Stopping existing services..."
-
-# Stop Docker services and remove orphaned containers from previous deployments
-docker compose down --remove-orphans 2>/dev/null || true
-
-# Stop systemd service for Python code
-if systemctl is-active --quiet cantomqtt.service; then
-    echo "  Stopping cantomqtt.service..."
-    sudo systemctl stop cantomqtt.service
-fi
-
-# Step 2: Load Docker images from tar files
-echo ""
-echo "Step 2: Loading Docker images..."
-images_loaded=0
-for image_file in images/*.tar; do
-    if [ -f "$image_file" ]; then
-        echo "  Loading $image_file..."
-        if docker load -i "$image_file"; then
-            images_loaded=$((images_loaded+1))
-        else
-            echo "  Warning: Failed to load $image_file"
-        fi
+echo "Step 1: Loading Docker images (services keep running)..."
+if command -v python3 >/dev/null 2>&1 && [ -f "local_code/load_images.py" ]; then
+    # Skips tarballs whose image ID (and tags) the daemon already has, loads the
+    # rest IMAGE_LOAD_PARALLEL at a time and prints a per-image timing summary.
+    if ! python3 local_code/load_images.py --parallel "${IMAGE_LOAD_PARALLEL:-2}" images/*.tar; then
+        echo "  Warning: Failed to load one or more images (see summary above)"
     fi
-done
-echo "  Loaded $images_loaded image(s)"
-
-# Prune dangling images left over from previous deployments
-pruned=$(docker image prune -f 2>/dev/null | grep "Total reclaimed space" || true)
-if [ -n "$pruned" ]; then
-    echo "  Cleaned up old images: $pruned"
+else
+    images_loaded=0
+    for image_file in images/*.tar; do
+        if [ -f "$image_file" ]; then
+            echo "  Loading $image_file..."
+            if docker load -i "$image_file"; then
+                images_loaded=$((images_loaded+1))
+            else
+                echo "  Warning: Failed to load $image_file"
+            fi
+        fi
+    done
+    echo "  Loaded $images_loaded image(s)"
 fi
 
-# Step 3: Set up environment files
+# Step 2: Set up environment files
 echo ""
-echo "Step 3: Setting up environment files..."
+echo "Step 2: Setting up environment files..."
 
 TLS_HOSTNAME=$(grep "^TLS_CERT_HOSTNAME=" .env | cut -d'=' -f2)
 
@@ -204,12 +149,40 @@ fi
 echo "  Root .env: MQTT_BROKER_URL=mqtts://mosquitto:8883 (for Docker)"
 echo "  local_code/.env: MQTT_BROKER_URL=mqtts://${TLS_HOSTNAME}:8883 (for host scripts)"
 
-# Step 4: Start Docker services
+# Step 3: Stop existing services (full restart only)
+echo ""
+echo "Step 3: Stopping existing services..."
+CUTOVER_START=$(now_ms)
+CAN_BRIDGE_STOPPED=""
+if [ "${DEPLOY_FULL_RESTART:-no}" = "yes" ]; then
+    # Stop Docker services and remove orphaned containers from previous deployments
+    docker compose down --remove-orphans 2>/dev/null || true
+
+    # Stop systemd service for Python code
+    if systemctl is-active --quiet cantomqtt.service; then
+        echo "  Stopping cantomqtt.service..."
+        sudo systemctl stop cantomqtt.service
+        CAN_BRIDGE_STOPPED=$CUTOVER_START
+    fi
+else
+    echo "  Services keep running; Step 4 recreates only containers whose image or"
+    echo "  configuration changed (DEPLOY_FULL_RESTART=yes stops everything first)"
+fi
+
+# Step 4: Start Docker services (the cut-over)
 echo ""
 echo "Step 4: Starting Docker services..."
 # --no-build: use pre-loaded images, don't try to build from source
 # --remove-orphans: clean up containers from services removed in newer versions
 docker compose up -d --no-build --remove-orphans
+DOCKER_DOWNTIME_MS=$(( $(now_ms) - CUTOVER_START ))
+echo "  Docker cut-over took $(ms_to_s $DOCKER_DOWNTIME_MS)s"
+
+# Prune images the previous containers used (dangling now that they are replaced)
+pruned=$(docker image prune -f 2>/dev/null | grep "Total reclaimed space" || true)
+if [ -n "$pruned" ]; then
+    echo "  Cleaned up old images: $pruned"
+fi
 
 # Step 5: Ensure local_code is deployed to the user's home directory
 echo ""
@@ -266,6 +239,7 @@ echo "Step 6: Restarting Python service (cantomqtt)..."
 if [ -f "local_code/can-to-mqtt.service" ]; then
     sudo cp local_code/can-to-mqtt.service /etc/systemd/system/cantomqtt.service
     sudo systemctl daemon-reload
+    CAN_BRIDGE_STOPPED=${CAN_BRIDGE_STOPPED:-$(now_ms)}
     if sudo systemctl is-enabled --quiet cantomqtt.service 2>/dev/null; then
         sudo systemctl restart cantomqtt.service
         echo "  cantomqtt.service updated and restarted"
@@ -277,10 +251,20 @@ else
     echo "  ERROR: local_code/can-to-mqtt.service not found"
 fi
 
+CAN_BRIDGE_DOWNTIME_MS=$(( $(now_ms) - ${CAN_BRIDGE_STOPPED:-$(now_ms)} ))
+
 # Wait for cantomqtt to initialize (connect to MQTT broker and CAN bus)
 echo "  Waiting for CAN-to-MQTT bridge to initialize..."
 sleep 5
 
+# Record the downtime before Step 6.1 restarts the deployment watcher
+echo "  Downtime: Docker services $(ms_to_s $DOCKER_DOWNTIME_MS)s, CAN bridge $(ms_to_s $CAN_BRIDGE_DOWNTIME_MS)s"
+FULL_RESTART=false
+if [ "${DEPLOY_FULL_RESTART:-no}" = "yes" ]; then
+    FULL_RESTART=true
+fi
+echo "{\"docker_seconds\": $(ms_to_s $DOCKER_DOWNTIME_MS), \"can_bridge_seconds\": $(ms_to_s $CAN_BRIDGE_DOWNTIME_MS), \"full_restart\": $FULL_RESTART, \"measured_at\": $(date +%s)}" > "$DOWNTIME_FILE"
+
 # Step 6.1: Install/restart deployment watcher service
 echo ""
 echo "Step 6.1: Setting up deployment watcher service..."
@@ -334,11 +318,13 @@ if [ -f "local_code/provision_wifi_mqtt.py" ]; then
 
             if [ -n "$WIFI_SSID" ] && [ -n "$WIFI_PASSWORD" ]; then
                 echo "  Sending WiFi credentials to MCUs (SSID: $WIFI_SSID)..."
-                "$VENV_PATH/bin/python3" local_code/provision_wifi_mqtt.py "$WIFI_SSID" "$WIFI_PASSWORD"
-                if [ $? -eq 0 ]; then
+                "$VENV_PATH/bin/python3" local_code/provision_wifi_mqtt.py "$WIFI_SSID" "$WIFI_PASSWORD" && PROVISION_RC=0 || PROVISION_RC=$?
+                if [ $PROVISION_RC -eq 0 ]; then
                     echo "  WiFi credentials provisioned successfully"
                     # Brief wait for MCUs to store credentials in NVS
                     sleep 2
+                elif [ $PROVISION_RC -eq 3 ]; then
+                    echo "  Warning: Some modules did not accept the WiFi credentials (see list above)"
                 else
                     echo "  Warning: Failed to provision WiFi credentials"
                 fi
@@ -363,7 +349,7 @@ echo "Step 7: Deploying MCU firmware (if present)..."
 # binaries from a previous deployment are left behind (unzip overlays, it
 # never deletes old files).
 FIRMWARE_INCLUDED=$(cat .firmware-included 2>/dev/null)
-if [ "$FIRMWARE_INCLUDED" = "yes" ] && [ -f "local_code/trigger_ota_mqtt.py" ]; then
+if [ "$FIRMWARE_INCLUDED" = "yes" ] && [ -f "local_code/ota_rollout.py" ]; then
     echo "  Firmware directory found, querying enabled devices..."
 
     # Query MongoDB for enabled modules via Docker (MongoDB is not exposed to host)
@@ -383,25 +369,33 @@ if [ "$FIRMWARE_INCLUDED" = "yes" ] && [ -f "local_code/trigger_ota_mqtt.py" ];
     if [ "$MODULES" = "[]" ]; then
         echo "  No enabled modules found in database, skipping OTA deployment"
     else
-        echo "  Deploying firmware to enabled modules..."
-
-        if command -v jq &> /dev/null; then
-            echo "$MODULES" | jq -c '.[]' | while read -r module; do
-                HOSTNAME=$(echo "$module" | jq -r '.hostname')
-                TYPE=$(echo "$module" | jq -r '.type')
-                NAME=$(echo "$module" | jq -r '.name')
-                FIRMWARE_PATH="firmware/wired/${TYPE}/firmware.bin"
-
-                if [ -f "$FIRMWARE_PATH" ]; then
-                    echo "  Deploying firmware to $NAME ($HOSTNAME)..."
-                    deploy_firmware "$HOSTNAME" "$FIRMWARE_PATH" "$NAME" || true
-                else
-                    echo "  No firmware found for $NAME (type: $TYPE), skipping..."
-                fi
-            done
+        echo "  Deploying firmware to enabled modules (up to ${OTA_PARALLEL:-3} at a time)..."
+        # Triggers each module over CAN and uploads with espota.serve() concurrently,
+        # each upload on its own local port; prints a per-module summary.
+        # Modules already running their image (~/.ota-deployed-firmware.json) are
+        # skipped unless OTA_FORCE=yes; OTA_VERIFY_RUNNING=yes confirms over CAN.
+        # One trace span per module, added to the watcher's run of this deployment
+        OTA_ARGS="--trace-deployment ${DEPLOYMENT_ID:-manual} --trace-version ${DEPLOYMENT_VERSION:-unknown}"
+        if [ -n "${DEPLOYMENT_TRACE_RUN:-}" ]; then
+            OTA_ARGS="$OTA_ARGS --trace-run $DEPLOYMENT_TRACE_RUN"
+        fi
+        if [ "${OTA_COMPRESS:-no}" = "yes" ]; then
+            OTA_ARGS="$OTA_ARGS --compress"
+        fi
+        if [ "${OTA_FORCE:-no}" = "yes" ]; then
+            OTA_ARGS="$OTA_ARGS --force"
+        fi
+        if [ "${OTA_VERIFY_RUNNING:-no}" = "yes" ]; then
+            OTA_ARGS="$OTA_ARGS --verify-running"
+        fi
+        if "$VENV_PATH/bin/python3" local_code/ota_rollout.py \
+            --modules "$MODULES" \
+            --firmware-dir firmware/wired \
+            --parallel "${OTA_PARALLEL:-3}" \
+            --fallback-host "$TLS_HOSTNAME" $OTA_ARGS; then
             echo "  Firmware deployment complete"
         else
-            echo "  jq not found, skipping firmware deployment (install jq to enable OTA updates)"
+            echo "  Warning: Firmware deployment failed for one or more modules (see summary above)"
         fi
     fi
 else
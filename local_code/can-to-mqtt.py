@@ -8,6 +8,13 @@ import ssl
 import traceback
 import re
 import signal
+import queue
+import select
+import socketserver
+import threading
+
+from can_frames import parse_can_id
+from can_control import CONTROL_SOCKET_PATH
 
 MAX_RETRIES = 100
 shutdown_requested = False
@@ -132,6 +139,116 @@ def on_disconnect(client, userdata, flags, reason_code, properties):
     else:
         print(f"Disconnected from MQTT broker unexpectedly (rc={reason_code}), will auto-reconnect")
 
+def send_frame(bus, can_id, data_bytes):
+    """Send a single standard-ID data frame directly on the bus."""
+    bus.send(can.Message(arbitration_id=can_id, data=bytes(data_bytes[:8]), is_extended_id=False))
+
+
+class ControlRequestHandler(socketserver.StreamRequestHandler):
+    """Executes newline-delimited JSON commands from can_control.py clients."""
+
+    def handle(self):
+        for raw in self.rfile:
+            try:
+                request = json.loads(raw.decode('utf-8'))
+                if request.get('cmd') == 'listen':
+                    # Turns this connection into a one-way stream of inbound frames
+                    self.stream_frames(parse_can_id(request['id']), request.get('prefix', []))
+                    return
+                response = self.execute(request)
+            except Exception as e:
+                response = {'ok': False, 'error': str(e)}
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+    def execute(self, request):
+        bus = self.server.bus
+        cmd = request.get('cmd')
+        if cmd == 'ping':
+            return {'ok': True}
+        if cmd == 'send':
+            send_frame(bus, parse_can_id(request['id']), request.get('data', []))
+            return {'ok': True, 'frames': 1}
+        return {'ok': False, 'error': f'Unknown command: {cmd}'}
+
+    def stream_frames(self, can_id, prefix):
+        """Forward inbound frames matching can_id/prefix until the client disconnects."""
+        frames = queue.Queue()
+        listener = (can_id, list(prefix), frames)
+        self.server.add_listener(listener)
+        try:
+            self.wfile.write(b'{"ok": true}\n')
+            self.wfile.flush()
+            while not self.server.closing:
+                try:
+                    frame_id, data = frames.get(timeout=0.5)
+                except queue.Empty:
+                    # Client closed its end: the socket becomes readable with no data
+                    readable, _, _ = select.select([self.connection], [], [], 0)
+                    if readable and not self.connection.recv(1):
+                        return
+                    continue
+                self.wfile.write((json.dumps({'frame': {'id': frame_id, 'data': data}}) + '\n').encode('utf-8'))
+                self.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            self.server.remove_listener(listener)
+
+
+class ControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, bus):
+        # Remove a stale socket left behind by a crashed instance
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, ControlRequestHandler)
+        os.chmod(path, 0o660)
+        self.bus = bus
+        self.closing = False
+        self.listeners = []
+        self.listeners_lock = threading.Lock()
+
+    def add_listener(self, listener):
+        with self.listeners_lock:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self.listeners_lock:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+    def dispatch(self, message):
+        """Hand a received frame to every 'listen' connection whose filter matches."""
+        with self.listeners_lock:
+            if not self.listeners:
+                return
+            listeners = list(self.listeners)
+        data = list(message.data)
+        for can_id, prefix, frames in listeners:
+            if message.arbitration_id == can_id and data[:len(prefix)] == prefix:
+                frames.put((can_id, data))
+
+
+def start_control_server(bus):
+    """Serve the local command socket on a background thread."""
+    server = ControlServer(CONTROL_SOCKET_PATH, bus)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Control socket listening on {CONTROL_SOCKET_PATH}")
+    return server
+
+
+def stop_control_server(server):
+    server.closing = True
+    server.shutdown()
+    server.server_close()
+    try:
+        os.remove(CONTROL_SOCKET_PATH)
+    except OSError:
+        pass
+
+
 def int_to_bit_array(n):
     if isinstance(n, int):
         return [int(b) for b in format(n, 'b').zfill(8)]
@@ -143,10 +260,17 @@ def main():
 
     bus = None
     client = None
+    control_server = None
     try:
         bus = can.interface.Bus(interface='socketcan', channel='can0', bitrate=500000)
         print("CAN bus initialized on can0")
 
+        # Local tools send frames through this socket instead of the broker
+        try:
+            control_server = start_control_server(bus)
+        except OSError as e:
+            print(f"Warning: Could not start control socket: {e}")
+
         client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2, protocol=mqtt.MQTTv311, userdata=bus)
         client.on_connect = on_connect
         client.on_subscribe = on_subscribe
@@ -171,6 +295,8 @@ def main():
             # Timeout lets the loop check shutdown_requested periodically
             message = bus.recv(timeout=1.0)
             if message is not None:
+                if control_server:
+                    control_server.dispatch(message)
                 frame_id = message.arbitration_id
                 data = message.data
                 data_length_code = message.dlc
@@ -193,6 +319,8 @@ def main():
         print(f"Error: {e}")
         raise
     finally:
+        if control_server:
+            stop_control_server(control_server)
         if client:
             client.loop_stop()
             client.disconnect()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Client for the CAN command socket served by can-to-mqtt.py.
+
+The bridge keeps the CAN bus open for its whole lifetime, so local tools
+(deploy.sh, trigger_ota_mqtt.py, provision_wifi_mqtt.py) can send frames
+through it in milliseconds instead of starting paho and doing a TLS
+handshake with the broker for every call.
+
+Protocol: newline-delimited JSON over a Unix stream socket. Each request
+is an object with a "cmd" key ("ping", "send" or "listen"); each response
+is {"ok": true, ...} or {"ok": false, "error": "..."}. A "listen" request
+(id, prefix) turns the connection into a stream of matching inbound frames,
+one {"frame": {"id": ..., "data": [...]}} line each, until the client
+closes it.
+
+Usage:
+  can_control.py ping
+  can_control.py ota-trigger <hostname>
+  can_control.py send <can_id> [byte ...]
+
+WiFi credentials go through provision_wifi_mqtt.py, which checks each
+module's acknowledgements.
+"""
+
+import json
+import os
+import socket
+import sys
+import threading
+
+from can_frames import ota_trigger_frame
+
+CONTROL_SOCKET_PATH = os.environ.get('CAN_CONTROL_SOCKET', '/tmp/can-control.sock')
+DEFAULT_TIMEOUT = 10
+
+
+class ControlClient:
+    """Persistent connection to the bridge command socket."""
+
+    def __init__(self, path=CONTROL_SOCKET_PATH, timeout=DEFAULT_TIMEOUT):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(path)
+        except OSError:
+            self.sock.close()
+            raise
+        self.reader = self.sock.makefile('r', encoding='utf-8')
+        self.lock = threading.Lock()
+
+    def request(self, cmd, **params):
+        """Send one command and return the decoded response dict (thread-safe)."""
+        params['cmd'] = cmd
+        with self.lock:
+            self.sock.sendall((json.dumps(params) + '\n').encode('utf-8'))
+            line = self.reader.readline()
+        if not line:
+            raise ConnectionError('Bridge closed the control connection')
+        return json.loads(line)
+
+    def close(self):
+        try:
+            self.reader.close()
+        finally:
+            self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def control_available(path=CONTROL_SOCKET_PATH):
+    """True if the bridge command socket exists (the bridge may still be starting)."""
+    return os.path.exists(path)
+
+
+def send_command(cmd, path=CONTROL_SOCKET_PATH, timeout=DEFAULT_TIMEOUT, **params):
+    """One-shot helper: connect, send a command, return the response dict.
+
+    Raises OSError if the bridge socket is not available.
+    """
+    with ControlClient(path, timeout) as client:
+        return client.request(cmd, **params)
+
+
+def main(argv):
+    if not argv:
+        print(__doc__.strip().split('Usage:')[1], file=sys.stderr)
+        return 1
+
+    command = argv[0]
+    try:
+        if command == 'ping' and len(argv) == 1:
+            response = send_command('ping')
+        elif command == 'ota-trigger' and len(argv) == 2:
+            can_id, data = ota_trigger_frame(argv[1])
+            response = send_command('send', id=can_id, data=data)
+        elif command == 'send' and len(argv) >= 2:
+            response = send_command('send', id=argv[1], data=[int(b, 16) for b in argv[2:]])
+        else:
+            print(f'Unknown command or wrong arguments: {" ".join(argv)}', file=sys.stderr)
+            return 1
+    except (OSError, ValueError) as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return 1
+
+    if not response.get('ok'):
+        print(f'Error: {response.get("error", "unknown error")}', file=sys.stderr)
+        return 1
+    print(json.dumps(response))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+CAN frame encoding shared by the host-side control tools.
+
+Builds the frames for the OTA trigger and WiFi provisioning sequences and
+converts them to/from the bit-array JSON format used on the can/outbound
+and can/inbound MQTT topics (see can-to-mqtt.py and mqtt.js publishCanMessage).
+"""
+
+import math
+
+# CAN IDs
+CAN_OTA_TRIGGER_ID = 0x00
+CAN_WIFI_CONFIG_ID = 0x01
+CAN_DEVICE_ACK_ID = 0x02
+CAN_FIRMWARE_QUERY_ID = 0x03
+
+# Acknowledgement frames sent by modules on CAN_DEVICE_ACK_ID:
+#   [MAC1, MAC2, MAC3, ackedCanId, msgType, index, status, 0]
+# MAC bytes are the last three bytes of the module MAC (same as its hostname),
+# ackedCanId/msgType/index identify the frame being acknowledged.
+ACK_STATUS_OK = 0x00
+
+# msgType values in acknowledgements of CAN_OTA_TRIGGER_ID
+OTA_ACK_TRIGGERED = 0x00  # trigger received, module is rebooting into OTA mode
+OTA_ACK_READY = 0x01      # on WiFi with the OTA listener running
+
+# Modules that support CAN_FIRMWARE_QUERY_ID answer on CAN_DEVICE_ACK_ID with
+#   [MAC1, MAC2, MAC3, 0x03, part, d0, d1, d2]
+# for part 0..FIRMWARE_DIGEST_PARTS-1: the leading bytes of the SHA256 of the
+# running app image (esp_partition_get_sha256 of the running partition).
+FIRMWARE_DIGEST_PARTS = 3
+FIRMWARE_DIGEST_BYTES_PER_PART = 3
+
+# WiFi provisioning message types (first data byte of CAN_WIFI_CONFIG_ID frames)
+WIFI_MSG_START = 0x01
+WIFI_MSG_SSID = 0x02
+WIFI_MSG_PASSWORD = 0x03
+WIFI_MSG_END = 0x04
+
+BYTES_PER_CHUNK = 6  # 8-byte CAN frame minus 2-byte header (type + index)
+MAX_SSID_LENGTH = 32
+MAX_PASSWORD_LENGTH = 63
+
+
+def byte_to_bit_array(byte_val):
+    """Convert a byte (0-255) to an array of 8 bits (MSB first)"""
+    bits = []
+    for i in range(7, -1, -1):
+        bits.append((byte_val >> i) & 1)
+    return bits
+
+
+def bit_array_to_byte(bit_array):
+    """Convert an array of 8 bits (MSB first) back to a byte value"""
+    byte_val = 0
+    for i, bit in enumerate(bit_array):
+        byte_val |= (bit << (7 - i))
+    return byte_val
+
+
+def build_outbound_message(can_id, data_bytes):
+    """Build a can/outbound message dict (matches mqtt.js publishCanMessage)"""
+    bit_arrays = [byte_to_bit_array(b) for b in data_bytes]
+
+    # Pad to 8 bytes
+    while len(bit_arrays) < 8:
+        bit_arrays.append([0, 0, 0, 0, 0, 0, 0, 0])
+
+    return {
+        'identifier': f'0x{can_id:x}',
+        'data_length_code': min(len(data_bytes), 8),
+        'data': bit_arrays[:8],
+        'extd': 0,
+        'rtr': 0,
+        'ss': 0,
+        'self': 0
+    }
+
+
+def decode_inbound_message(message):
+    """Decode a can/inbound message dict (from can-to-mqtt.py) into (can_id, data bytes)"""
+    data = [bit_array_to_byte(bits) for bits in message['data']]
+    return int(message['identifier'], 16), data[:message['data_length_code']]
+
+
+def parse_can_id(value):
+    """Accept a CAN ID as an int or a hex string ('0x15' / '15')."""
+    if isinstance(value, int):
+        return value
+    return int(str(value), 16)
+
+
+def extract_mac_from_hostname(hostname):
+    """Extract MAC bytes from esp32-XXXXXX hostname"""
+    # hostname format: esp32-8F56D8 (last 6 hex chars are MAC bytes)
+    mac_hex = hostname.replace('esp32-', '')
+    if len(mac_hex) != 6:
+        raise ValueError(f'Invalid hostname format: {hostname}')
+
+    # Convert to 3 bytes
+    return [
+        int(mac_hex[0:2], 16),
+        int(mac_hex[2:4], 16),
+        int(mac_hex[4:6], 16)
+    ]
+
+
+def hostname_from_mac(mac_bytes):
+    """Inverse of extract_mac_from_hostname: [0x8F, 0x56, 0xD8] -> 'esp32-8F56D8'"""
+    return 'esp32-' + ''.join(f'{b:02X}' for b in mac_bytes)
+
+
+def parse_device_ack(data):
+    """Decode a CAN_DEVICE_ACK_ID payload into a dict (None if too short)."""
+    if len(data) < 7:
+        return None
+    return {
+        'hostname': hostname_from_mac(data[0:3]),
+        'can_id': data[3],
+        'msg_type': data[4],
+        'index': data[5],
+        'status': data[6],
+        'ok': data[6] == ACK_STATUS_OK
+    }
+
+
+def ota_trigger_frame(hostname):
+    """Return (can_id, data) for the OTA trigger: [MAC1, MAC2, MAC3, 0, 0, 0, 0, 0]"""
+    return CAN_OTA_TRIGGER_ID, extract_mac_from_hostname(hostname) + [0x00] * 5
+
+
+def firmware_query_frame(hostname):
+    """Return (can_id, data) for the running firmware query: [MAC1, MAC2, MAC3, 0, 0, 0, 0, 0]"""
+    return CAN_FIRMWARE_QUERY_ID, extract_mac_from_hostname(hostname) + [0x00] * 5
+
+
+def parse_firmware_digest_part(data):
+    """Decode a firmware query reply into (hostname, part, digest bytes); None if it is not one."""
+    if len(data) < 8 or data[3] != CAN_FIRMWARE_QUERY_ID:
+        return None
+    return hostname_from_mac(data[0:3]), data[4], bytes(data[5:8])
+
+
+def wifi_credential_frames(ssid, password):
+    """Build the WiFi provisioning sequence as a list of 8-byte payloads.
+
+    Start (0x01) -> SSID chunks (0x02) -> Password chunks (0x03) -> End (0x04),
+    matching mqtt.js publishWifiCredentials. Raises ValueError if the SSID or
+    password is too long for the protocol.
+    """
+    ssid_bytes = ssid.encode('utf-8')
+    password_bytes = password.encode('utf-8')
+
+    if len(ssid_bytes) > MAX_SSID_LENGTH:
+        raise ValueError(f'SSID too long (max {MAX_SSID_LENGTH} bytes)')
+    if len(password_bytes) > MAX_PASSWORD_LENGTH:
+        raise ValueError(f'Password too long (max {MAX_PASSWORD_LENGTH} bytes)')
+
+    ssid_chunks = math.ceil(len(ssid_bytes) / BYTES_PER_CHUNK)
+    password_chunks = math.ceil(len(password_bytes) / BYTES_PER_CHUNK)
+
+    # 1. Start message: [0x01, ssidLen, passwordLen, ssidChunks, passwordChunks, 0, 0, 0]
+    frames = [[WIFI_MSG_START, len(ssid_bytes), len(password_bytes),
+               ssid_chunks, password_chunks, 0x00, 0x00, 0x00]]
+
+    # 2/3. SSID and password chunks: [type, chunkIndex, ...up to 6 data bytes]
+    for msg_type, payload, count in ((WIFI_MSG_SSID, ssid_bytes, ssid_chunks),
+                                     (WIFI_MSG_PASSWORD, password_bytes, password_chunks)):
+        for i in range(count):
+            chunk = [msg_type, i]
+            start = i * BYTES_PER_CHUNK
+            chunk.extend(payload[start:start + BYTES_PER_CHUNK])
+            while len(chunk) < 8:
+                chunk.append(0x00)
+            frames.append(chunk)
+
+    # 4. End message with XOR checksum: [0x04, checksum, 0, 0, 0, 0, 0, 0]
+    checksum = 0
+    for b in ssid_bytes + password_bytes:
+        checksum ^= b
+    frames.append([WIFI_MSG_END, checksum, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
+
+    return frames
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Transports for sending CAN frames from host-side tools.
+
+  can    - open can0 directly through SocketCAN (python-can); no broker,
+           no bridge, works even while Docker services are down
+  bridge - the command socket served by can-to-mqtt.py (see can_control.py)
+  mqtt   - publish to can/outbound via the broker (original path, kept as
+           the fallback)
+
+Every transport can also listen for inbound frames, which the tools use to
+wait for module acknowledgements (see CAN_DEVICE_ACK_ID in can_frames.py).
+Listeners must be opened before the frame they are waiting on is sent.
+
+load_mqtt_settings() reads the broker settings for the MQTT path from
+local_code/.env (the same file can-to-mqtt.py uses).
+"""
+
+import json
+import os
+import queue
+import re
+import ssl
+import sys
+import threading
+
+from can_frames import build_outbound_message, decode_inbound_message
+from can_control import CONTROL_SOCKET_PATH, ControlClient, control_available
+
+CAN_CHANNEL = os.environ.get('CAN_CHANNEL', 'can0')
+TRANSPORT_MODES = ('auto', 'can', 'bridge', 'mqtt')
+ENV_PATH = os.path.join(os.path.dirname(__file__), '.env')
+MQTT_CA_CERT_PATH = os.path.join(os.path.dirname(__file__), 'ca.pem')
+
+
+def load_mqtt_settings(env_path=ENV_PATH):
+    """MqttTransport keyword arguments from MQTT_BROKER_URL/_USERNAME/_PASSWORD. Raises ValueError."""
+    from dotenv import load_dotenv
+    load_dotenv(env_path)
+    broker_url = os.getenv('MQTT_BROKER_URL', 'mqtts://mosquitto:8883')
+    # Format: mqtts://hostname:port or mqtt://hostname:port
+    match = re.match(r'(mqtts?)://([^:]+):(\d+)', broker_url)
+    if not match:
+        raise ValueError(f'Invalid MQTT_BROKER_URL format: {broker_url}')
+    return {
+        'host': match.group(2),
+        'port': int(match.group(3)),
+        'username': os.getenv('MQTT_USERNAME'),
+        'password': os.getenv('MQTT_PASSWORD'),
+        'use_tls': match.group(1) == 'mqtts',
+        'ca_certs': MQTT_CA_CERT_PATH
+    }
+
+
+class FrameListener:
+    """Queue of inbound frames whose ID and leading data bytes match a filter."""
+
+    def __init__(self, can_id, prefix=None, on_close=None):
+        self.can_id = can_id
+        self.prefix = list(prefix or [])
+        self.frames = queue.Queue()
+        self._on_close = on_close
+
+    def matches(self, can_id, data):
+        return can_id == self.can_id and list(data[:len(self.prefix)]) == self.prefix
+
+    def get(self, timeout):
+        """Next matching (can_id, data) tuple, or None after timeout seconds."""
+        try:
+            return self.frames.get(timeout=max(timeout, 0))
+        except queue.Empty:
+            return None
+
+    def close(self):
+        if self._on_close:
+            self._on_close(self)
+            self._on_close = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class CanTransport:
+    """Base class: listener bookkeeping shared by all transports."""
+
+    name = 'base'
+
+    def __init__(self):
+        self._listeners = []
+        self._listeners_lock = threading.Lock()
+
+    def listen(self, can_id, prefix=None):
+        listener = FrameListener(can_id, prefix, on_close=self._remove_listener)
+        with self._listeners_lock:
+            self._listeners.append(listener)
+        return listener
+
+    def _remove_listener(self, listener):
+        with self._listeners_lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def _dispatch(self, can_id, data):
+        with self._listeners_lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            if listener.matches(can_id, data):
+                listener.frames.put((can_id, list(data)))
+
+    def send(self, can_id, data_bytes):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class SocketCanTransport(CanTransport):
+    """Talk to the bus directly. SocketCAN allows this alongside can-to-mqtt.py."""
+
+    name = 'can'
+
+    def __init__(self, channel=CAN_CHANNEL):
+        super().__init__()
+        import can
+        self._can = can
+        self.bus = can.interface.Bus(interface='socketcan', channel=channel)
+        self._closed = threading.Event()
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    def _read_loop(self):
+        while not self._closed.is_set():
+            try:
+                message = self.bus.recv(timeout=0.2)
+            except Exception:
+                if self._closed.is_set():
+                    return
+                raise
+            if message is not None and not message.is_error_frame:
+                self._dispatch(message.arbitration_id, message.data)
+
+    def send(self, can_id, data_bytes):
+        self.bus.send(self._can.Message(arbitration_id=can_id, data=bytes(data_bytes[:8]),
+                                        is_extended_id=False))
+
+    def close(self):
+        self._closed.set()
+        self._reader.join(timeout=1)
+        self.bus.shutdown()
+
+
+class BridgeTransport(CanTransport):
+    """Send through the can-to-mqtt.py command socket."""
+
+    name = 'bridge'
+
+    def __init__(self, path=CONTROL_SOCKET_PATH):
+        super().__init__()
+        self.path = path
+        self.client = ControlClient(path)
+        if not self.client.request('ping').get('ok'):
+            self.client.close()
+            raise ConnectionError('Bridge did not answer ping')
+
+    def listen(self, can_id, prefix=None):
+        # Each listener gets its own connection; the bridge streams matching
+        # frames on it as {"frame": {"id": ..., "data": [...]}} lines.
+        listener = super().listen(can_id, prefix)
+        stream = ControlClient(self.path, timeout=None)
+        response = stream.request('listen', id=can_id, prefix=listener.prefix)
+        if not response.get('ok'):
+            stream.close()
+            listener.close()
+            raise ConnectionError(response.get('error', 'Bridge rejected listen request'))
+
+        def reader():
+            try:
+                for line in stream.reader:
+                    frame = json.loads(line).get('frame')
+                    if frame:
+                        listener.frames.put((frame['id'], frame['data']))
+            except (OSError, ValueError):
+                pass
+
+        def close_stream(closed_listener):
+            self._remove_listener(closed_listener)
+            try:
+                stream.sock.shutdown(2)
+            except OSError:
+                pass
+            stream.close()
+
+        listener._on_close = close_stream
+        threading.Thread(target=reader, daemon=True).start()
+        return listener
+
+    def send(self, can_id, data_bytes):
+        response = self.client.request('send', id=can_id, data=list(data_bytes))
+        if not response.get('ok'):
+            raise ConnectionError(response.get('error', 'Bridge rejected frame'))
+
+    def close(self):
+        self.client.close()
+
+
+class MqttTransport(CanTransport):
+    """Publish to can/outbound and listen on can/inbound through the broker."""
+
+    name = 'mqtt'
+    OUTBOUND_TOPIC = 'can/outbound'
+    INBOUND_TOPIC = 'can/inbound'
+
+    def __init__(self, host, port, username, password, use_tls=True, ca_certs=None, timeout=10):
+        super().__init__()
+        import paho.mqtt.client as mqtt
+
+        self.client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2, protocol=mqtt.MQTTv311)
+        self.client.username_pw_set(username, password)
+        if use_tls:
+            self.client.tls_set(
+                ca_certs=ca_certs,
+                certfile=None,
+                keyfile=None,
+                cert_reqs=ssl.CERT_REQUIRED,
+                tls_version=ssl.PROTOCOL_TLSv1_2
+            )
+
+        subscribed = threading.Event()
+
+        def on_connect(client, userdata, flags, reason_code, properties):
+            if reason_code == 0:
+                client.subscribe(self.INBOUND_TOPIC)
+
+        def on_subscribe(client, userdata, mid, reason_code_list, properties):
+            subscribed.set()
+
+        def on_message(client, userdata, msg):
+            try:
+                can_id, data = decode_inbound_message(json.loads(msg.payload.decode('utf-8')))
+            except (ValueError, KeyError, TypeError):
+                return
+            self._dispatch(can_id, data)
+
+        self.client.on_connect = on_connect
+        self.client.on_subscribe = on_subscribe
+        self.client.on_message = on_message
+        self.client.connect(host, port, 60)
+        self.client.loop_start()
+        if not subscribed.wait(timeout):
+            self.close()
+            raise ConnectionError(f'Timed out connecting to MQTT broker {host}:{port}')
+
+    def send(self, can_id, data_bytes):
+        info = self.client.publish(self.OUTBOUND_TOPIC, json.dumps(build_outbound_message(can_id, data_bytes)))
+        info.wait_for_publish(timeout=5)
+
+    def close(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+
+def socketcan_available(channel=CAN_CHANNEL):
+    return os.path.isdir(f'/sys/class/net/{channel}')
+
+
+def open_transport(mode='auto', mqtt_settings=None):
+    """Open a transport by name. 'auto' tries can -> bridge -> mqtt.
+
+    mqtt_settings is a dict of MqttTransport keyword arguments, or a function
+    returning one (such as load_mqtt_settings) that is only called when the
+    MQTT path is used.
+    """
+    if mode not in TRANSPORT_MODES:
+        raise ValueError(f'Unknown transport: {mode}')
+
+    def mqtt_transport():
+        return MqttTransport(**(mqtt_settings() if callable(mqtt_settings) else mqtt_settings or {}))
+
+    if mode == 'can':
+        return SocketCanTransport()
+    if mode == 'bridge':
+        return BridgeTransport()
+    if mode == 'mqtt':
+        return mqtt_transport()
+
+    if socketcan_available():
+        try:
+            return SocketCanTransport()
+        except Exception as e:
+            print(f'SocketCAN unavailable ({e}), trying bridge', file=sys.stderr)
+    if control_available():
+        try:
+            return BridgeTransport()
+        except Exception as e:
+            print(f'Bridge control socket unavailable ({e}), falling back to MQTT', file=sys.stderr)
+    if mqtt_settings is None:
+        raise ConnectionError('No CAN transport available')
+    return mqtt_transport()
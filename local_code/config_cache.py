@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Encrypted local snapshot of the cloud configuration, used by deployment-watcher.py.
+
+Reading the cloud config means `docker compose ps` plus `docker exec ... node`
+in the backend container, which opens a MongoDB connection: seconds of CPU
+on a Pi. The watcher keeps the last result in a file instead and reads
+MongoDB again only when the config version changes. The backend publishes
+that version (a SHA256 over the stored cloud fields) on
+local/config/cloud_updated, retained, so it is also known at startup.
+
+The snapshot holds the MQTT password and API key, so it is encrypted and
+authenticated (Fernet) with a key derived from ENCRYPTION_KEY, the key that
+protects the same secrets in MongoDB. It needs the `cryptography` package;
+without it, or without ENCRYPTION_KEY, nothing is cached and every refresh
+reads MongoDB as before.
+
+Usage:
+  config_cache.py [FILE]      # print the cached config version (not the secrets)
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import tempfile
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
+CACHE_FILE = os.path.join(os.path.expanduser('~'), '.deployment-watcher-config')
+KEY_CONTEXT = b'trailcurrent deployment-watcher cloud config snapshot'
+
+
+def snapshot_key(encryption_key):
+    """Fernet key for the snapshot, derived from ENCRYPTION_KEY (64 hex chars). Raises ValueError."""
+    secret = bytes.fromhex(encryption_key)
+    if len(secret) != 32:
+        raise ValueError("ENCRYPTION_KEY must be 64 hex characters")
+    return base64.urlsafe_b64encode(hmac.new(secret, KEY_CONTEXT, hashlib.sha256).digest())
+
+
+class ConfigCache:
+    """load()/save() the cloud config dict in path; both are no-ops when disabled."""
+
+    def __init__(self, path=CACHE_FILE, encryption_key=None, log=print):
+        self.path = path
+        self.log = log
+        self.fernet = None
+        if Fernet is None:
+            log("Python package 'cryptography' not installed, cloud config is not cached")
+        elif not encryption_key:
+            log("ENCRYPTION_KEY not set, cloud config is not cached")
+        else:
+            try:
+                self.fernet = Fernet(snapshot_key(encryption_key))
+            except ValueError as e:
+                log(f"Cloud config is not cached: {e}")
+
+    @property
+    def enabled(self):
+        return self.fernet is not None
+
+    def load(self):
+        """The cached config, or None if there is none or it cannot be decrypted."""
+        if not self.enabled:
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                token = f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            self.log(f"Cannot read cloud config snapshot: {e}")
+            return None
+        try:
+            config = json.loads(self.fernet.decrypt(token))
+        except (InvalidToken, ValueError):
+            # Written with another ENCRYPTION_KEY, or damaged
+            self.log("Discarding cloud config snapshot that does not decrypt")
+            self.clear()
+            return None
+        return config if isinstance(config, dict) else None
+
+    def save(self, config):
+        """Replace the snapshot with config (a dict), readable only by this user."""
+        if not self.enabled:
+            return
+        token = self.fernet.encrypt(json.dumps(config).encode())
+        try:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix='.config-')
+            with os.fdopen(fd, 'wb') as f:  # mkstemp creates it with mode 0600
+                f.write(token)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            self.log(f"Cannot write cloud config snapshot: {e}")
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def main(args):
+    path = args[0] if args else CACHE_FILE
+    cache = ConfigCache(path, os.environ.get('ENCRYPTION_KEY'), log=lambda msg: print(msg, file=sys.stderr))
+    if not cache.enabled:
+        return 2
+    config = cache.load()
+    if config is None:
+        print(f"No cloud config snapshot in {path}", file=sys.stderr)
+        return 1
+    print(f"version={config.get('version') or 'unknown'} cloud_enabled={config.get('cloud_enabled')} "
+          f"cloud_url={config.get('cloud_url')}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
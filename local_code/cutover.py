@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+When a staged deployment may cut over, used by deployment-watcher.py.
+
+The watcher downloads, verifies, extracts and pre-loads the Docker images of
+a release while the current one keeps running; only the cut-over (deploy.sh)
+interrupts services. CutoverPolicy holds that cut-over back until:
+
+  - the local time is inside the maintenance window (DEPLOYMENT_WINDOW,
+    "HH:MM-HH:MM", may wrap past midnight; empty = any time), and
+  - with DEPLOYMENT_REQUIRE_PARKED=yes, the vehicle is parked: the last
+    GNSS speed over ground on local/gps/details is at most
+    DEPLOYMENT_PARKED_SPEED. Without a GNSS reading for STALE_AFTER seconds
+    (no module fitted, or it is powered down) the vehicle counts as parked.
+
+Usage:
+  cutover.py --window 02:00-05:00   # print whether a cut-over may start now
+"""
+
+import argparse
+import re
+import sys
+import threading
+import time
+
+GPS_DETAILS_TOPIC = 'local/gps/details'
+DEFAULT_PARKED_SPEED = 1.0
+STALE_AFTER = 300.0
+CHECK_INTERVAL = 30.0
+
+
+def parse_window(text):
+    """'HH:MM-HH:MM' -> (start_minute, end_minute); None for an empty window. Raises ValueError."""
+    if not text or not text.strip():
+        return None
+    match = re.fullmatch(r'\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*', text)
+    if not match:
+        raise ValueError(f"invalid window {text!r}, expected HH:MM-HH:MM")
+    hours_a, minutes_a, hours_b, minutes_b = (int(g) for g in match.groups())
+    if hours_a > 23 or hours_b > 23 or minutes_a > 59 or minutes_b > 59:
+        raise ValueError(f"invalid window {text!r}")
+    return hours_a * 60 + minutes_a, hours_b * 60 + minutes_b
+
+
+def in_window(window, now=None):
+    """True if the local time now (a struct_time) falls inside window."""
+    if window is None:
+        return True
+    now = now or time.localtime()
+    minute = now.tm_hour * 60 + now.tm_min
+    start, end = window
+    if start <= end:
+        return start <= minute < end
+    return minute >= start or minute < end  # wraps past midnight
+
+
+class CutoverPolicy:
+    """Maintenance window and parked check; update_gps() is fed from the local MQTT broker."""
+
+    def __init__(self, window=None, require_parked=False, parked_speed=DEFAULT_PARKED_SPEED,
+                 stale_after=STALE_AFTER, log=print):
+        self.window = parse_window(window) if isinstance(window, str) else window
+        self.window_text = window if isinstance(window, str) else None
+        self.require_parked = require_parked
+        self.parked_speed = parked_speed
+        self.stale_after = stale_after
+        self.log = log
+        self._speed = None
+        self._speed_at = 0.0
+        self._changed = threading.Event()
+
+    def update_gps(self, payload):
+        """Record the speed from a local/gps/details payload (dict)."""
+        speed = payload.get('speedOverGround') if isinstance(payload, dict) else None
+        if isinstance(speed, (int, float)):
+            parked_before = self._parked()
+            self._speed = float(speed)
+            self._speed_at = time.monotonic()
+            if self._parked() != parked_before:
+                self._changed.set()
+
+    def interrupt(self):
+        """Wake wait() so it re-checks should_stop() now."""
+        self._changed.set()
+
+    def _parked(self):
+        if self._speed is None or time.monotonic() - self._speed_at > self.stale_after:
+            return True
+        return self._speed <= self.parked_speed
+
+    def blocked_reason(self, now=None):
+        """Why a cut-over may not start now, or None if it may."""
+        if not in_window(self.window, now):
+            return f"outside maintenance window {self.window_text or self.window}"
+        if self.require_parked and not self._parked():
+            return f"vehicle moving ({self._speed:.1f} > {self.parked_speed:.1f})"
+        return None
+
+    def wait(self, should_stop, interval=CHECK_INTERVAL):
+        """Block until a cut-over may start. Returns False if should_stop() became true first."""
+        reported = None
+        started = time.monotonic()
+        while not should_stop():
+            reason = self.blocked_reason()
+            if reason is None:
+                if reported:
+                    self.log(f"Cut-over allowed after waiting {time.monotonic() - started:.0f}s")
+                return True
+            if reason != reported:
+                self.log(f"Cut-over deferred: {reason}")
+                reported = reason
+            self._changed.wait(interval)
+            self._changed.clear()
+        return False
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Check whether a deployment cut-over may start now.')
+    parser.add_argument('--window', default='', help='Maintenance window HH:MM-HH:MM (local time).')
+    options = parser.parse_args(args)
+    try:
+        policy = CutoverPolicy(options.window)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    reason = policy.blocked_reason()
+    print(reason or "cut-over allowed now")
+    return 1 if reason else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+Content-addressed deployment packages, used by deployment-watcher.py.
+
+create-deployment-package.sh --delta publishes the package tree as a
+manifest plus blobs named by their SHA256:
+
+  {"version": 1,
+   "files": [{"path": "images/backend.tar", "size": 52430336, "mode": 420, "sha256": "<file>",
+              "chunks": [["<sha256>", 1536], ["<sha256>", 52428800], ...]}]}
+
+Each file is the concatenation of its chunks. Ordinary files are one chunk;
+tar files (the docker save tarballs in images/) are cut at member
+boundaries, so every image layer is its own blob and a layer the running
+release already has is not downloaded again.
+
+The local content store is the installed release itself plus STORE_DIR:
+the watcher indexes the files installed in ~ (hashing them once; the index
+in STORE_DIR/installed.json lets later deployments skip files whose size and
+mtime did not change), fetches only the blobs no installed file holds into
+STORE_DIR/blobs (resumable, see package_download.py), and reconstructs the
+package tree in the staging directory, checking every chunk and every file
+against its digest. Once the tree is installed the downloaded blobs are
+redundant and are removed, so the store never holds a second copy of a release.
+
+Usage:
+  delta_package.py build TREE OUTPUT_DIR          # write OUTPUT_DIR/manifest.json and OUTPUT_DIR/blobs/
+  delta_package.py plan MANIFEST [--installed ~]  # what a deployment would download
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import stat
+import sys
+import tarfile
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from package_download import DownloadError, PackageDownload
+
+MANIFEST_VERSION = 1
+STORE_DIR = os.path.join(os.path.expanduser('~'), '.deployment-store')
+INDEX_FILE = 'installed.json'
+COPY_BLOCK = 1024 * 1024
+BLOB_FETCHES = 4  # blobs downloaded in parallel
+
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class DeltaError(DownloadError):
+    """The delta package is invalid or could not be reconstructed."""
+
+
+def _copy(src, dst, length, *hashes):
+    """Copy length bytes from src to dst (None: only read them). Returns their SHA256."""
+    chunk_hash = hashlib.sha256()
+    remaining = length
+    while remaining:
+        block = src.read(min(COPY_BLOCK, remaining))
+        if not block:
+            raise DeltaError(f"{getattr(src, 'name', 'source')} ended {remaining} bytes early")
+        chunk_hash.update(block)
+        for h in hashes:
+            h.update(block)
+        if dst:
+            dst.write(block)
+        remaining -= len(block)
+    return chunk_hash.hexdigest()
+
+
+def chunk_spans(path, size):
+    """The (offset, length) pieces a file is split into: tar member data, or the whole file."""
+    if size == 0:
+        return []
+    if path.endswith('.tar'):
+        try:
+            spans, position = [], 0
+            with tarfile.open(path, 'r:') as tar:
+                for member in tar:
+                    if member.isreg() and not member.issparse() and member.size:
+                        spans.append((position, member.offset_data - position))  # headers and padding
+                        spans.append((member.offset_data, member.size))
+                        position = member.offset_data + member.size
+            if position < size:
+                spans.append((position, size - position))
+            if position <= size and all(length > 0 for _, length in spans):
+                return spans
+        except (tarfile.TarError, OSError):
+            pass
+    return [(0, size)]
+
+
+def hash_file(path):
+    """Returns (file SHA256, [[chunk SHA256, length], ...]), reading the file once."""
+    file_hash = hashlib.sha256()
+    chunks = []
+    with open(path, 'rb') as f:
+        for _, length in chunk_spans(path, os.fstat(f.fileno()).st_size):
+            chunks.append([_copy(f, None, length, file_hash), length])
+    return file_hash.hexdigest(), chunks
+
+
+def validate_manifest(manifest):
+    """Raise DeltaError unless manifest is a well-formed version 1 manifest with safe paths."""
+    if not isinstance(manifest, dict) or manifest.get('version') != MANIFEST_VERSION:
+        raise DeltaError(f"unsupported manifest version {manifest.get('version') if isinstance(manifest, dict) else None}")
+    for entry in manifest.get('files', []):
+        path = entry.get('path', '')
+        normalized = os.path.normpath(path)
+        if not path or os.path.isabs(path) or normalized in ('.', '..') or normalized.startswith('..' + os.sep):
+            raise DeltaError(f"unsafe path in manifest: {path!r}")
+        chunks = entry.get('chunks', [])
+        if not SHA256_PATTERN.match(entry.get('sha256', '')) or \
+                any(not SHA256_PATTERN.match(sha) or length <= 0 for sha, length in chunks) or \
+                sum(length for _, length in chunks) != entry.get('size'):
+            raise DeltaError(f"invalid manifest entry for {path}")
+
+
+def build(tree, output_dir, log=print):
+    """Write output_dir/manifest.json and the blobs of every file under tree. Returns the manifest."""
+    blob_dir = os.path.join(output_dir, 'blobs')
+    os.makedirs(blob_dir, exist_ok=True)
+    files = []
+    for root, dirs, names in os.walk(tree):
+        dirs.sort()
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, tree).replace(os.sep, '/')
+            file_hash = hashlib.sha256()
+            chunks = []
+            with open(path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                for _, length in chunk_spans(path, st.st_size):
+                    fd, tmp = tempfile.mkstemp(dir=blob_dir, prefix='.blob-')
+                    with os.fdopen(fd, 'wb') as out:
+                        sha = _copy(f, out, length, file_hash)
+                    if os.path.exists(os.path.join(blob_dir, sha)):
+                        os.remove(tmp)
+                    else:
+                        os.replace(tmp, os.path.join(blob_dir, sha))
+                    chunks.append([sha, length])
+            files.append({'path': rel, 'size': st.st_size, 'mode': stat.S_IMODE(st.st_mode),
+                          'sha256': file_hash.hexdigest(), 'chunks': chunks})
+
+    manifest = {'version': MANIFEST_VERSION, 'files': files}
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    blobs = {sha: length for entry in files for sha, length in entry['chunks']}
+    log(f"{len(files)} files, {len(blobs)} blobs ({sum(blobs.values())} bytes) in {output_dir}")
+    return manifest
+
+
+class DeltaPackage:
+    """One delta deployment; run() fetches the missing blobs and rebuilds the package tree."""
+
+    def __init__(self, manifest_url, expected_sha256, blob_url, headers=None, segments=1, store_dir=STORE_DIR,
+                 progress=None, log=print, throttle=None, should_stop=None):
+        self.manifest_url = manifest_url
+        self.expected_sha256 = expected_sha256.lower()
+        self.blob_url = blob_url.rstrip('/')
+        self.headers = dict(headers or {})
+        self.segments = segments
+        self.store_dir = store_dir
+        self.blob_dir = os.path.join(store_dir, 'blobs')
+        self.partial_dir = os.path.join(store_dir, 'partial')
+        self.index_path = os.path.join(store_dir, INDEX_FILE)
+        self.progress = progress
+        self.log = log
+        self.throttle = throttle  # passed to every PackageDownload, with should_stop
+        self.should_stop = should_stop
+        self.manifest = None
+        self.stats = {'files': 0, 'size': 0, 'reused_bytes': 0, 'downloaded_bytes': 0, 'blobs_downloaded': 0}
+        self._sources = {}  # chunk sha256 -> (path, offset) in an installed file
+
+    def _blob_path(self, sha):
+        return os.path.join(self.blob_dir, sha)
+
+    def _download(self, url, sha, size, dest, progress=None):
+        PackageDownload(url, sha, size, self.headers, self.segments, self.partial_dir,
+                        progress=progress, log=self.log, exclusive=False, throttle=self.throttle,
+                        should_stop=self.should_stop).run(dest)
+
+    # --- manifest and index ---
+
+    def fetch_manifest(self):
+        path = os.path.join(self.store_dir, f'manifest-{self.expected_sha256}.json')
+        if not os.path.exists(path):
+            self._download(self.manifest_url, self.expected_sha256, 0, path)
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+        except ValueError as e:
+            os.remove(path)
+            raise DeltaError(f"unreadable manifest: {e}")
+        validate_manifest(manifest)
+        self.manifest = manifest
+        return manifest
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            self.log(f"Ignoring unreadable content index {self.index_path}: {e}")
+            return {}
+        return index if isinstance(index, dict) else {}
+
+    def index_installed(self, installed_dir):
+        """Register the chunks that files installed in installed_dir (the running release) hold."""
+        index = self._load_index()
+        for rel in sorted({entry['path'] for entry in self.manifest['files']} | set(index)):
+            path = os.path.join(installed_dir, rel)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            known = index.get(rel)
+            if known and known.get('size') == st.st_size and known.get('mtime_ns') == st.st_mtime_ns:
+                chunks = known['chunks']
+            else:
+                if st.st_size >= 64 * COPY_BLOCK:
+                    self.log(f"Indexing installed {rel} ({st.st_size} bytes)...")
+                try:
+                    _, chunks = hash_file(path)
+                except (OSError, DeltaError) as e:
+                    self.log(f"Could not index installed {rel}: {e}")
+                    continue
+            offset = 0
+            for sha, length in chunks:
+                self._sources.setdefault(sha, (path, offset))
+                offset += length
+
+    def missing(self):
+        """{sha256: length} of the blobs neither installed files nor the store hold."""
+        needed = {}
+        for entry in self.manifest['files']:
+            for sha, length in entry['chunks']:
+                if sha not in self._sources and not os.path.exists(self._blob_path(sha)):
+                    needed[sha] = length
+        return needed
+
+    def _prune(self, keep=()):
+        """Remove stored blobs and partial downloads not in keep."""
+        for directory, suffixes in ((self.blob_dir, ('',)), (self.partial_dir, ('.part', '.part.json'))):
+            if not os.path.isdir(directory):
+                continue
+            keep_names = {sha + suffix for sha in keep for suffix in suffixes}
+            for entry in os.listdir(directory):
+                if entry not in keep_names:
+                    try:
+                        os.remove(os.path.join(directory, entry))
+                    except OSError:
+                        pass
+
+    # --- download and reconstruction ---
+
+    def _download_blobs(self, needed):
+        total = sum(needed.values())
+        received = {}
+        lock = threading.Lock()
+
+        def reporter(sha):
+            def progress(done, _size):
+                with lock:
+                    received[sha] = done
+                    if self.progress:
+                        self.progress(sum(received.values()), total)
+            return progress
+
+        with ThreadPoolExecutor(BLOB_FETCHES) as pool:
+            futures = [pool.submit(self._download, f"{self.blob_url}/{sha}", sha, length, self._blob_path(sha),
+                                   reporter(sha)) for sha, length in needed.items()]
+            for future in futures:
+                future.result()  # raises the first failure; finished blobs stay in the store
+        self.stats['downloaded_bytes'] += total
+        self.stats['blobs_downloaded'] += len(needed)
+
+    def _write_chunk(self, out, sha, length, file_hash):
+        """Append a chunk to out from the store or an installed file. Returns the updated file hash."""
+        source = self._sources.get(sha)
+        if source and not os.path.exists(self._blob_path(sha)):
+            start = out.tell()
+            saved = file_hash.copy()
+            try:
+                with open(source[0], 'rb') as f:
+                    f.seek(source[1])
+                    if _copy(f, out, length, file_hash) == sha:
+                        self.stats['reused_bytes'] += length
+                        return file_hash
+            except (OSError, DeltaError):
+                pass
+            self.log(f"Installed copy of chunk {sha[:12]} changed, downloading it")
+            out.seek(start)
+            out.truncate()
+            file_hash = saved
+            del self._sources[sha]
+            self._download_blobs({sha: length})
+
+        with open(self._blob_path(sha), 'rb') as f:
+            if _copy(f, out, length, file_hash) != sha:
+                os.remove(self._blob_path(sha))
+                raise DeltaError(f"stored blob {sha} is corrupt")
+        return file_hash
+
+    def reconstruct(self, staging_dir):
+        """Rebuild the package tree in staging_dir, verifying every file."""
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        os.makedirs(staging_dir)
+        for entry in self.manifest['files']:
+            dest = os.path.join(staging_dir, entry['path'])
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            file_hash = hashlib.sha256()
+            with open(dest, 'wb') as out:
+                for sha, length in entry['chunks']:
+                    file_hash = self._write_chunk(out, sha, length, file_hash)
+            if file_hash.hexdigest() != entry['sha256']:
+                raise DeltaError(f"reconstructed {entry['path']} does not match its SHA256")
+            os.chmod(dest, entry.get('mode', 0o644) & 0o777)
+            self.stats['files'] += 1
+            self.stats['size'] += entry['size']
+
+    def run(self, staging_dir, installed_dir):
+        """Fetch the manifest and missing blobs, rebuild the tree in staging_dir. Returns stats."""
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self.fetch_manifest()
+        self.index_installed(installed_dir)
+        needed = self.missing()
+        wanted = {sha for entry in self.manifest['files'] for sha, _ in entry['chunks']}
+        self._prune(keep=wanted)  # blobs left over from other deployments
+
+        size = sum(entry['size'] for entry in self.manifest['files'])
+        self.log(f"Delta package: {len(self.manifest['files'])} files ({size} bytes), "
+                 f"{len(needed)} blobs ({sum(needed.values())} bytes) to download")
+        self._download_blobs(needed)
+        self.reconstruct(staging_dir)
+        return self.stats
+
+    def installed(self, dest_dir):
+        """Record the installed tree as the content source for the next deployment and drop the blobs."""
+        index = {}
+        for entry in self.manifest['files']:
+            try:
+                st = os.stat(os.path.join(dest_dir, entry['path']))
+            except OSError:
+                continue
+            index[entry['path']] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'chunks': entry['chunks']}
+        fd, tmp = tempfile.mkstemp(dir=self.store_dir, prefix='.index-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, self.index_path)
+        self._prune()
+        for entry in os.listdir(self.store_dir):
+            if entry.startswith('manifest-'):
+                os.remove(os.path.join(self.store_dir, entry))
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Build or inspect content-addressed deployment packages.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build', help='Write a manifest and blobs for a package tree.')
+    build_parser.add_argument('tree')
+    build_parser.add_argument('output_dir')
+    plan_parser = commands.add_parser('plan', help='Show what a deployment of MANIFEST would download.')
+    plan_parser.add_argument('manifest')
+    plan_parser.add_argument('--installed', default=os.path.expanduser('~'),
+                             help='Installed release to reuse. Default: ~')
+    plan_parser.add_argument('--store', default=STORE_DIR, help=f'Content store. Default: {STORE_DIR}')
+    options = parser.parse_args(args)
+
+    if options.command == 'build':
+        manifest = build(options.tree, options.output_dir)
+        with open(os.path.join(options.output_dir, 'manifest.json'), 'rb') as f:
+            print(f"manifest SHA256: {hashlib.sha256(f.read()).hexdigest()}")
+        return 0 if manifest['files'] else 1
+
+    package = DeltaPackage('', '0' * 64, '', store_dir=options.store)
+    with open(options.manifest) as f:
+        package.manifest = json.load(f)
+    try:
+        validate_manifest(package.manifest)
+    except DeltaError as e:
+        print(f"Invalid manifest: {e}", file=sys.stderr)
+        return 1
+    package.index_installed(options.installed)
+    needed = package.missing()
+    size = sum(entry['size'] for entry in package.manifest['files'])
+    print(f"{len(package.manifest['files'])} files ({size} bytes): "
+          f"{len(needed)} blobs ({sum(needed.values())} bytes) to download")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
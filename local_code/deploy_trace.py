@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Phase timing of deployments, used by deployment-watcher.py.
+
+Every phase of a deployment is recorded as a span: download_wait,
+download, verify, extract, images (pre-loading, plus one span per image),
+cutover_wait, install, deploy.sh, rollback. deploy.sh gets one span per
+"Step N:" in its output, and its image-load summary one span per image.
+Spans are appended to TRACE_FILE as JSON lines when they end, so they
+survive the watcher restart at deploy.sh Step 6.1:
+
+  {"deployment": "abc123", "version": "1.2.0", "run": 1760000000, "span": "step",
+   "label": "Step 4: Starting Docker services", "start": 1760000123.4,
+   "seconds": 8.2, "status": "ok"}
+
+That restart also stops deploy.sh (it runs in the watcher's service), so
+the watcher sees nothing after Step 6.1; the Step 6.1 span is written as
+interrupted. ota_rollout.py appends one 'ota' span per module itself, with
+the deployment id and run deploy.sh passes on from the watcher
+(DEPLOYMENT_ID, DEPLOYMENT_VERSION, DEPLOYMENT_TRACE_RUN), so rollouts that
+run by hand or survive Step 6.1 are traced.
+
+summarize() turns one run's spans into the 'timing' sent with the
+'completed'/'failed' status report.
+
+Usage:
+  deploy_trace.py [DEPLOYMENT_ID]    # timing of the last (or that) deployment
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+TRACE_FILE = os.path.join(os.path.expanduser('~'), '.deployment-trace.jsonl')
+MAX_TRACE_BYTES = 1024 * 1024  # then the file moves to .1 and a new one starts
+SLOWEST = 5
+
+# deploy.sh output (after the watcher's "  [deploy.sh] " prefix is removed)
+STEP_LINE = re.compile(r'^Step (\d+(?:\.\d+)?): (.*?)\.*$')
+IMAGE_LINE = re.compile(r'^\s+(\S+\.tar)\s+(loaded|tagged|present|failed)\s+(\d+(?:\.\d+)?)s$')  # load_images.py
+
+
+class DeploymentTrace:
+    """Spans of one deployment attempt (a run), written to path as they end."""
+
+    def __init__(self, deployment_id, version='unknown', path=TRACE_FILE, log=print, run=None):
+        self.deployment_id = deployment_id
+        self.version = version
+        self.path = path
+        self.log = log
+        self.run = run or int(time.time())  # given when another process adds spans to a run
+        self._lock = threading.Lock()
+        self._open = []
+        self._step = None
+
+    def _write(self, record):
+        line = json.dumps({'deployment': self.deployment_id, 'version': self.version, 'run': self.run, **record})
+        with self._lock:
+            try:
+                if os.path.getsize(self.path) > MAX_TRACE_BYTES:
+                    os.replace(self.path, self.path + '.1')
+            except OSError:
+                pass
+            try:
+                with open(self.path, 'a') as f:
+                    f.write(line + '\n')
+            except OSError as e:
+                self.log(f"Cannot write deployment trace: {e}")
+
+    def start(self, name, **attrs):
+        """Open a span; end() records it. Set span['status'] to record another outcome than 'ok'."""
+        span = {'span': name, 'start': time.time(), '_started': time.monotonic(), **attrs}
+        with self._lock:
+            self._open.append(span)
+        return span
+
+    def end(self, span, status=None):
+        with self._lock:
+            if span not in self._open:
+                return  # already ended by interrupt()
+            self._open.remove(span)
+        record = {k: v for k, v in span.items() if not k.startswith('_')}
+        record['seconds'] = round(time.monotonic() - span['_started'], 3)
+        record['status'] = status or span.get('status', 'ok')
+        self._write(record)
+
+    @contextmanager
+    def span(self, name, **attrs):
+        span = self.start(name, **attrs)
+        try:
+            yield span
+        except BaseException:
+            self.end(span, 'error')
+            raise
+        self.end(span)
+
+    def add(self, name, seconds, status='ok', **attrs):
+        """Record a span that has already ended, lasting seconds."""
+        self._write({'span': name, 'start': round(time.time() - seconds, 3), 'seconds': round(seconds, 3),
+                     'status': status, **attrs})
+
+    def deploy_output(self, line, phase='deploy.sh'):
+        """Follow one line of deploy.sh output: step boundaries and image loads.
+
+        phase tells runs of deploy.sh apart, e.g. 'rollback' for the one after a failure.
+        """
+        match = STEP_LINE.match(line)
+        if match:
+            self.end_step()
+            self._step = self.start('step', label=f"Step {match.group(1)}: {match.group(2)}", phase=phase)
+            return
+        match = IMAGE_LINE.match(line)
+        if match:
+            self.add('image', float(match.group(3)), match.group(2), label=match.group(1), phase=phase)
+
+    def end_step(self, status=None):
+        if self._step:
+            self.end(self._step, status)
+            self._step = None
+
+    def interrupt(self):
+        """End every open span as 'interrupted' (the watcher is being stopped)."""
+        with self._lock:
+            spans = list(self._open)
+        for span in reversed(spans):
+            self.end(span, 'interrupted')
+
+
+def load_spans(deployment_id=None, path=TRACE_FILE, run=None):
+    """Spans of one run of deployment_id (default: the last deployment), latest run unless given."""
+    spans = []
+    for name in (path + '.1', path):
+        try:
+            with open(name) as f:
+                for line in f:
+                    try:
+                        spans.append(json.loads(line))
+                    except ValueError:
+                        pass
+        except OSError:
+            pass
+    if deployment_id is None and spans:
+        deployment_id = spans[-1].get('deployment')
+    spans = [s for s in spans if s.get('deployment') == deployment_id]
+    if run is None and spans:
+        run = max(s.get('run', 0) for s in spans)
+    return [s for s in spans if s.get('run') == run]
+
+
+def summarize(spans):
+    """{'total_seconds', 'phases', 'steps', 'images', 'ota', 'slowest'} for one run's spans."""
+    if not spans:
+        return {}
+    timing = {'phases': {}, 'steps': {}, 'images': {}, 'ota': {}}
+    groups = {'step': 'steps', 'image': 'images', 'ota': 'ota'}
+    for span in spans:
+        group = groups.get(span['span'])
+        if group:
+            key = span.get('label', '?')
+            if span.get('phase') and (group == 'images' or span['phase'] != 'deploy.sh'):
+                key = f"{span['phase']} {key}"
+        else:
+            group, key = 'phases', span['span']
+        timing[group][key] = round(timing[group].get(key, 0) + span.get('seconds', 0), 1)
+    start = min(s['start'] for s in spans)
+    end = max(s['start'] + s.get('seconds', 0) for s in spans)
+    timing['total_seconds'] = round(end - start, 1)
+    labelled = [(key, seconds) for group in ('phases', 'steps', 'ota') for key, seconds in timing[group].items()
+                if key not in ('deploy.sh', 'rollback')]  # their steps are listed instead
+    timing['slowest'] = sorted(labelled, key=lambda item: -item[1])[:SLOWEST]
+    timing['interrupted'] = sorted({s.get('label', s['span']) for s in spans if s.get('status') == 'interrupted'})
+    return {key: value for key, value in timing.items() if value or key == 'total_seconds'}
+
+
+def main(args):
+    spans = load_spans(args[0] if args else None)
+    if not spans:
+        print(f"No deployment trace in {TRACE_FILE}", file=sys.stderr)
+        return 1
+    timing = summarize(spans)
+    print(f"Deployment {spans[0]['deployment']} (v{spans[0].get('version')}): {timing['total_seconds']:.1f}s")
+    for group in ('phases', 'steps', 'images', 'ota'):
+        if timing.get(group):
+            print(f"  {group}:")
+            for key, seconds in timing[group].items():
+                print(f"    {key:<60} {seconds:8.1f}s")
+    print("  slowest: " + ', '.join(f"{key} {seconds:.1f}s" for key, seconds in timing['slowest']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
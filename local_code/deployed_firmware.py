@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Record of the firmware image each module was last flashed with.
+
+ota_rollout.py skips modules whose recorded image matches the one being
+deployed, so a deployment that does not change a module's firmware sends no
+OTA traffic to it. The record is a JSON file written after each rollout:
+
+  {"esp32-8F56D8": {"type": "...", "sha256": "<whole file>",
+                    "app_sha256": "<digest appended to the image>", "deployed_at": 1760000000}}
+
+The record only knows what this host flashed. query_running_digest() asks
+the module itself over CAN (CAN_FIRMWARE_QUERY_ID) for the digest of the
+image it is running; ESP-IDF appends that digest to the image, so it can be
+compared with app_sha256 without the module reporting a whole-file hash.
+
+Usage:
+  deployed_firmware.py                  # print the record
+  deployed_firmware.py --forget esp32-8F56D8
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from can_frames import (
+    CAN_DEVICE_ACK_ID, CAN_FIRMWARE_QUERY_ID, FIRMWARE_DIGEST_PARTS, extract_mac_from_hostname,
+    firmware_query_frame, parse_firmware_digest_part
+)
+
+DEFAULT_STATE_PATH = os.path.join(os.path.expanduser('~'), '.ota-deployed-firmware.json')
+QUERY_TIMEOUT = 2.0
+
+ESP_IMAGE_MAGIC = 0xE9
+HASH_APPENDED_OFFSET = 23  # esp_image_header_t.hash_appended
+HASH_BLOCK = 1024 * 1024
+
+
+def image_digests(path):
+    """Returns {'sha256': whole file, 'app_sha256': appended image digest or None}."""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        header = f.read(HASH_APPENDED_OFFSET + 1)
+        sha256.update(header)
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            sha256.update(block)
+        app_sha256 = None
+        if len(header) > HASH_APPENDED_OFFSET and header[0] == ESP_IMAGE_MAGIC \
+                and header[HASH_APPENDED_OFFSET] == 1 and f.tell() >= len(header) + 32:
+            f.seek(-32, os.SEEK_END)
+            app_sha256 = f.read(32).hex()
+    return {'sha256': sha256.hexdigest(), 'app_sha256': app_sha256}
+
+
+def load_deployed(path=DEFAULT_STATE_PATH):
+    """Returns {hostname: record}; empty if the file is missing or unreadable."""
+    try:
+        with open(path) as f:
+            deployed = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning("Ignoring unreadable firmware record %s: %s", path, e)
+        return {}
+    return deployed if isinstance(deployed, dict) else {}
+
+
+def save_deployed(deployed, path=DEFAULT_STATE_PATH):
+    """Write the record atomically, so an interrupted rollout never leaves it truncated."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.ota-deployed-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(deployed, f, indent=2, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def record_flash(deployed, hostname, module_type, digests):
+    deployed[hostname] = {'type': module_type, 'sha256': digests['sha256'], 'app_sha256': digests['app_sha256'],
+                          'deployed_at': int(time.time())}
+
+
+def is_unchanged(deployed, hostname, digests):
+    """True if the record says hostname was last flashed with this image."""
+    return deployed.get(hostname, {}).get('sha256') == digests['sha256']
+
+
+def query_running_digest(link, hostname, timeout=QUERY_TIMEOUT):
+    """
+    Ask a module for the digest of the image it runs. Returns the leading hex
+    digits it reported, or None if it did not answer (older firmware ignores the query).
+    """
+    parts = {}
+    deadline = time.monotonic() + timeout
+    with link.listen(CAN_DEVICE_ACK_ID, extract_mac_from_hostname(hostname) + [CAN_FIRMWARE_QUERY_ID]) as listener:
+        link.send(*firmware_query_frame(hostname))
+        while len(parts) < FIRMWARE_DIGEST_PARTS:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            frame = listener.get(min(remaining, 0.5))
+            reply = parse_firmware_digest_part(frame[1]) if frame else None
+            if reply and reply[1] < FIRMWARE_DIGEST_PARTS:
+                parts[reply[1]] = reply[2]
+    return b''.join(parts[i] for i in range(FIRMWARE_DIGEST_PARTS)).hex()
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Show or edit the record of firmware flashed to each module.')
+    parser.add_argument('--state', default=DEFAULT_STATE_PATH, help=f'Record file. Default: {DEFAULT_STATE_PATH}')
+    parser.add_argument('--forget', nargs='+', default=[], metavar='HOSTNAME',
+                        help='Drop these modules from the record so the next rollout flashes them.')
+    options = parser.parse_args(args)
+
+    deployed = load_deployed(options.state)
+    if options.forget:
+        for hostname in options.forget:
+            deployed.pop(hostname, None)
+        save_deployed(deployed, options.state)
+    for hostname, record in sorted(deployed.items()):
+        print(f"  {hostname} {record.get('type')} sha256 {record.get('sha256', '')[:16]} "
+              f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(record.get('deployed_at', 0)))}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
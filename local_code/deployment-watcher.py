@@ -11,25 +11,37 @@ MongoDB via docker exec into the backend container, matching the
 pattern used by deploy.sh.
 """
 
+import glob
+import hashlib
 import json
 import os
 import sys
 import ssl
 import re
 import time
-import hashlib
-import zipfile
 import subprocess
 import signal
 import shutil
-import tempfile
 import threading
 import traceback
-from urllib.request import Request, urlopen
 from urllib.error import URLError, HTTPError
 
 import paho.mqtt.client as mqtt
 
+from config_cache import ConfigCache
+from cutover import GPS_DETAILS_TOPIC, CutoverPolicy
+from delta_package import DeltaPackage
+from deploy_trace import DeploymentTrace, load_spans, summarize
+from deployment_state import (COMPLETED, DEPLOYING, DOWNLOADING, FAILED, STAGED, SUPERSEDED, DeploymentState,
+                              StateError)
+from download_policy import DEFAULT_METERED_INTERFACES, DOWNLOAD_CONTROL_TOPIC, DownloadPolicy, DownloadStopped
+from event_loop import EventLoop
+from load_images import FAILED as IMAGE_FAILED, load_all
+from package_download import DOWNLOAD_DIR, ChecksumMismatch, PackageDownload
+from package_stage import StagedExtraction
+from releases import ROLLED_BACK, ReleaseError, Releases, release_name
+from status_reporter import StatusReporter
+
 # Load .env file from script directory
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 ENV_FILE = os.path.join(SCRIPT_DIR, '.env')
@@ -78,17 +90,55 @@ CLOUD_STATUS_TOPIC = 'rv/deployment/status'
 
 # Paths
 HOME_DIR = os.path.expanduser('~')
-LAST_DEPLOYED_FILE = os.path.join(HOME_DIR, '.deployment-watcher-last')
-PENDING_STATUS_FILE = os.path.join(HOME_DIR, '.deployment-watcher-pending')
-LOCK_FILE = '/tmp/deployment-watcher.lock'
+STATE_FILE = os.path.join(HOME_DIR, '.deployment-watcher-state.json')  # per deployment, see deployment_state.py
+LOCK_FILE = os.path.join(HOME_DIR, '.deployment-watcher.lock')  # flock held while a deployment runs
+STAGING_DIR = os.path.join(HOME_DIR, '.deployment-staging')  # renamed into a release directory, same filesystem
+DOWNTIME_FILE = os.path.join(HOME_DIR, '.deployment-downtime.json')  # written by deploy.sh at cut-over
+CONFIG_CACHE_FILE = os.path.join(HOME_DIR, '.deployment-watcher-config')  # see config_cache.py
+TRACE_FILE = os.path.join(HOME_DIR, '.deployment-trace.jsonl')  # phase timing, see deploy_trace.py
+
+# Parallel range requests per package download (1 = a single resumable stream)
+DOWNLOAD_SEGMENTS = int(os.environ.get('DEPLOYMENT_DOWNLOAD_SEGMENTS', '1'))
+
+# Images of a staged release loaded at once before the cut-over
+IMAGE_LOAD_PARALLEL = int(os.environ.get('IMAGE_LOAD_PARALLEL', '2'))
+
+# When and how fast packages download (see download_policy.py)
+DEPLOYMENT_DOWNLOAD_RATE = os.environ.get('DEPLOYMENT_DOWNLOAD_RATE', '')
+DEPLOYMENT_DOWNLOAD_WINDOW = os.environ.get('DEPLOYMENT_DOWNLOAD_WINDOW', '')
+DEPLOYMENT_DOWNLOAD_UNMETERED_ONLY = os.environ.get('DEPLOYMENT_DOWNLOAD_UNMETERED_ONLY', 'no') == 'yes'
+DEPLOYMENT_METERED_INTERFACES = os.environ.get('DEPLOYMENT_METERED_INTERFACES', DEFAULT_METERED_INTERFACES)
+
+# When a staged release may cut over (see cutover.py)
+DEPLOYMENT_WINDOW = os.environ.get('DEPLOYMENT_WINDOW', '')
+DEPLOYMENT_REQUIRE_PARKED = os.environ.get('DEPLOYMENT_REQUIRE_PARKED', 'no') == 'yes'
+DEPLOYMENT_PARKED_SPEED = float(os.environ.get('DEPLOYMENT_PARKED_SPEED', '1.0'))
+
+# Release directories kept for rollback (see releases.py), and whether a
+# failed deploy.sh switches back to the previous release automatically
+DEPLOYMENT_KEEP_RELEASES = int(os.environ.get('DEPLOYMENT_KEEP_RELEASES', '3'))
+DEPLOYMENT_AUTO_ROLLBACK = os.environ.get('DEPLOYMENT_AUTO_ROLLBACK', 'yes') == 'yes'
 
 # State
 cloud_config = None
 cloud_mqtt_client = None
 local_mqtt_client = None
 shutting_down = False
-failed_deployments = {}  # {deployment_id: attempt_count}
+queued_deployment = None  # (id, payload) that arrived while another deployment held the lock
+current_trace = None  # DeploymentTrace of the deployment holding the lock
+cloud_retry_delay = None  # seconds until the next cloud connect attempt while it keeps failing
+cloud_retry_timer = None
 MAX_DEPLOY_ATTEMPTS = 3
+CLOUD_RETRY_MIN = 10
+CLOUD_RETRY_MAX = 300
+
+# Events handled on the main thread (see main())
+EVENT_CONFIG_CHANGED = 'config-changed'  # (version,) from local/config/cloud_updated
+EVENT_DEPLOYMENT = 'deployment'  # (payload,) from rv/deployment/available or the queue
+EVENT_CLOUD_CONNECTED = 'cloud-connected'
+EVENT_CLOUD_DISCONNECTED = 'cloud-disconnected'  # (reason_code,)
+EVENT_CLOUD_RETRY = 'cloud-retry'  # after a failed initial connect
+EVENT_SHUTDOWN = 'shutdown'
 
 
 def log(msg):
@@ -96,41 +146,45 @@ def log(msg):
     print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {msg}", flush=True)
 
 
-def report_status(deployment_id, status, version='unknown', progress=None):
+status_reporter = StatusReporter(lambda: cloud_config, log)
+releases = Releases(keep=DEPLOYMENT_KEEP_RELEASES, log=log)
+events = EventLoop(log)
+config_cache = ConfigCache(CONFIG_CACHE_FILE, os.environ.get('ENCRYPTION_KEY'), log)
+deployment_state = DeploymentState(STATE_FILE, LOCK_FILE, log=log)
+
+try:
+    cutover_policy = CutoverPolicy(DEPLOYMENT_WINDOW, DEPLOYMENT_REQUIRE_PARKED, DEPLOYMENT_PARKED_SPEED, log=log)
+except ValueError as e:
+    log(f"Ignoring DEPLOYMENT_WINDOW: {e}")
+    cutover_policy = CutoverPolicy(None, DEPLOYMENT_REQUIRE_PARKED, DEPLOYMENT_PARKED_SPEED, log=log)
+
+try:
+    download_policy = DownloadPolicy(DEPLOYMENT_DOWNLOAD_RATE, DEPLOYMENT_DOWNLOAD_WINDOW,
+                                     DEPLOYMENT_DOWNLOAD_UNMETERED_ONLY, DEPLOYMENT_METERED_INTERFACES, log=log)
+except ValueError as e:
+    log(f"Ignoring DEPLOYMENT_DOWNLOAD_RATE and DEPLOYMENT_DOWNLOAD_WINDOW: {e}")
+    download_policy = DownloadPolicy(None, None, DEPLOYMENT_DOWNLOAD_UNMETERED_ONLY, DEPLOYMENT_METERED_INTERFACES,
+                                     log=log)
+
+
+def report_status(deployment_id, status, version='unknown', progress=None, **extra):
     """Report deployment status via HTTP POST to the cloud backend.
 
-    Posts to {cloud_url}/api/deployments/status using the cloud API
-    key for authentication. Failures are logged but never block or
-    abort the deployment.
+    Queues the message for the background reporter (status_reporter.py),
+    which posts to {cloud_url}/api/deployments/status using the cloud API
+    key for authentication, so reporting never blocks the deployment.
+    Progress updates coalesce; 'completed'/'failed' are retried until
+    delivered, also across restarts.
 
     When status is 'downloading', progress (0-100) indicates the
-    download percentage.
+    download percentage. Extra keyword arguments are added to the message.
+    'completed' and 'failed' carry the deployment's phase timing.
     """
-    if not cloud_config or not cloud_config.get('cloud_url') or not cloud_config.get('cloud_api_key'):
-        log(f"Cannot report status '{status}' - cloud config not available")
-        return
-
-    try:
-        msg = {
-            'deploymentId': deployment_id,
-            'status': status,
-            'version': version,
-            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
-        }
-        if progress is not None:
-            msg['progress'] = progress
-
-        url = cloud_config['cloud_url'].rstrip('/') + '/api/deployments/status'
-        data = json.dumps(msg).encode('utf-8')
-        req = Request(url, data=data, method='POST')
-        req.add_header('Authorization', cloud_config['cloud_api_key'])
-        req.add_header('Content-Type', 'application/json')
-
-        resp = urlopen(req, timeout=10)
-        resp.read()  # consume response body
-        log(f"Reported status '{status}'{f' ({progress}%)' if progress is not None else ''} for deployment {deployment_id}")
-    except Exception as e:
-        log(f"Failed to report status '{status}' (non-fatal): {e}")
+    if status in ('completed', 'failed') and 'timing' not in extra:
+        timing = summarize(load_spans(deployment_id, TRACE_FILE))
+        if timing:
+            extra['timing'] = timing
+    status_reporter.report(deployment_id, status, version, progress, **extra)
 
 
 def get_backend_container():
@@ -150,7 +204,12 @@ def get_backend_container():
 
 
 def read_cloud_config():
-    """Read cloud configuration from MongoDB via docker exec into the backend container."""
+    """Read cloud configuration from MongoDB via docker exec into the backend container.
+
+    The result carries 'version', computed like cloudConfigVersion() in the
+    backend (containers/backend/src/utils/cloud-config.js) so it can be
+    compared with the version in local/config/cloud_updated notifications.
+    """
     container = get_backend_container()
     if not container:
         log("Backend container not found, cannot read cloud config")
@@ -170,7 +229,13 @@ def read_cloud_config():
                 const d = crypto.createDecipheriv("aes-256-cbc", key, Buffer.from(iv, "hex"));
                 return d.update(enc, "hex", "utf8") + d.final("utf8");
             }
+            const version = crypto.createHash("sha256").update(JSON.stringify([
+                config.cloud_enabled || false, config.cloud_url || "", config.cloud_mqtt_username || "",
+                config.cloud_mqtt_password_encrypted || "", config.cloud_mqtt_password_iv || "",
+                config.cloud_api_key_encrypted || "", config.cloud_api_key_iv || ""
+            ])).digest("hex");
             const result = {
+                version,
                 cloud_enabled: config.cloud_enabled || false,
                 cloud_url: config.cloud_url || "",
                 cloud_mqtt_username: config.cloud_mqtt_username || "",
@@ -200,6 +265,32 @@ def read_cloud_config():
         return None
 
 
+def load_cloud_config(version=None):
+    """Cloud config from the local snapshot, or from MongoDB if that is out of date.
+
+    The snapshot is used when its version equals version, the one the backend
+    last published. With version None (no notification seen yet) any snapshot
+    is used. MongoDB results replace the snapshot.
+    """
+    cached = config_cache.load()
+    if cached and (version is None or cached.get('version') == version):
+        log(f"Using cached cloud config (version {str(cached.get('version'))[:12]})")
+        return cached
+    config = read_cloud_config()
+    if config:
+        config_cache.save(config)
+    return config
+
+
+def _notified_version(payload):
+    """Config version from a local/config/cloud_updated payload, or None (older backends send none)."""
+    try:
+        version = json.loads(payload).get('version')
+    except (ValueError, AttributeError):
+        return None
+    return version if isinstance(version, str) else None
+
+
 def extract_mqtt_host_from_url(cloud_url):
     """Extract hostname from cloud URL for MQTT connection."""
     try:
@@ -210,177 +301,251 @@ def extract_mqtt_host_from_url(cloud_url):
         return None
 
 
-def get_last_deployed_id():
-    """Read the last deployed deployment ID from tracking file."""
+def set_state(deployment_id, new_state, version=None, **fields):
+    """Record a deployment state transition. Returns the record, or None if it could not be saved."""
     try:
-        if os.path.isfile(LAST_DEPLOYED_FILE):
-            with open(LAST_DEPLOYED_FILE, 'r') as f:
-                return f.read().strip()
-    except Exception:
-        pass
-    return None
-
+        return deployment_state.transition(deployment_id, new_state, version, **fields)
+    except (StateError, OSError) as e:
+        log(f"Warning: Could not record deployment state: {e}")
+        return None
 
-def set_pending_deployment(deployment_id, version):
-    """Write a pending deployment marker before starting deploy.sh.
 
-    If the watcher process is killed during deploy.sh (e.g. by
-    systemctl restart), the next instance uses this file to detect
-    the deployment and report 'completed'.
-    """
+def pop_downtime():
+    """Downtime deploy.sh measured at the last cut-over, as status extras; the record is removed."""
     try:
-        with open(PENDING_STATUS_FILE, 'w') as f:
-            f.write(f"{deployment_id}:{version}")
-    except Exception as e:
-        log(f"Warning: Could not write pending status file: {e}")
+        with open(DOWNTIME_FILE) as f:
+            downtime = json.load(f)
+        os.remove(DOWNTIME_FILE)
+    except (OSError, ValueError):
+        return {}
+    log(f"Cut-over downtime: Docker services {downtime.get('docker_seconds')}s, "
+        f"CAN bridge {downtime.get('can_bridge_seconds')}s")
+    return {'downtime': downtime}
 
 
-def get_pending_deployment():
-    """Read the pending deployment marker, if any. Returns (id, version) or None."""
-    try:
-        if os.path.isfile(PENDING_STATUS_FILE):
-            with open(PENDING_STATUS_FILE, 'r') as f:
-                content = f.read().strip()
-            if ':' in content:
-                dep_id, version = content.split(':', 1)
-                return dep_id, version
-    except Exception:
-        pass
-    return None
-
+def reached_cutover(record):
+    """True if deploy.sh got to Step 6.1 (the watcher restart) for a record still in 'deploying'.
 
-def clear_pending_deployment():
-    """Remove the pending deployment marker."""
+    deploy.sh writes DOWNTIME_FILE just before Step 6.1, and the step's span
+    is written (as interrupted) when the restart stops this watcher.
+    """
     try:
-        if os.path.isfile(PENDING_STATUS_FILE):
-            os.remove(PENDING_STATUS_FILE)
-    except Exception:
+        with open(DOWNTIME_FILE) as f:
+            if json.load(f).get('measured_at', 0) >= record.get('updated_at', 0):
+                return True
+    except (OSError, ValueError, AttributeError):
         pass
+    return any(span.get('span') == 'step' and span.get('label', '').startswith('Step 6.1:')
+               for span in load_spans(record['id'], TRACE_FILE))
 
 
-def set_last_deployed_id(deployment_id):
-    """Write the deployed deployment ID to tracking file."""
-    try:
-        with open(LAST_DEPLOYED_FILE, 'w') as f:
-            f.write(deployment_id)
-    except Exception as e:
-        log(f"Warning: Could not write deployment tracking file: {e}")
-
-
-def acquire_lock():
-    """Simple file-based lock to prevent concurrent deployments."""
-    if os.path.isfile(LOCK_FILE):
-        try:
-            with open(LOCK_FILE, 'r') as f:
-                pid = int(f.read().strip())
-            # Check if the process is still running
-            os.kill(pid, 0)
-            return False  # Process still running
-        except (ValueError, ProcessLookupError, PermissionError):
-            # Stale lock file
-            os.remove(LOCK_FILE)
-
-    with open(LOCK_FILE, 'w') as f:
-        f.write(str(os.getpid()))
-    return True
-
-
-def release_lock():
-    """Release the deployment lock."""
-    try:
-        if os.path.isfile(LOCK_FILE):
-            os.remove(LOCK_FILE)
-    except Exception:
-        pass
-
+def _download_progress(deployment_id, version):
+    """Progress callback reporting 'downloading' every 5%."""
+    last_reported_pct = -1
 
-def download_and_verify(download_url, api_key, expected_sha256, deployment_id,
-                        total_size=0, version='unknown'):
-    """Download a zip file, verify its SHA256 checksum, return the temp file path."""
-    temp_path = os.path.join(tempfile.gettempdir(), f'deployment-{deployment_id}.zip')
+    def progress(downloaded, total):
+        nonlocal last_reported_pct
+        if total > 0:
+            pct = int(downloaded * 100 / total)
+            if pct >= last_reported_pct + 5:
+                last_reported_pct = pct
+                report_status(deployment_id, 'downloading', version, progress=min(pct, 100))
+    return progress
 
-    log(f"Downloading deployment to {temp_path}...")
-    req = Request(download_url)
-    req.add_header('Authorization', api_key)
 
+def _file_sha256(path):
     sha256 = hashlib.sha256()
-    downloaded = 0
-    last_reported_pct = -1
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
 
-    try:
-        response = urlopen(req, timeout=300)
-        # Use Content-Length from response if we don't have a size from the payload
-        if not total_size:
-            cl = response.headers.get('Content-Length')
-            if cl:
-                total_size = int(cl)
-        with open(temp_path, 'wb') as f:
-            while True:
-                chunk = response.read(65536)
-                if not chunk:
-                    break
-                f.write(chunk)
-                sha256.update(chunk)
-                downloaded += len(chunk)
-
-                # Report download progress every 5%
-                if total_size > 0:
-                    pct = int(downloaded * 100 / total_size)
-                    if pct >= last_reported_pct + 5:
-                        last_reported_pct = pct
-                        report_status(deployment_id, 'downloading', version,
-                                      progress=min(pct, 100))
-
-        computed_hash = sha256.hexdigest()
-        log(f"Downloaded {downloaded} bytes, SHA256: {computed_hash}")
-
-        if computed_hash != expected_sha256:
-            log(f"CHECKSUM MISMATCH! Expected: {expected_sha256}, Got: {computed_hash}")
-            log(f"  Expected size: {total_size}, Downloaded: {downloaded} bytes")
-            os.remove(temp_path)
-            return None
 
+def download_and_verify(download_url, api_key, expected_sha256, deployment_id,
+                        total_size=0, version='unknown', stage=None, should_stop=None):
+    """Download a zip file, verify its SHA256 checksum, return the file path.
+
+    Resumes with HTTP Range requests after dropped connections and across
+    watcher restarts (see package_download.py); DOWNLOAD_SEGMENTS > 1
+    fetches that many ranges in parallel, limited and held back by
+    download_policy (see download_policy.py); while it is held back,
+    should_stop() becoming true ends it. With a StagedExtraction as stage
+    the package is extracted into the staging directory as it arrives.
+    """
+    zip_path = os.path.join(DOWNLOAD_DIR, f'deployment-{deployment_id}.zip')
+    if os.path.isfile(zip_path):
+        with current_trace.span('verify', reused=True) as span:
+            verified = _file_sha256(zip_path) == expected_sha256.lower()
+            span['status'] = 'ok' if verified else 'failed'
+        if verified:
+            # Downloaded before a restart (e.g. while waiting for the cut-over)
+            log(f"Using verified {zip_path} from an earlier attempt")
+            return zip_path
+    log(f"Downloading deployment to {zip_path}...")
+    progress = _download_progress(deployment_id, version)
+
+    download = PackageDownload(download_url, expected_sha256, total_size,
+                               headers={'Authorization': api_key}, segments=DOWNLOAD_SEGMENTS,
+                               progress=progress, log=log, stream_to=stage, throttle=download_policy,
+                               should_stop=should_stop)
+    try:
+        download.run(zip_path)
+        log(f"Downloaded {download.size} bytes, SHA256: {download.expected_sha256}")
         log("Checksum verified OK")
-        return temp_path
+        return zip_path
 
+    except ChecksumMismatch as e:
+        log(f"CHECKSUM MISMATCH! Expected: {e.expected}, Got: {e.computed}")
+        log(f"  Expected size: {total_size}, Downloaded: {e.size} bytes")
+        return None
+    # The partial download is kept for the next attempt in the cases below
+    except DownloadStopped:
+        log("Download stopped")
+        return None
     except HTTPError as e:
         log(f"HTTP error downloading deployment: {e.code} {e.reason}")
-        if os.path.isfile(temp_path):
-            os.remove(temp_path)
         return None
     except URLError as e:
         log(f"URL error downloading deployment: {e.reason}")
-        if os.path.isfile(temp_path):
-            os.remove(temp_path)
         return None
     except Exception as e:
         log(f"Error downloading deployment: {e}")
-        if os.path.isfile(temp_path):
-            os.remove(temp_path)
         return None
 
 
-def extract_and_deploy(zip_path):
-    """Extract the zip to ~/ and run deploy.sh."""
-    log(f"Extracting {zip_path} to {HOME_DIR}...")
+def download_delta(manifest_url, manifest_sha256, blob_url, api_key, deployment_id, version='unknown',
+                   should_stop=None):
+    """Fetch a content-addressed package into STAGING_DIR, reusing installed files.
+
+    Only blobs that no file of the running release holds are downloaded
+    (see delta_package.py). Returns the DeltaPackage, or None on failure.
+    """
+    delta = DeltaPackage(manifest_url, manifest_sha256, blob_url, headers={'Authorization': api_key},
+                         segments=DOWNLOAD_SEGMENTS, progress=_download_progress(deployment_id, version), log=log,
+                         throttle=download_policy, should_stop=should_stop)
     try:
-        # Remove directories whose contents are release-specific before extracting.
-        # extractall() overlays without removing old files, so stale artifacts
-        # from a prior release would persist — causing unnecessary MCU OTA updates
-        # (firmware/) or wasted time loading removed container images (images/).
-        for stale_dir in ['firmware', 'images']:
-            dirpath = os.path.join(HOME_DIR, stale_dir)
-            if os.path.isdir(dirpath):
-                shutil.rmtree(dirpath)
-                log(f"Removed stale {stale_dir}/ directory from previous deployment")
-
-        with zipfile.ZipFile(zip_path, 'r') as zf:
-            zf.extractall(HOME_DIR)
+        stats = delta.run(STAGING_DIR, HOME_DIR)
+        log(f"Reconstructed {stats['files']} files ({stats['size']} bytes): downloaded "
+            f"{stats['downloaded_bytes']} bytes in {stats['blobs_downloaded']} blobs, "
+            f"reused {stats['reused_bytes']} bytes from the installed release")
+        return delta
+    except DownloadStopped:
+        log("Delta package download stopped")
+    except HTTPError as e:
+        log(f"HTTP error downloading delta package: {e.code} {e.reason}")
+    except URLError as e:
+        log(f"URL error downloading delta package: {e.reason}")
+    except Exception as e:
+        log(f"Error building delta package: {e}")
+    shutil.rmtree(STAGING_DIR, ignore_errors=True)
+    return None
+
+
+def extract_and_deploy(zip_path, stage, deployment_id, version):
+    """Install the package as a new release and run deploy.sh.
+
+    The package is normally extracted into the staging directory while it
+    downloads (stage); otherwise it is extracted from zip_path into staging
+    first. The staged tree becomes the current release only after the
+    checksum passed.
+    """
+    log(f"Installing {zip_path} as a new release...")
+    try:
+        if stage.complete:
+            log(f"Package is already staged ({stage.members} entries)")
+        else:
+            log(f"Extracting {zip_path} to {stage.staging_dir}...")
+            with current_trace.span('extract'):
+                stage.extract_from(zip_path)
+        os.remove(zip_path)  # everything needed is staged
+        install_staged(stage.staging_dir, deployment_id, version)
         log("Extraction complete")
     except Exception as e:
         log(f"Error extracting zip: {e}")
         return False
+    return run_deploy_script()
+
 
+def prestage_images(staging_dir):
+    """Load the staged release's Docker images while the running services carry on.
+
+    deploy.sh then finds them in the daemon and skips its own load, so the
+    cut-over only recreates the containers whose image changed. Failures are
+    not fatal: deploy.sh retries the load.
+    """
+    paths = sorted(glob.glob(os.path.join(staging_dir, 'images', '*.tar')))
+    if not paths:
+        return
+    log(f"Pre-loading {len(paths)} Docker image(s) while services keep running...")
+    started = time.monotonic()
+    with current_trace.span('images') as span:
+        try:
+            results = load_all(paths, IMAGE_LOAD_PARALLEL, log=log)
+        except Exception as e:
+            log(f"Error pre-loading images: {e}")
+            span['status'] = 'failed'
+            return
+    for r in results:
+        current_trace.add('image', r['seconds'], r['outcome'], label=os.path.basename(r['path']), phase='prestage')
+    failed = sum(r['outcome'] == IMAGE_FAILED for r in results)
+    log(f"Pre-loaded images in {time.monotonic() - started:.1f}s"
+        f"{f' ({failed} failed, deploy.sh will retry)' if failed else ''}")
+
+
+def deploy_delta(delta, deployment_id, version):
+    """Install a package reconstructed by download_delta() as a new release and run deploy.sh."""
+    log("Installing reconstructed package as a new release...")
+    try:
+        install_staged(STAGING_DIR, deployment_id, version)
+        delta.installed(HOME_DIR)
+        log("Install complete")
+    except Exception as e:
+        log(f"Error installing package: {e}")
+        return False
+    return run_deploy_script()
+
+
+def install_staged(staging_dir, deployment_id, version):
+    """Make a staged package tree the current release (see releases.py).
+
+    The tree moves into its own release directory and ~/ switches to it with
+    one symlink rename, so a failed install never leaves a mix of two
+    releases. Entries the release does not ship (an omitted firmware/ or
+    images/) disappear with the switch instead of lingering from the last one.
+    """
+    previous = releases.current()
+    with current_trace.span('install'):
+        releases.install(staging_dir, release_name(deployment_id, version), version, deployment_id)
+    log(f"Release {releases.current()} is now current" + (f" (previous: {previous})" if previous else ""))
+
+
+def rollback_release():
+    """After a failed deploy.sh, switch back to the previous release and redeploy it.
+
+    Returns the release rolled back to, or None. The failed release is marked
+    rolled back so the retained notification does not install it again.
+    """
+    if not DEPLOYMENT_AUTO_ROLLBACK:
+        return None
+    try:
+        previous = releases.rollback()
+    except (ReleaseError, OSError) as e:
+        log(f"Rollback failed: {e}")
+        return None
+    if not previous:
+        log("No previous release to roll back to")
+        return None
+    log(f"Rolled back to release {previous}, re-running deploy.sh...")
+    if not run_deploy_script('rollback'):
+        log(f"deploy.sh failed for rolled-back release {previous} as well")
+    return previous
+
+
+def run_deploy_script(span_name='deploy.sh'):
+    """Find the installed deploy.sh and run it, streaming its output.
+
+    The run is traced as span_name, with a span per "Step N:" it prints.
+    """
     # Find deploy.sh — check common locations
     deploy_script = None
     for candidate in [
@@ -403,34 +568,44 @@ def extract_and_deploy(zip_path):
         return False
 
     log(f"Running {deploy_script}...")
+    span = current_trace.start(span_name)
     try:
         os.chmod(deploy_script, 0o755)
+        # ota_rollout.py adds its spans to this run (see deploy_trace.py)
+        trace_env = {'DEPLOYMENT_ID': current_trace.deployment_id, 'DEPLOYMENT_VERSION': current_trace.version,
+                     'DEPLOYMENT_TRACE_RUN': str(current_trace.run)}
         proc = subprocess.Popen(
             ['bash', deploy_script],
             cwd=os.path.dirname(deploy_script),
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
-            text=True
+            text=True,
+            env={**os.environ, **trace_env}
         )
 
         # Stream output
         for line in proc.stdout:
             log(f"  [deploy.sh] {line.rstrip()}")
+            current_trace.deploy_output(line.rstrip(), span_name)
 
         proc.wait()
         log(f"deploy.sh exited with code {proc.returncode}")
         # Exit code -15 means SIGTERM — deploy.sh restarts this service at
         # Step 6.1, which sends SIGTERM to the running watcher (and its
         # child deploy.sh). This is expected, not a failure.
-        return proc.returncode == 0 or proc.returncode == -15
+        success = proc.returncode == 0 or proc.returncode == -15
     except Exception as e:
         log(f"Error running deploy.sh: {e}")
-        return False
+        success = False
+    status = 'ok' if success else 'failed'
+    current_trace.end_step(status)
+    current_trace.end(span, status)
+    return success
 
 
 def handle_deployment(payload):
     """Handle a deployment notification from the cloud MQTT broker."""
-    global cloud_config
+    global cloud_config, queued_deployment, current_trace
 
     try:
         data = json.loads(payload)
@@ -444,6 +619,10 @@ def handle_deployment(payload):
     size = data.get('size', 0)
     sha256 = data.get('sha256')
     download_url_path = data.get('downloadUrl')
+    # Optional content-addressed form of the same package (delta_package.py)
+    manifest_url_path = data.get('manifestUrl')
+    manifest_sha256 = data.get('manifestSha256')
+    blob_url_path = data.get('blobUrl')
     timestamp = data.get('timestamp', '')
 
     if not deployment_id or not sha256 or not download_url_path:
@@ -453,15 +632,22 @@ def handle_deployment(payload):
     log(f"Deployment available: id={deployment_id} version={version} file={filename} size={size}")
 
     # Check if already deployed
-    last_deployed = get_last_deployed_id()
-    if last_deployed == deployment_id:
+    record = deployment_state.get(deployment_id) or {}
+    if record.get('state') == COMPLETED:
         log(f"Deployment {deployment_id} already applied, skipping")
         return
 
-    # Check if we've already failed too many times for this deployment
-    attempts = failed_deployments.get(deployment_id, 0)
+    # A release whose deploy.sh failed and was rolled back is not retried
+    # automatically; `releases.py rollback NAME --deploy` installs it by hand
+    if releases.status(release_name(deployment_id, version)) == ROLLED_BACK:
+        log(f"Deployment {deployment_id} was rolled back after failing, skipping")
+        return
+
+    # Check if we've already failed too many times for this deployment (counted across restarts)
+    attempts = record.get('attempts', 0)
     if attempts >= MAX_DEPLOY_ATTEMPTS:
-        log(f"Deployment {deployment_id} has failed {attempts} times, giving up")
+        log(f"Deployment {deployment_id} has failed {attempts} times, giving up "
+            f"(deployment_state.py --reset {deployment_id} to retry)")
         return
 
     # Verify we have cloud config
@@ -470,66 +656,186 @@ def handle_deployment(payload):
         return
 
     # Acquire lock
-    if not acquire_lock():
-        log("Another deployment is in progress, skipping")
+    if not deployment_state.acquire():
+        queued_deployment = (deployment_id, payload)
+        log(f"Another deployment is in progress, queued {deployment_id}")
+        cutover_policy.interrupt()  # a staged deployment still waiting gives way
+        download_policy.interrupt()  # as does one whose download has not started
         return
 
+    current_trace = DeploymentTrace(deployment_id, version, TRACE_FILE, log)
+
+    # A newer deployment arriving while this one waits replaces it
+    def superseded():
+        return queued_deployment is not None and queued_deployment[0] != deployment_id
+
     try:
         # Build full download URL from PWA-configured cloud server
         base_url = cloud_config['cloud_url'].rstrip('/')
         full_url = f"{base_url}{download_url_path}"
         api_key = cloud_config['cloud_api_key']
 
-        log(f"Downloading from {full_url}")
+        # Hold the download while paused over MQTT, outside the download
+        # window or on a metered connection
+        reason = download_policy.blocked_reason()
+        if reason:
+            report_status(deployment_id, 'deferred', version, reason=reason)
+            with current_trace.span('download_wait'):
+                allowed = download_policy.wait(lambda: shutting_down or superseded())
+            if not allowed:
+                if superseded():
+                    log(f"Deployment {deployment_id} superseded by {queued_deployment[0]} before downloading")
+                    set_state(deployment_id, SUPERSEDED, version)
+                    report_status(deployment_id, 'failed', version, reason='superseded')
+                return
+
+        # Partial downloads of deployments that never finished give way to this one
+        for stale in deployment_state.in_state(DOWNLOADING) + deployment_state.in_state(STAGED):
+            if stale['id'] != deployment_id:
+                set_state(stale['id'], SUPERSEDED)
+        set_state(deployment_id, DOWNLOADING, version)
         report_status(deployment_id, 'downloading', version)
 
-        # Download and verify
-        zip_path = download_and_verify(full_url, api_key, sha256, deployment_id,
-                                       total_size=size, version=version)
-        if not zip_path:
-            failed_deployments[deployment_id] = failed_deployments.get(deployment_id, 0) + 1
-            attempts = failed_deployments[deployment_id]
-            log(f"Download or verification failed (attempt {attempts}/{MAX_DEPLOY_ATTEMPTS}), aborting deployment")
-            report_status(deployment_id, 'failed', version)
-            return
+        # Prefer the delta package: only blobs the running release lacks are fetched
+        delta = None
+        zip_path = None
+        if manifest_url_path and manifest_sha256 and blob_url_path:
+            log(f"Fetching delta package {base_url}{manifest_url_path}")
+            with current_trace.span('download', package='delta') as span:
+                delta = download_delta(f"{base_url}{manifest_url_path}", manifest_sha256,
+                                       f"{base_url}{blob_url_path}", api_key, deployment_id, version,
+                                       should_stop=lambda: shutting_down or superseded())
+                span['status'] = 'ok' if delta else 'failed'
+            if not delta and shutting_down:
+                return
+            if not delta and superseded():
+                log(f"Deployment {deployment_id} superseded by {queued_deployment[0]} while downloading")
+                set_state(deployment_id, SUPERSEDED)
+                report_status(deployment_id, 'failed', version, reason='superseded')
+                return
+            if not delta:
+                log("Delta package failed, falling back to the full package")
+
+        if not delta:
+            log(f"Downloading from {full_url}")
+
+            # Download and verify, extracting into the staging directory on the way
+            stage = StagedExtraction(STAGING_DIR, log)
+            # The SHA256 is computed as the bytes arrive, so verifying is part of this span
+            with current_trace.span('download', package='zip') as span:
+                zip_path = download_and_verify(full_url, api_key, sha256, deployment_id,
+                                               total_size=size, version=version, stage=stage,
+                                               should_stop=lambda: shutting_down or superseded())
+                span['status'] = 'ok' if zip_path else 'failed'
+                span['extracted_while_downloading'] = stage.complete
+            if not zip_path:
+                stage.discard()
+                if shutting_down:
+                    log("Download stopped for shutdown; it resumes from the partial file after restart")
+                    return
+                if superseded():
+                    log(f"Deployment {deployment_id} superseded by {queued_deployment[0]} while downloading")
+                    set_state(deployment_id, SUPERSEDED)
+                    report_status(deployment_id, 'failed', version, reason='superseded')
+                    return
+                attempts = (set_state(deployment_id, FAILED, reason='download') or {}).get('attempts', '?')
+                log(f"Download or verification failed (attempt {attempts}/{MAX_DEPLOY_ATTEMPTS}), aborting deployment")
+                report_status(deployment_id, 'failed', version)
+                return
 
         report_status(deployment_id, 'downloaded', version)
 
-        # Write pending marker so the new watcher instance (after deploy.sh
+        # Stage everything while the current release keeps running
+        if not delta and not stage.complete:
+            try:
+                log(f"Extracting {zip_path} to {stage.staging_dir}...")
+                with current_trace.span('extract'):
+                    stage.extract_from(zip_path)
+            except Exception as e:
+                log(f"Error extracting zip: {e}")
+                stage.discard()
+                set_state(deployment_id, FAILED, reason='extract')
+                report_status(deployment_id, 'failed', version)
+                return
+        prestage_images(STAGING_DIR)
+        set_state(deployment_id, STAGED)
+        report_status(deployment_id, 'staged', version)
+
+        # Hold the cut-over for the maintenance window / a parked vehicle
+        with current_trace.span('cutover_wait'):
+            allowed = cutover_policy.wait(lambda: shutting_down or superseded())
+        if not allowed:
+            if superseded():
+                log(f"Deployment {deployment_id} superseded by {queued_deployment[0]} before cut-over")
+                if zip_path and os.path.isfile(zip_path):
+                    os.remove(zip_path)
+                set_state(deployment_id, SUPERSEDED)
+                report_status(deployment_id, 'failed', version, reason='superseded')
+            return
+
+        # Recorded first so the new watcher instance (after deploy.sh
         # restarts this service) can report 'completed' on our behalf.
-        set_pending_deployment(deployment_id, version)
+        set_state(deployment_id, DEPLOYING)
 
         # Extract and deploy
         report_status(deployment_id, 'deploying', version)
-        success = extract_and_deploy(zip_path)
+        installed_before = releases.current()
+        if delta:
+            success = deploy_delta(delta, deployment_id, version)
+        else:
+            success = extract_and_deploy(zip_path, stage, deployment_id, version)
 
-        # Clean up zip
-        if os.path.isfile(zip_path):
-            os.remove(zip_path)
+            # Clean up zip
+            if os.path.isfile(zip_path):
+                os.remove(zip_path)
 
         # Note: deploy.sh restarts deployment-watcher at Step 6.1, so
         # the code below typically never runs. The new watcher instance
-        # detects the pending file on startup and reports 'completed'.
+        # finds the deployment in 'deploying' on startup and reports 'completed'.
         if success:
-            failed_deployments.pop(deployment_id, None)
-            set_last_deployed_id(deployment_id)
-            clear_pending_deployment()
+            set_state(deployment_id, COMPLETED)
             log(f"Deployment {deployment_id} (v{version}) completed successfully")
-            report_status(deployment_id, 'completed', version)
+            report_status(deployment_id, 'completed', version, **pop_downtime())
         else:
-            failed_deployments[deployment_id] = failed_deployments.get(deployment_id, 0) + 1
-            clear_pending_deployment()
+            set_state(deployment_id, FAILED, reason='deploy.sh')
             log(f"Deployment {deployment_id} (v{version}) failed during deploy.sh execution")
-            report_status(deployment_id, 'failed', version)
+            if releases.current() != installed_before:
+                # The release was switched; go back to the one that was running.
+                # Its deploy.sh restarts this watcher, so report first.
+                previous = releases.previous() if DEPLOYMENT_AUTO_ROLLBACK else None
+                report_status(deployment_id, 'failed', version, **({'rolledBackTo': previous} if previous else {}))
+                rollback_release()
+            else:
+                report_status(deployment_id, 'failed', version)
 
     finally:
-        release_lock()
+        deployment_state.release()
+        _start_queued_deployment()
+
+
+def _start_queued_deployment():
+    """Handle the deployment that arrived while the lock was held, if any."""
+    global queued_deployment
+    queued = queued_deployment
+    queued_deployment = None
+    if queued and not shutting_down:
+        events.post(EVENT_DEPLOYMENT, queued[1])
+
+
+def on_deployment_event(payload):
+    """Run a deployment in its own thread so the event loop and MQTT stay responsive."""
+    threading.Thread(target=handle_deployment, args=(payload,), daemon=True).start()
 
 
 # --- Cloud MQTT Client ---
 
-def connect_cloud_mqtt(config, _retry=False):
-    """Connect to the cloud MQTT broker and subscribe to deployment topic."""
+def connect_cloud_mqtt(config):
+    """Connect to the cloud MQTT broker and subscribe to deployment topic.
+
+    If the first connect fails (typically the network is not up yet after
+    boot), another attempt is scheduled with backoff. Paho reconnects on its
+    own only after a connect succeeded once.
+    """
     global cloud_mqtt_client
 
     cloud_host = extract_mqtt_host_from_url(config['cloud_url'])
@@ -557,9 +863,8 @@ def connect_cloud_mqtt(config, _retry=False):
 
     def on_connect(client, userdata, flags, reason_code, properties):
         if reason_code == 0:
-            log("Connected to cloud MQTT broker")
             client.subscribe(CLOUD_DEPLOYMENT_TOPIC, qos=1)
-            log(f"Subscribe request sent for {CLOUD_DEPLOYMENT_TOPIC}")
+            events.post(EVENT_CLOUD_CONNECTED)
         else:
             log(f"Failed to connect to cloud MQTT: {reason_code}")
 
@@ -573,18 +878,14 @@ def connect_cloud_mqtt(config, _retry=False):
     def on_message(client, userdata, msg):
         log(f"Received message on {msg.topic} ({len(msg.payload)} bytes)")
         if msg.topic == CLOUD_DEPLOYMENT_TOPIC:
-            # Run in a separate thread so the MQTT network loop stays alive.
-            # Otherwise this callback blocks keepalives and publish flushes
+            # Handed to the main thread, which starts the deployment in its own
+            # thread; blocking here would stall keepalives and publish flushes
             # for the entire download+deploy duration.
-            threading.Thread(
-                target=handle_deployment,
-                args=(msg.payload.decode('utf-8'),),
-                daemon=True
-            ).start()
+            events.post(EVENT_DEPLOYMENT, msg.payload.decode('utf-8'))
 
     def on_disconnect(client, userdata, flags, reason_code, properties):
         if not shutting_down:
-            log(f"Disconnected from cloud MQTT (reason: {reason_code}), will reconnect...")
+            events.post(EVENT_CLOUD_DISCONNECTED, reason_code)
 
     client.on_connect = on_connect
     client.on_subscribe = on_subscribe
@@ -598,40 +899,43 @@ def connect_cloud_mqtt(config, _retry=False):
     except Exception as e:
         log(f"Failed to connect to cloud MQTT: {e}")
         cloud_mqtt_client = None
-        if not _retry:
-            # Start background retry — the initial connect() likely failed
-            # because the network wasn't ready yet (common on boot). Paho only
-            # auto-reconnects after a successful initial connect, so we must
-            # retry ourselves.
-            threading.Thread(
-                target=_retry_cloud_connect,
-                args=(config,),
-                daemon=True
-            ).start()
-
-
-def _retry_cloud_connect(config):
-    """Retry cloud MQTT connection with exponential backoff."""
-    delay = 10
-    max_delay = 300
-    while not shutting_down and cloud_mqtt_client is None:
-        log(f"Retrying cloud MQTT connection in {delay}s...")
-        for _ in range(delay):
-            if shutting_down or cloud_mqtt_client is not None:
-                return
-            time.sleep(1)
-        if cloud_mqtt_client is not None:
-            return
-        connect_cloud_mqtt(config, _retry=True)
-        if cloud_mqtt_client is not None:
-            log("Cloud MQTT connection established on retry")
-            return
-        delay = min(delay * 2, max_delay)
+        _schedule_cloud_retry()
+
+
+def _schedule_cloud_retry():
+    """Try connect_cloud_mqtt() again later, doubling the delay each time."""
+    global cloud_retry_delay, cloud_retry_timer
+    cloud_retry_delay = min(cloud_retry_delay * 2, CLOUD_RETRY_MAX) if cloud_retry_delay else CLOUD_RETRY_MIN
+    log(f"Retrying cloud MQTT connection in {cloud_retry_delay}s...")
+    cloud_retry_timer = events.call_later(cloud_retry_delay, EVENT_CLOUD_RETRY)
+
+
+def on_cloud_retry():
+    global cloud_retry_timer
+    cloud_retry_timer = None
+    # With the config as it is now; a change in between cancels the retry
+    if cloud_mqtt_client is None and cloud_config and cloud_config.get('cloud_enabled'):
+        connect_cloud_mqtt(cloud_config)
+
+
+def on_cloud_connected():
+    global cloud_retry_delay
+    if cloud_retry_delay:
+        log("Cloud MQTT connection established on retry")
+    cloud_retry_delay = None
+    log("Connected to cloud MQTT broker")
+    log(f"Subscribe request sent for {CLOUD_DEPLOYMENT_TOPIC}")
+
+
+def on_cloud_disconnected(reason_code):
+    log(f"Disconnected from cloud MQTT (reason: {reason_code}), will reconnect...")
 
 
 def disconnect_cloud_mqtt():
     """Disconnect from the cloud MQTT broker."""
-    global cloud_mqtt_client
+    global cloud_mqtt_client, cloud_retry_delay, cloud_retry_timer
+    events.cancel(cloud_retry_timer)
+    cloud_retry_timer = cloud_retry_delay = None
     if cloud_mqtt_client:
         try:
             cloud_mqtt_client.loop_stop()
@@ -641,11 +945,17 @@ def disconnect_cloud_mqtt():
         cloud_mqtt_client = None
 
 
-def refresh_cloud_connection():
-    """Re-read cloud config and reconnect if needed."""
+def refresh_cloud_connection(version=None):
+    """Re-read cloud config and reconnect if needed.
+
+    version is the one announced by the backend; without it (older backend)
+    the config is always read from MongoDB.
+    """
     global cloud_config
 
-    new_config = read_cloud_config()
+    new_config = load_cloud_config(version) if version else read_cloud_config()
+    if new_config and not version:
+        config_cache.save(new_config)
     if not new_config:
         log("Could not read cloud config")
         return
@@ -680,7 +990,7 @@ def refresh_cloud_connection():
 # --- Local MQTT Client ---
 
 def setup_local_mqtt():
-    """Connect to the local MQTT broker for config change notifications."""
+    """Connect to the local MQTT broker for config change notifications, download control (and GPS speed)."""
     global local_mqtt_client
 
     client = mqtt.Client(
@@ -705,13 +1015,25 @@ def setup_local_mqtt():
             log("Connected to local MQTT broker")
             client.subscribe(LOCAL_CONFIG_TOPIC, qos=1)
             log(f"Subscribed to {LOCAL_CONFIG_TOPIC}")
+            client.subscribe(DOWNLOAD_CONTROL_TOPIC, qos=1)  # pause / resume package downloads
+            if DEPLOYMENT_REQUIRE_PARKED:
+                # Vehicle speed for the parked check before a cut-over
+                client.subscribe(GPS_DETAILS_TOPIC, qos=0)
         else:
             log(f"Failed to connect to local MQTT: {reason_code}")
 
     def on_message(client, userdata, msg):
         if msg.topic == LOCAL_CONFIG_TOPIC:
-            log("Cloud config changed notification received, refreshing...")
-            refresh_cloud_connection()
+            # Retained: also delivered on every (re)connect, with the current
+            # version. Handled once main() has read the config at startup.
+            events.post(EVENT_CONFIG_CHANGED, _notified_version(msg.payload))
+        elif msg.topic == DOWNLOAD_CONTROL_TOPIC:
+            download_policy.control(msg.payload)
+        elif msg.topic == GPS_DETAILS_TOPIC:
+            try:
+                cutover_policy.update_gps(json.loads(msg.payload))
+            except ValueError:
+                pass
 
     def on_disconnect(client, userdata, flags, reason_code, properties):
         if not shutting_down:
@@ -726,11 +1048,25 @@ def setup_local_mqtt():
     local_mqtt_client = client
 
 
+def on_config_changed(version):
+    log("Cloud config changed notification received, refreshing...")
+    refresh_cloud_connection(version)
+
+
 def shutdown(signum=None, frame=None):
+    """Signal handler: stop from the event loop."""
+    events.post(EVENT_SHUTDOWN)
+
+
+def on_shutdown():
     """Graceful shutdown."""
     global shutting_down
     shutting_down = True
     log("Shutting down...")
+    cutover_policy.interrupt()  # a deployment waiting to cut over gives up
+    download_policy.stop()  # as does a download, keeping the partial file
+    if current_trace:
+        current_trace.interrupt()  # record how far it got
     disconnect_cloud_mqtt()
     if local_mqtt_client:
         try:
@@ -738,17 +1074,23 @@ def shutdown(signum=None, frame=None):
             local_mqtt_client.disconnect()
         except Exception:
             pass
-    release_lock()
-    sys.exit(0)
+    status_reporter.stop(timeout=5)
+    events.stop()
 
 
 def main():
-    global cloud_config
+    global cloud_config, current_trace
 
+    for name, handler in [(EVENT_CONFIG_CHANGED, on_config_changed), (EVENT_DEPLOYMENT, on_deployment_event),
+                          (EVENT_CLOUD_CONNECTED, on_cloud_connected),
+                          (EVENT_CLOUD_DISCONNECTED, on_cloud_disconnected),
+                          (EVENT_CLOUD_RETRY, on_cloud_retry), (EVENT_SHUTDOWN, on_shutdown)]:
+        events.on(name, handler)
     signal.signal(signal.SIGTERM, shutdown)
     signal.signal(signal.SIGINT, shutdown)
 
     log("TrailCurrent Deployment Watcher starting...")
+    status_reporter.start()
 
     # Step 1: Connect to local MQTT
     log("Connecting to local MQTT broker...")
@@ -756,22 +1098,38 @@ def main():
 
     # Step 2: Check for a deployment that completed while we were restarted.
     # deploy.sh restarts this service at Step 6.1, so the previous instance
-    # never gets to report 'completed'. We detect this via the pending file.
+    # never gets to report 'completed'. Its record is still in 'deploying'.
+    # A record whose deploy.sh never got to Step 6.1 (power loss, crash) was
+    # interrupted part way: it counts as a failed attempt and is rolled back.
     # IMPORTANT: This must happen BEFORE connecting to cloud MQTT, because
     # the retained deployment message arrives immediately on connect and
-    # would race with setting last_deployed_id.
-    pending = get_pending_deployment()
-    if pending:
-        dep_id, dep_version = pending
-        log(f"Found pending deployment {dep_id} (v{dep_version}) from before restart")
-        # Give deploy.sh time to fully finish (Steps 6.5-7 run after our restart)
-        time.sleep(15)
-        set_last_deployed_id(dep_id)
-        clear_pending_deployment()
-
-    # Step 3: Read cloud config and connect to cloud MQTT
+    # would race with recording it as completed. There is nothing to wait
+    # for: restarting this service also ended the deploy.sh it ran.
+    pending = []
+    for record in deployment_state.in_state(DEPLOYING):
+        if reached_cutover(record):
+            log(f"Found pending deployment {record['id']} (v{record['version']}) from before restart")
+            set_state(record['id'], COMPLETED)
+            pending.append(record)
+            continue
+        attempts = (set_state(record['id'], FAILED, reason='interrupted') or {}).get('attempts', '?')
+        log(f"Deployment {record['id']} (v{record['version']}) was interrupted before deploy.sh reached "
+            f"Step 6.1 (attempt {attempts}/{MAX_DEPLOY_ATTEMPTS})")
+        if releases.current() == release_name(record['id'], record['version']):
+            # Same as a failed deploy.sh: report first, the rollback's deploy.sh restarts this watcher
+            previous = releases.previous() if DEPLOYMENT_AUTO_ROLLBACK else None
+            report_status(record['id'], 'failed', record['version'], reason='interrupted',
+                          **({'rolledBackTo': previous} if previous else {}))
+            current_trace = DeploymentTrace(record['id'], record['version'], TRACE_FILE, log)
+            rollback_release()
+        else:
+            report_status(record['id'], 'failed', record['version'], reason='interrupted')
+
+    # Step 3: Read cloud config and connect to cloud MQTT. The snapshot is
+    # used if there is one; the retained local/config/cloud_updated version,
+    # handled by the event loop below, triggers a re-read if it is outdated.
     log("Reading cloud configuration...")
-    cloud_config = read_cloud_config()
+    cloud_config = load_cloud_config()
 
     if cloud_config and cloud_config.get('cloud_enabled'):
         if cloud_config.get('cloud_url') and cloud_config.get('cloud_mqtt_username'):
@@ -783,15 +1141,14 @@ def main():
 
     # Now that cloud MQTT is connected, report 'completed' for the pending
     # deployment (if any). The retained message will have been skipped by
-    # handle_deployment since last_deployed_id was already set above.
-    if pending:
-        report_status(dep_id, 'completed', dep_version)
-        log(f"Reported 'completed' for deployment {dep_id} (v{dep_version})")
+    # handle_deployment since it was already recorded as completed above.
+    for record in pending:
+        report_status(record['id'], 'completed', record['version'], **pop_downtime())
+        log(f"Queued 'completed' report for deployment {record['id']} (v{record['version']})")
 
-    # Step 4: Main loop - keep alive
+    # Step 4: Handle events until shutdown; idle means asleep in select()
     log("Deployment watcher running. Waiting for deployment notifications...")
-    while not shutting_down:
-        time.sleep(1)
+    events.run()
 
 
 if __name__ == "__main__":
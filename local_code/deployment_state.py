@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Durable per-deployment state for deployment-watcher.py.
+
+Every deployment the watcher works on has a record in STATE_FILE (atomic
+JSON, fsynced before the rename) that moves through an explicit state
+machine:
+
+  downloading  the package is being fetched (a restart resumes the partial file)
+  staged       extracted and images pre-loaded, waiting for the cut-over
+  deploying    deploy.sh is running. It restarts the watcher at Step 6.1,
+               so the next instance finds the record here and completes it
+               (or fails it, if deploy.sh never got that far)
+  failed       'attempts' counts the failures, also across restarts and reboots
+  superseded   a newer deployment arrived before this one cut over
+
+TRANSITIONS lists the moves allowed from each state; completed is final.
+
+Transitions are read-modify-write under an fcntl lock on STATE_FILE.lock,
+so the CLI and the watcher can update the file together. Only one
+deployment runs at a time: acquire() takes an exclusive flock on LOCK_FILE,
+which the kernel releases when the process dies, so a crash never leaves
+a stale lock behind.
+
+The marker files this replaces (~/.deployment-watcher-last and
+~/.deployment-watcher-pending, next to the state file) are imported once
+and removed.
+
+Usage:
+  deployment_state.py                 # list deployments, newest first
+  deployment_state.py --reset ID      # forget ID (e.g. to retry one that gave up)
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+HOME_DIR = os.path.expanduser('~')
+STATE_FILE = os.path.join(HOME_DIR, '.deployment-watcher-state.json')
+LOCK_FILE = os.path.join(HOME_DIR, '.deployment-watcher.lock')
+LEGACY_LAST_NAME = '.deployment-watcher-last'  # markers of earlier versions, in the state file's directory
+LEGACY_PENDING_NAME = '.deployment-watcher-pending'
+KEEP_RECORDS = 20
+
+# States
+DOWNLOADING = 'downloading'
+STAGED = 'staged'
+DEPLOYING = 'deploying'
+COMPLETED = 'completed'
+FAILED = 'failed'
+SUPERSEDED = 'superseded'
+
+TRANSITIONS = {
+    None: (DOWNLOADING, SUPERSEDED),
+    DOWNLOADING: (DOWNLOADING, STAGED, FAILED, SUPERSEDED),
+    STAGED: (DOWNLOADING, DEPLOYING, FAILED, SUPERSEDED),
+    DEPLOYING: (COMPLETED, FAILED),
+    FAILED: (DOWNLOADING, SUPERSEDED),
+    SUPERSEDED: (DOWNLOADING,),
+    COMPLETED: (),
+}
+
+
+class StateError(Exception):
+    """A transition the state machine does not allow."""
+
+
+class DeploymentState:
+    """Records of recent deployments in path, and the lock that serializes them."""
+
+    def __init__(self, path=STATE_FILE, lock_path=LOCK_FILE, keep=KEEP_RECORDS, log=print):
+        self.path = path
+        self.lock_path = lock_path
+        self.keep = keep
+        self.log = log
+        self._thread_lock = threading.Lock()
+        self._deploy_fd = None
+
+    # --- persistence ---
+
+    @contextmanager
+    def _locked(self):
+        """Hold the state file lock (threads and processes) while reading and writing it."""
+        with self._thread_lock:
+            fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                os.close(fd)  # releases the flock
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return self._import_legacy()
+        except (OSError, ValueError) as e:
+            self.log(f"Ignoring unreadable deployment state {self.path}: {e}")
+            return {'deployments': []}
+        if not isinstance(state, dict) or not isinstance(state.get('deployments'), list):
+            return {'deployments': []}
+        return state
+
+    def _save(self, state):
+        state['deployments'] = state['deployments'][-self.keep:]
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.deployment-state-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)  # the rename itself survives a power cut
+        finally:
+            os.close(dir_fd)
+
+    def _import_legacy(self):
+        """State from the marker files of earlier watcher versions, which are then removed."""
+        directory = os.path.dirname(self.path) or '.'
+        last_file = os.path.join(directory, LEGACY_LAST_NAME)
+        pending_file = os.path.join(directory, LEGACY_PENDING_NAME)
+        state = {'deployments': []}
+        now = int(time.time())
+        try:
+            with open(last_file) as f:
+                last = f.read().strip()
+            if last:
+                state['deployments'].append({'id': last, 'version': 'unknown', 'state': COMPLETED,
+                                             'attempts': 0, 'updated_at': now})
+        except OSError:
+            pass
+        try:
+            with open(pending_file) as f:
+                pending_id, _, version = f.read().strip().partition(':')
+            if pending_id:
+                state['deployments'].append({'id': pending_id, 'version': version or 'unknown',
+                                             'state': DEPLOYING, 'attempts': 0, 'updated_at': now})
+        except OSError:
+            pass
+        if state['deployments']:
+            self.log(f"Imported deployment state from {last_file} / {pending_file}")
+            self._save(state)
+        for path in (last_file, pending_file):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return state
+
+    @staticmethod
+    def _find(state, deployment_id):
+        for record in state['deployments']:
+            if record.get('id') == deployment_id:
+                return record
+        return None
+
+    # --- queries ---
+
+    def records(self):
+        """All records, oldest first (copies)."""
+        with self._locked():
+            return [dict(record) for record in self._load()['deployments']]
+
+    def get(self, deployment_id):
+        with self._locked():
+            record = self._find(self._load(), deployment_id)
+            return dict(record) if record else None
+
+    def state(self, deployment_id):
+        record = self.get(deployment_id)
+        return record['state'] if record else None
+
+    def attempts(self, deployment_id):
+        record = self.get(deployment_id)
+        return record.get('attempts', 0) if record else 0
+
+    def in_state(self, state):
+        """Records currently in state, oldest first."""
+        return [record for record in self.records() if record['state'] == state]
+
+    # --- transitions ---
+
+    def transition(self, deployment_id, new_state, version=None, **fields):
+        """Move deployment_id to new_state, saved before returning. Raises StateError.
+
+        Entering FAILED counts an attempt. Extra fields (e.g. reason) are stored
+        with the record until the next transition.
+        """
+        with self._locked():
+            state = self._load()
+            record = self._find(state, deployment_id)
+            current = record['state'] if record else None
+            if new_state not in TRANSITIONS.get(current, ()):
+                raise StateError(f"deployment {deployment_id}: {current or 'new'} -> {new_state} is not allowed")
+            if record is None:
+                record = {'id': deployment_id, 'version': version or 'unknown', 'attempts': 0}
+            else:
+                state['deployments'].remove(record)  # most recently updated last
+                record = {key: record[key] for key in ('id', 'version', 'attempts') if key in record}
+            if version:
+                record['version'] = version
+            record['state'] = new_state
+            record['updated_at'] = int(time.time())
+            if new_state == FAILED:
+                record['attempts'] = record.get('attempts', 0) + 1
+            elif new_state == COMPLETED:
+                record['attempts'] = 0
+            record.update(fields)
+            state['deployments'].append(record)
+            self._save(state)
+            return dict(record)
+
+    def forget(self, deployment_id):
+        """Drop the record of deployment_id. Returns True if there was one."""
+        with self._locked():
+            state = self._load()
+            record = self._find(state, deployment_id)
+            if record is None:
+                return False
+            state['deployments'].remove(record)
+            self._save(state)
+            return True
+
+    # --- deployment lock ---
+
+    def acquire(self):
+        """Take the deployment lock without waiting. Returns False if a deployment holds it."""
+        with self._thread_lock:
+            if self._deploy_fd is not None:
+                return False
+            fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            os.ftruncate(fd, 0)
+            os.write(fd, str(os.getpid()).encode())  # for people looking at the file
+            self._deploy_fd = fd
+            return True
+
+    def release(self):
+        """Release the deployment lock (no-op if it is not held)."""
+        with self._thread_lock:
+            if self._deploy_fd is not None:
+                os.close(self._deploy_fd)
+                self._deploy_fd = None
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Show or edit the deployment watcher state.')
+    parser.add_argument('--reset', metavar='ID', help='Forget a deployment so the watcher treats it as new.')
+    parser.add_argument('--file', default=STATE_FILE, help=f'State file. Default: {STATE_FILE}')
+    options = parser.parse_args(args)
+
+    store = DeploymentState(options.file, log=lambda msg: print(msg, file=sys.stderr))
+    if options.reset:
+        if not store.forget(options.reset):
+            print(f"No record of deployment {options.reset}", file=sys.stderr)
+            return 1
+        print(f"Forgot deployment {options.reset}")
+        return 0
+    for record in reversed(store.records()):
+        updated = time.strftime('%Y-%m-%d %H:%M', time.localtime(record.get('updated_at', 0)))
+        extra = f"  {record['reason']}" if record.get('reason') else ''
+        print(f"{record['id']:<26} {record.get('version', ''):<12} {record['state']:<12} {updated}  "
+              f"attempts {record.get('attempts', 0)}{extra}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
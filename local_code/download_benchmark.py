@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Measure package download throughput, serial loop vs pipelined reader/writer.
+
+Serves a random package from a local HTTP server in a separate process
+(Range requests supported, optionally throttled) and downloads it with
+PackageDownload once per (mode, segments) pair and repeat, verifying the
+SHA256 each time. Prints the median time, MB/s and the speedup over the
+first setting.
+
+Usage:
+  download_benchmark.py --size 200000000 --repeat 3
+  download_benchmark.py --segments 1,4 --bandwidth 12500000   # ~100 Mbit/s link
+"""
+
+import argparse
+import contextlib
+import hashlib
+import multiprocessing
+import os
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from package_download import PackageDownload
+
+SEND_BLOCK = 1024 * 1024
+MODES = ('serial', 'pipelined')
+
+
+class PackageServer(ThreadingHTTPServer):
+    """Serves one file at /package on 127.0.0.1; bandwidth (B/s) limits each connection."""
+
+    daemon_threads = True
+
+    def __init__(self, path, bandwidth=None):
+        super().__init__(('127.0.0.1', 0), _PackageHandler)
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.bandwidth = bandwidth
+
+
+def _serve(path, bandwidth, ports):
+    server = PackageServer(path, bandwidth)
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+
+@contextlib.contextmanager
+def serve_package(path, bandwidth=None):
+    """Run a PackageServer in a child process (so it does not share the GIL). Yields its URL."""
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(path, bandwidth, ports), daemon=True)
+    process.start()
+    try:
+        yield f"http://127.0.0.1:{ports.get(timeout=10)}/package"
+    finally:
+        process.terminate()
+        process.join()
+
+
+class _PackageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        size = self.server.size
+        start, end = 0, size
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)) + 1, size) if match.group(2) else size
+            if start >= size:
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{end - 1}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start))
+        self.end_headers()
+
+        started = time.monotonic()
+        sent = 0
+        with open(self.server.path, 'rb') as f:
+            f.seek(start)
+            while start + sent < end:
+                block = f.read(min(SEND_BLOCK, end - start - sent))
+                if not block:
+                    break
+                try:
+                    self.wfile.write(block)
+                except OSError:
+                    return
+                sent += len(block)
+                if self.server.bandwidth:
+                    delay = sent / self.server.bandwidth - (time.monotonic() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+
+
+def run_download(url, sha256, size, pipeline, segments, download_dir):
+    """One verified download. Returns seconds."""
+    dest = os.path.join(download_dir, 'package.zip')
+    download = PackageDownload(url, sha256, size, segments=segments, download_dir=download_dir,
+                               log=lambda msg: None, pipeline=pipeline)
+    started = time.monotonic()
+    download.run(dest)
+    elapsed = time.monotonic() - started
+    os.remove(dest)
+    return elapsed
+
+
+def benchmark(size, modes, segment_counts, repeat=1, bandwidth=None):
+    """Returns one result dict per (mode, segments): median seconds and MB/s."""
+    work_dir = tempfile.mkdtemp(prefix='download-benchmark-')
+    results = []
+    try:
+        path = os.path.join(work_dir, 'package.bin')
+        sha256 = hashlib.sha256()
+        with open(path, 'wb') as f:
+            for offset in range(0, size, SEND_BLOCK):
+                block = os.urandom(min(SEND_BLOCK, size - offset))
+                sha256.update(block)
+                f.write(block)
+        with serve_package(path, bandwidth) as url:
+            for segments in segment_counts:
+                for mode in modes:
+                    runs = [run_download(url, sha256.hexdigest(), size, mode == 'pipelined', segments, work_dir)
+                            for _ in range(repeat)]
+                    seconds = statistics.median(runs)
+                    results.append({'mode': mode, 'segments': segments, 'seconds': seconds,
+                                    'mb_per_s': size / 1e6 / seconds, 'runs': repeat})
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def print_results(results):
+    print(f"{'mode':<10} {'segments':>8} {'seconds':>8} {'MB/s':>8} {'speedup':>8}")
+    base = results[0]['seconds'] if results else 1
+    for r in results:
+        print(f"{r['mode']:<10} {r['segments']:>8} {r['seconds']:>8.2f} {r['mb_per_s']:>8.1f} "
+              f"{base / r['seconds']:>7.1f}x")
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Benchmark package downloads from a local HTTP server.')
+    parser.add_argument('--size', type=int, default=100000000, help='Random package size in bytes. Default: 100000000')
+    parser.add_argument('--modes', default=','.join(MODES), help=f"Comma-separated. Default: {','.join(MODES)}")
+    parser.add_argument('--segments', default='1', help='Comma-separated segment counts. Default: 1')
+    parser.add_argument('--bandwidth', type=float, default=None, metavar='BYTES_PER_S',
+                        help='Throttle each connection. Default: unlimited')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per setting (median is reported).')
+    options = parser.parse_args(args)
+
+    modes = options.modes.split(',')
+    if any(mode not in MODES for mode in modes):
+        parser.error(f"modes are {', '.join(MODES)}")
+    segment_counts = [int(count) for count in options.segments.split(',')]
+    print(f"{options.size} random bytes, link {options.bandwidth or 'unlimited'} B/s, "
+          f"{options.repeat} run(s) per setting")
+    print_results(benchmark(options.size, modes, segment_counts, options.repeat, options.bandwidth))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
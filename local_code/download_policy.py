@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+When and how fast deployment packages download, used by deployment-watcher.py.
+
+The RV is often online through a metered LTE hotspot, so DownloadPolicy
+holds package downloads back and limits their rate:
+
+  - DEPLOYMENT_DOWNLOAD_RATE caps the download at that many bytes/s ("500k",
+    "2M"; empty = unlimited), shared by all segment connections through a
+    token bucket
+  - DEPLOYMENT_DOWNLOAD_WINDOW ("HH:MM-HH:MM", local time, may wrap past
+    midnight) only downloads inside that window
+  - DEPLOYMENT_DOWNLOAD_UNMETERED_ONLY=yes only downloads while the default
+    route is not metered: its interface does not match
+    DEPLOYMENT_METERED_INTERFACES (default "wwan*,ppp*,usb*") and
+    NetworkManager does not report it metered (phone hotspots usually are)
+  - "pause" / "resume" on local/deployment/download pauses and resumes
+    downloads; publish it retained to keep it across watcher restarts
+
+A download that becomes blocked part way stops reading until it may go on
+(package_download.py resumes with a Range request if the server dropped
+the connection meanwhile), or gives up if a newer deployment supersedes it.
+
+Usage:
+  download_policy.py [--window 01:00-06:00] [--unmetered-only]   # may a download run now?
+"""
+
+import argparse
+import fnmatch
+import re
+import subprocess
+import sys
+import threading
+import time
+
+from cutover import in_window, parse_window
+
+DOWNLOAD_CONTROL_TOPIC = 'local/deployment/download'
+DEFAULT_METERED_INTERFACES = 'wwan*,ppp*,usb*'
+ROUTE_FILE = '/proc/net/route'
+METERED_CHECK_INTERVAL = 30.0  # seconds a metered check is reused
+CHECK_INTERVAL = 30.0
+MIN_BURST = 65536
+
+
+class DownloadStopped(Exception):
+    """stop() was called while a download was waiting."""
+
+
+def parse_rate(text):
+    """'500k' / '2M' / '100000' (bytes/s) -> int; None for empty or 0. Raises ValueError."""
+    if not text or not text.strip():
+        return None
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kKmM]?)\s*', text)
+    if not match:
+        raise ValueError(f"invalid rate {text!r}, expected bytes/s like 500k or 2M")
+    rate = float(match.group(1)) * {'': 1, 'k': 1e3, 'm': 1e6}[match.group(2).lower()]
+    return int(rate) or None
+
+
+class TokenBucket:
+    """consume(n) blocks so that the average rate stays at rate bytes/s; thread-safe."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(MIN_BURST, rate // 4)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, count):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= count  # may go into debt; the wait pays it off
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+
+def default_interface(route_file=ROUTE_FILE):
+    """Interface of the IPv4 default route, or None."""
+    try:
+        with open(route_file) as f:
+            for line in f.readlines()[1:]:
+                fields = line.split()
+                if len(fields) > 3 and fields[1] == '00000000' and int(fields[3], 16) & 1:  # RTF_UP
+                    return fields[0]
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def networkmanager_metered(interface):
+    """True/False from NetworkManager's GENERAL.METERED for interface, None if unknown."""
+    try:
+        result = subprocess.run(['nmcli', '-t', '-f', 'GENERAL.METERED', 'device', 'show', interface],
+                                capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    value = result.stdout.strip().partition(':')[2]  # "yes", "no", "yes (guessed)", "unknown"
+    if value.startswith('yes'):
+        return True
+    if value.startswith('no'):
+        return False
+    return None
+
+
+class DownloadPolicy:
+    """Rate limit, download window, metered check and pause; set_paused() is fed from local MQTT."""
+
+    def __init__(self, rate=None, window=None, unmetered_only=False, metered_interfaces=DEFAULT_METERED_INTERFACES,
+                 log=print):
+        self.rate = parse_rate(rate) if isinstance(rate, str) else rate
+        self.window = parse_window(window) if isinstance(window, str) else window
+        self.window_text = window if isinstance(window, str) else None
+        self.unmetered_only = unmetered_only
+        self.metered_interfaces = [p.strip() for p in metered_interfaces.split(',') if p.strip()]
+        self.log = log
+        self.paused = False
+        self._bucket = TokenBucket(self.rate) if self.rate else None
+        self._metered = None  # (interface, metered) of the last check
+        self._metered_at = 0.0
+        self._stopped = False
+        self._changed = threading.Event()
+
+    def set_paused(self, paused):
+        if paused != self.paused:
+            self.paused = paused
+            self.log(f"Deployment downloads {'paused' if paused else 'resumed'} via {DOWNLOAD_CONTROL_TOPIC}")
+            self._changed.set()
+
+    def control(self, payload):
+        """Handle a local/deployment/download payload: b'pause' or b'resume'."""
+        command = payload.decode(errors='replace').strip().lower() if isinstance(payload, bytes) else str(payload)
+        if command in ('pause', 'resume'):
+            self.set_paused(command == 'pause')
+        elif command:
+            self.log(f"Ignoring {DOWNLOAD_CONTROL_TOPIC} command {command!r} (expected pause or resume)")
+
+    def interrupt(self):
+        """Wake a waiting download so it re-checks now."""
+        self._changed.set()
+
+    def stop(self):
+        """Make waiting and later downloads raise DownloadStopped (the watcher is shutting down)."""
+        self._stopped = True
+        self._changed.set()
+
+    def metered(self):
+        """(interface, metered) of the default route, checked at most every METERED_CHECK_INTERVAL."""
+        if self._metered is None or time.monotonic() - self._metered_at > METERED_CHECK_INTERVAL:
+            interface = default_interface()
+            metered = False
+            if interface:
+                metered = any(fnmatch.fnmatch(interface, p) for p in self.metered_interfaces) or \
+                    bool(networkmanager_metered(interface))
+            self._metered = (interface, metered)
+            self._metered_at = time.monotonic()
+        return self._metered
+
+    def blocked_reason(self, now=None):
+        """Why a download may not run now, or None if it may."""
+        if self.paused:
+            return f"paused via {DOWNLOAD_CONTROL_TOPIC}"
+        if not in_window(self.window, now):
+            return f"outside download window {self.window_text or self.window}"
+        if self.unmetered_only:
+            interface, metered = self.metered()
+            if metered:
+                return f"connection via {interface} is metered"
+        return None
+
+    def wait(self, should_stop=lambda: False, interval=CHECK_INTERVAL):
+        """Block until a download may run. Returns False if should_stop() became true first."""
+        reported = None
+        started = time.monotonic()
+        while not should_stop() and not self._stopped:
+            reason = self.blocked_reason()
+            if reason is None:
+                if reported:
+                    self.log(f"Download allowed after waiting {time.monotonic() - started:.0f}s")
+                return True
+            if reason != reported:
+                self.log(f"Download deferred: {reason}")
+                reported = reason
+            self._changed.wait(interval)
+            self._changed.clear()
+        return False
+
+    def consume(self, count, should_stop=lambda: False):
+        """Called by PackageDownload before reading count bytes: waits while blocked, then throttles.
+
+        Raises DownloadStopped if stop() was called, or should_stop() becomes
+        true while blocked (e.g. a newer deployment supersedes this one).
+        """
+        if self._stopped or (self.blocked_reason() is not None and not self.wait(should_stop)):
+            raise DownloadStopped("download stopped")
+        if self._bucket:
+            self._bucket.consume(count)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Check whether a deployment download may run now.')
+    parser.add_argument('--window', default='', help='Download window HH:MM-HH:MM (local time).')
+    parser.add_argument('--unmetered-only', action='store_true', help='Only on an unmetered connection.')
+    parser.add_argument('--metered-interfaces', default=DEFAULT_METERED_INTERFACES,
+                        help=f'Interfaces that count as metered. Default: {DEFAULT_METERED_INTERFACES}')
+    options = parser.parse_args(args)
+    try:
+        policy = DownloadPolicy(None, options.window, options.unmetered_only, options.metered_interfaces)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    interface, metered = policy.metered()
+    print(f"default route: {interface or 'none'} ({'metered' if metered else 'unmetered'})")
+    reason = policy.blocked_reason()
+    print(reason or "download allowed now")
+    return 1 if reason else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
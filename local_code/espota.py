@@ -49,6 +49,24 @@
 # Changes
 # 2025-10-07:
 # - Fixed authentication when images might use old MD5 hashes stored in the firmware
+#
+# Changes
+# 2026-10-19:
+# - Added module-level TIMEOUT/PROGRESS defaults so serve() can be used as a library
+# - Added readiness probing: the invitation is retried with short backoff until the
+#   device's OTA listener answers, instead of callers sleeping a fixed delay
+# - Added configurable chunk size and a send window so several chunks can be in
+#   flight while the device's replies are drained (window 1 = stop-and-wait)
+# - Added FirmwareImage: the image is memory-mapped once and its MD5/SHA256 are
+#   computed incrementally and cached per path+mtime+size, instead of reading
+#   the whole file into memory for the MD5 and again for the upload
+# - serve() can report the phase reached, accepted auth variant and bytes sent
+#   through an optional stats dict (used by ota_session.py for retries)
+# - Added gzip-compressed uploads (-z): the compressed copy is cached next to the
+#   image and the invitation carries its size and MD5
+# - Split the challenge/response computation out of authenticate() as auth_response()
+# - serve() takes a progress(sent, total) callback and a local_port of 0 (ephemeral),
+#   and reports the failure message in stats["error"] (used by ota_client.py)
 
 
 from __future__ import print_function
@@ -56,17 +74,142 @@ import socket
 import sys
 import os
 import argparse
+import gzip
 import logging
 import hashlib
+import mmap
 import random
+import select
+import shutil
+import tempfile
+import threading
+import time
 
 # Commands
 FLASH = 0
 SPIFFS = 100
 AUTH = 200
 
+# Authentication variants, as reported in serve() stats["auth"]
+AUTH_NONE = "none"
+AUTH_MD5 = "md5"  # pre-3.3.1 MD5 challenge/response
+AUTH_SHA256 = "sha256"  # PBKDF2-HMAC-SHA256 with SHA256 password hash
+AUTH_SHA256_MD5_PASSWORD = "sha256-md5"  # PBKDF2-HMAC-SHA256 with legacy MD5 password hash
+
 # Constants
 PROGRESS_BAR_LENGTH = 60
+NO_AUTH_ANSWER = "No Answer to our Authentication"
+CHUNK_SIZE = 1024
+WINDOW = 1  # chunks sent per device reply; 1 = stop-and-wait
+
+# Defaults for the settings main() overrides, used when imported as a library
+TIMEOUT = 10
+PROGRESS = False
+
+
+class FirmwareImage:
+    """
+    Image file mapped into memory once, with digests computed incrementally.
+
+    Digests are cached per (path, mtime, size), so every auth attempt and
+    every concurrent upload of the same file hashes it only once.
+    """
+
+    _digests = {}
+    _digests_lock = threading.Lock()
+    HASH_BLOCK = 1 << 20
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.path = os.path.abspath(filename)
+        with open(filename, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.size = stat.st_size
+            self.key = (self.path, stat.st_mtime_ns, stat.st_size)
+            # mmap cannot map an empty file
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+
+    def chunks(self, chunk_size):
+        """Yield the image as zero-copy memoryview slices of chunk_size bytes."""
+        view = memoryview(self._data)
+        for offset in range(0, self.size, chunk_size):
+            yield view[offset:offset + chunk_size]
+
+    def digest(self, algorithm="md5"):
+        """Hex digest of the image, computed once per file version."""
+        with FirmwareImage._digests_lock:
+            entry = FirmwareImage._digests.setdefault(self.key, {"lock": threading.Lock()})
+        with entry["lock"]:
+            if algorithm not in entry:
+                h = hashlib.new(algorithm)
+                for block in self.chunks(self.HASH_BLOCK):
+                    h.update(block)
+                entry[algorithm] = h.hexdigest()
+            return entry[algorithm]
+
+    @property
+    def md5(self):
+        return self.digest("md5")
+
+    @property
+    def sha256(self):
+        return self.digest("sha256")
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            try:
+                self._data.close()
+            except BufferError:
+                pass  # a chunk is still referenced; the map is released with it
+        self._data = b""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def compress_image(filename, level=9):
+    """
+    Path of a gzip copy of filename, cached next to it as <filename>.gz.
+
+    Devices whose Update library accepts gzip images inflate them while
+    flashing; the invitation then carries the size and MD5 of the compressed
+    file, since that is what the device receives and checks. The cache is
+    rebuilt when it is older than the image, and kept in the temp directory
+    if the image directory is read-only. Returns filename itself when
+    compression would not make the upload smaller.
+    """
+    cached = filename + ".gz"
+    if not os.access(os.path.dirname(os.path.abspath(filename)), os.W_OK):
+        digest = hashlib.md5(os.path.abspath(filename).encode()).hexdigest()
+        cached = os.path.join(tempfile.gettempdir(), "espota-%s.bin.gz" % digest)
+
+    try:
+        fresh = os.path.getmtime(cached) >= os.path.getmtime(filename)
+    except OSError:
+        fresh = False
+
+    if not fresh:
+        # Build under a unique name and rename, so concurrent uploads never read a partial file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(cached), suffix=".tmp")
+        try:
+            with open(filename, "rb") as src, os.fdopen(fd, "wb") as raw:
+                # mtime=0 keeps the output (and so its MD5) identical across rebuilds
+                with gzip.GzipFile(filename="", mode="wb", compresslevel=level, fileobj=raw, mtime=0) as dst:
+                    shutil.copyfileobj(src, dst, 1 << 20)
+            os.replace(tmp, cached)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    if os.path.getsize(cached) >= os.path.getsize(filename):
+        logging.info("Compression does not shrink %s, sending it uncompressed", filename)
+        return filename
+    logging.info("Sending %s compressed: %d -> %d bytes", filename, os.path.getsize(filename),
+                 os.path.getsize(cached))
+    return cached
 
 
 # update_progress(): Displays or updates a console progress bar
@@ -140,21 +283,68 @@ def send_invitation_and_get_auth_challenge(remote_addr, remote_port, message):
     return True, data, None
 
 
-def authenticate(
-    remote_addr, remote_port, password, use_md5_password, use_old_protocol, filename, content_size, file_md5, nonce
-):
+def wait_for_invitation(remote_addr, remote_port, message, ready_timeout, ready_event=None):
     """
-    Perform authentication with the ESP device.
+    Probe until the device's OTA listener answers the invitation, or ready_timeout expires.
+
+    Right after an OTA trigger the device is still rebooting into OTA mode and
+    joining WiFi, so its hostname may not resolve yet and invitations go
+    unanswered. Each probe is the real invitation, so the upload can start the
+    moment the device replies. Probes back off from 0.25s to 2s; setting
+    ready_event (e.g. on a CAN "OTA ready" frame) triggers the next probe at once.
+    Returns (success, auth_data, error_message) tuple.
+    """
+    deadline = time.monotonic() + ready_timeout
+    delay = 0.25
+    probes = 0
+    last_error = "No response from the ESP"
+
+    sys.stderr.write("Waiting for %s to accept invitation " % remote_addr)
+    sys.stderr.flush()
+
+    while True:
+        probes += 1
+        sock2 = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            remote_address = (socket.gethostbyname(remote_addr), int(remote_port))
+            sock2.sendto(message.encode(), remote_address)
+            sock2.settimeout(min(1.0, max(deadline - time.monotonic(), 0.1)))
+            data = sock2.recv(69).decode()
+            sys.stderr.write("\n")
+            logging.info("Device ready after %d probe(s)", probes)
+            return True, data, None
+        except socket.gaierror:
+            last_error = "Host %s Not Found" % remote_addr
+        except (socket.timeout, OSError):
+            # Unanswered, or ICMP port unreachable while the listener is not up yet
+            last_error = "No response from the ESP"
+        finally:
+            sock2.close()
+
+        sys.stderr.write(".")
+        sys.stderr.flush()
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            sys.stderr.write("\n")
+            return False, None, last_error
+        if ready_event is not None:
+            if ready_event.wait(min(delay, remaining)):
+                ready_event.clear()
+        else:
+            time.sleep(min(delay, remaining))
+        delay = min(delay * 1.5, 2.0)
+
+
+def auth_response(password, nonce, cnonce_text, use_md5_password, use_old_protocol):
+    """
+    Compute the reply to an AUTH challenge.
 
     Args:
         use_md5_password: If True, hash password with MD5 instead of SHA256
         use_old_protocol: If True, use old MD5 challenge/response protocol (pre-3.3.1)
 
-    Returns (success, error_message) tuple.
+    Returns (cnonce, response, expected_response_length) tuple.
     """
-    cnonce_text = "%s%u%s%s" % (filename, content_size, file_md5, remote_addr)
-    remote_address = (remote_addr, int(remote_port))
-
     if use_old_protocol:
         # Generate client nonce (cnonce)
         cnonce = hashlib.md5(cnonce_text.encode()).hexdigest()
@@ -166,29 +356,48 @@ def authenticate(
         # 2. Create challenge response
         challenge = "%s:%s:%s" % (password_hash, nonce, cnonce)
         response = hashlib.md5(challenge.encode()).hexdigest()
-        expected_response_length = 32
+        return cnonce, response, 32
+
+    # Generate client nonce (cnonce) using SHA256 for new protocol
+    cnonce = hashlib.sha256(cnonce_text.encode()).hexdigest()
+
+    # New PBKDF2-HMAC-SHA256 challenge/response protocol (3.3.1+)
+    # The password can be hashed with either MD5 or SHA256
+    if use_md5_password:
+        # Use MD5 for password hash (for devices that stored MD5 hashes)
+        password_hash = hashlib.md5(password.encode()).hexdigest()
     else:
-        # Generate client nonce (cnonce) using SHA256 for new protocol
-        cnonce = hashlib.sha256(cnonce_text.encode()).hexdigest()
-
-        # New PBKDF2-HMAC-SHA256 challenge/response protocol (3.3.1+)
-        # The password can be hashed with either MD5 or SHA256
-        if use_md5_password:
-            # Use MD5 for password hash (for devices that stored MD5 hashes)
-            password_hash = hashlib.md5(password.encode()).hexdigest()
-        else:
-            # Use SHA256 for password hash (recommended)
-            password_hash = hashlib.sha256(password.encode()).hexdigest()
+        # Use SHA256 for password hash (recommended)
+        password_hash = hashlib.sha256(password.encode()).hexdigest()
+
+    # 2. Derive key using PBKDF2-HMAC-SHA256 with the password hash
+    salt = nonce + ":" + cnonce
+    derived_key = hashlib.pbkdf2_hmac("sha256", password_hash.encode(), salt.encode(), 10000)
+    derived_key_hex = derived_key.hex()
+
+    # 3. Create challenge response
+    challenge = derived_key_hex + ":" + nonce + ":" + cnonce
+    response = hashlib.sha256(challenge.encode()).hexdigest()
+    return cnonce, response, 64
+
+
+def authenticate(
+    remote_addr, remote_port, password, use_md5_password, use_old_protocol, filename, content_size, file_md5, nonce
+):
+    """
+    Perform authentication with the ESP device.
 
-        # 2. Derive key using PBKDF2-HMAC-SHA256 with the password hash
-        salt = nonce + ":" + cnonce
-        derived_key = hashlib.pbkdf2_hmac("sha256", password_hash.encode(), salt.encode(), 10000)
-        derived_key_hex = derived_key.hex()
+    Args:
+        use_md5_password: If True, hash password with MD5 instead of SHA256
+        use_old_protocol: If True, use old MD5 challenge/response protocol (pre-3.3.1)
 
-        # 3. Create challenge response
-        challenge = derived_key_hex + ":" + nonce + ":" + cnonce
-        response = hashlib.sha256(challenge.encode()).hexdigest()
-        expected_response_length = 64
+    Returns (success, error_message) tuple.
+    """
+    cnonce_text = "%s%u%s%s" % (filename, content_size, file_md5, remote_addr)
+    remote_address = (remote_addr, int(remote_port))
+    cnonce, response, expected_response_length = auth_response(
+        password, nonce, cnonce_text, use_md5_password, use_old_protocol
+    )
 
     # Send authentication response
     sock2 = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -200,7 +409,7 @@ def authenticate(
             data = sock2.recv(expected_response_length).decode()
         except:  # noqa: E722
             sock2.close()
-            return False, "No Answer to our Authentication"
+            return False, NO_AUTH_ANSWER
 
         if data != "OK":
             sock2.close()
@@ -213,9 +422,111 @@ def authenticate(
         return False, str(e)
 
 
-def serve(  # noqa: C901
-    remote_addr, local_addr, remote_port, local_port, password, md5_target, filename, command=FLASH
+def upload_chunks(connection, image, chunk_size=CHUNK_SIZE, window=WINDOW, stats=None, progress=None):
+    """
+    Send the image and drain the device's replies (one byte count per read).
+
+    Up to window chunks are sent after the last reply seen before blocking for
+    the next one; replies that have already arrived are drained after every
+    chunk. With window=1 this is the original stop-and-wait upload (one round
+    trip per chunk). The device reads whatever is available, so larger windows
+    only change pacing; TCP flow control still bounds what it has to buffer.
+    Returns True if the device already answered "OK". stats["bytes_sent"]
+    tracks progress, also when the upload fails part way; progress(sent, total)
+    replaces the progress bar if given.
+    """
+    stats = {} if stats is None else stats
+    started = time.monotonic()
+    offset = 0
+    unanswered = 0
+    responses = ""
+    connection.settimeout(10)
+    for chunk in image.chunks(chunk_size):
+        offset += len(chunk)
+        connection.sendall(chunk)
+        stats["bytes_sent"] = offset
+        if progress:
+            progress(offset, image.size)
+        else:
+            update_progress(offset / float(image.size))
+        stats["upload_seconds"] = time.monotonic() - started
+        unanswered += 1
+
+        while unanswered:
+            wait = 10 if unanswered >= window else 0
+            readable, _, _ = select.select([connection], [], [], wait)
+            if not readable:
+                if wait:
+                    raise socket.timeout("No response after %d bytes" % offset)
+                break
+            res = connection.recv(64)
+            if not res:
+                raise ConnectionError("Device closed the connection")
+            response_text = res.decode(errors="replace").strip()
+            logging.debug("Chunk response: '%s'", response_text)
+            # Keep a short tail: "OK" may be split across reads
+            responses = (responses + response_text)[-8:]
+            unanswered = 0
+
+    return "OK" in responses
+
+
+def serve(
+    remote_addr,
+    local_addr,
+    remote_port,
+    local_port,
+    password,
+    md5_target,
+    filename,
+    command=FLASH,
+    ready_timeout=None,
+    ready_event=None,
+    chunk_size=CHUNK_SIZE,
+    window=WINDOW,
+    stats=None,
+    compress=False,
+    progress=None,
+):
+    """
+    Upload filename (a path, or an open FirmwareImage shared between uploads).
+    With compress, a path is sent as its cached gzip copy (see compress_image).
+    local_port 0 listens on an ephemeral port. Returns 0 on success, 1 on failure.
+
+    If a stats dict is given it is filled with the phase reached ("listen",
+    "invitation", "auth", "connect", "upload", "result", "done"), the auth
+    variant that was accepted (or auth_rejected if the device refused the
+    password), the bytes sent and, on failure, the error message.
+    """
+    if isinstance(filename, FirmwareImage):
+        return serve_image(remote_addr, local_addr, remote_port, local_port, password, md5_target, filename,
+                           command, ready_timeout, ready_event, chunk_size, window, stats, progress)
+    if compress:
+        filename = compress_image(filename)
+    with FirmwareImage(filename) as image:
+        return serve_image(remote_addr, local_addr, remote_port, local_port, password, md5_target, image,
+                           command, ready_timeout, ready_event, chunk_size, window, stats, progress)
+
+
+def serve_image(  # noqa: C901
+    remote_addr,
+    local_addr,
+    remote_port,
+    local_port,
+    password,
+    md5_target,
+    image,
+    command=FLASH,
+    ready_timeout=None,
+    ready_event=None,
+    chunk_size=CHUNK_SIZE,
+    window=WINDOW,
+    stats=None,
+    progress=None,
 ):
+    stats = {} if stats is None else stats
+    stats.update(phase="listen", auth=None, auth_rejected=False, bytes_sent=0, upload_seconds=0.0, error=None)
+
     # Create a TCP/IP socket
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_address = (local_addr, local_port)
@@ -223,23 +534,35 @@ def serve(  # noqa: C901
     try:
         sock.bind(server_address)
         sock.listen(1)
+        local_port = sock.getsockname()[1]
     except Exception as e:
         logging.error("Listen Failed: %s", str(e))
+        stats["error"] = "Listen Failed: %s" % e
+        sock.close()
         return 1
 
-    content_size = os.path.getsize(filename)
-    with open(filename, "rb") as f:
-        file_md5 = hashlib.md5(f.read()).hexdigest()
+    filename = image.filename
+    content_size = image.size
+    file_md5 = image.md5
     logging.info("Upload size: %d", content_size)
     message = "%d %d %d %s\n" % (command, local_port, content_size, file_md5)
 
     # Send invitation and get authentication challenge
-    success, data, error = send_invitation_and_get_auth_challenge(remote_addr, remote_port, message)
+    stats["phase"] = "invitation"
+    if ready_timeout:
+        success, data, error = wait_for_invitation(remote_addr, remote_port, message, ready_timeout, ready_event)
+    else:
+        success, data, error = send_invitation_and_get_auth_challenge(remote_addr, remote_port, message)
     if not success:
         logging.error(error)
+        stats["error"] = error
+        sock.close()
         return 1
 
-    if data != "OK":
+    stats["phase"] = "auth"
+    if data == "OK":
+        stats["auth"] = AUTH_NONE
+    else:
         if data.startswith("AUTH"):
             nonce = data.split()[1]
             nonce_length = len(nonce)
@@ -269,9 +592,12 @@ def serve(  # noqa: C901
                     sys.stderr.write("FAIL\n")
                     logging.error("Authentication Failed: %s", auth_error)
                     logging.error("Please check your password and try again")
+                    stats["auth_rejected"] = auth_error != NO_AUTH_ANSWER
+                    stats["error"] = "Authentication Failed: %s" % auth_error
                     return 1
 
                 sys.stderr.write("OK\n")
+                stats["auth"] = AUTH_MD5
                 logging.warning("====================================================================")
                 logging.warning("WARNING: Device is using old MD5 authentication protocol (pre-3.3.1)")
                 logging.warning("Please update to ESP32 Arduino Core 3.3.1+ for improved security.")
@@ -299,6 +625,7 @@ def serve(  # noqa: C901
                     )
 
                     if auth_success:
+                        stats["auth"] = AUTH_SHA256_MD5_PASSWORD
                         logging.warning("Using insecure MD5 hash for password due to legacy device support")
                         logging.warning("Please upgrade devices to ESP32 Arduino Core 3.3.1+ for improved security")
                 else:
@@ -316,6 +643,8 @@ def serve(  # noqa: C901
                         file_md5=file_md5,
                         nonce=nonce,
                     )
+                    if auth_success:
+                        stats["auth"] = AUTH_SHA256
 
                     # Scenario 3: If SHA256 fails, try MD5 password hash (for devices with stored MD5 passwords)
                     if not auth_success:
@@ -329,11 +658,13 @@ def serve(  # noqa: C901
                         if not success:
                             sys.stderr.write("FAIL\n")
                             logging.error("Failed to get new challenge for MD5 retry: %s", error)
+                            stats["error"] = error
                             return 1
 
                         if not data.startswith("AUTH"):
                             sys.stderr.write("FAIL\n")
                             logging.error("Expected AUTH challenge for MD5 retry, got: %s", data)
+                            stats["error"] = "Expected AUTH challenge for MD5 retry, got: %s" % data
                             return 1
 
                         # Get new nonce for second attempt
@@ -355,6 +686,7 @@ def serve(  # noqa: C901
                         )
 
                         if auth_success:
+                            stats["auth"] = AUTH_SHA256_MD5_PASSWORD
                             logging.warning("====================================================================")
                             logging.warning("WARNING: Device authenticated with MD5 password hash (deprecated)")
                             logging.warning("MD5 is cryptographically broken and should not be used.")
@@ -370,16 +702,21 @@ def serve(  # noqa: C901
                     sys.stderr.write("FAIL\n")
                     logging.error("Authentication Failed: %s", auth_error)
                     logging.error("Please check your password and try again")
+                    stats["auth_rejected"] = auth_error != NO_AUTH_ANSWER
+                    stats["error"] = "Authentication Failed: %s" % auth_error
                     return 1
 
                 sys.stderr.write("OK\n")
             else:
                 logging.error("Invalid nonce length: %d (expected 32 or 64)", nonce_length)
+                stats["error"] = "Invalid nonce length: %d (expected 32 or 64)" % nonce_length
                 return 1
         else:
             logging.error("Bad Answer: %s", data)
+            stats["error"] = "Bad Answer: %s" % data
             return 1
 
+    stats["phase"] = "connect"
     logging.info("Waiting for device...")
 
     try:
@@ -389,83 +726,86 @@ def serve(  # noqa: C901
         connection.settimeout(None)
     except:  # noqa: E722
         logging.error("No response from device")
+        stats["error"] = "No response from device"
         sock.close()
         return 1
 
     try:
-        with open(filename, "rb") as f:
-            if PROGRESS:
-                update_progress(0)
-            else:
-                sys.stderr.write("Uploading")
-                sys.stderr.flush()
-            offset = 0
-            while True:
-                chunk = f.read(1024)
-                if not chunk:
-                    break
-                offset += len(chunk)
-                update_progress(offset / float(content_size))
-                connection.settimeout(10)
-                try:
-                    connection.sendall(chunk)
-                    res = connection.recv(10)
-                    response_text = res.decode().strip()
-                    last_response_contained_ok = "OK" in response_text
-                    logging.debug("Chunk response: '%s'", response_text)
-                except Exception as e:
-                    sys.stderr.write("\n")
-                    logging.error("Error Uploading: %s", str(e))
-                    connection.close()
-                    return 1
-
-            if last_response_contained_ok:
-                logging.info("Success")
-                connection.close()
-                return 0
-
+        if PROGRESS and not progress:
+            update_progress(0)
+        elif not progress:
+            sys.stderr.write("Uploading")
+            sys.stderr.flush()
+        try:
+            stats["phase"] = "upload"
+            last_response_contained_ok = upload_chunks(connection, image, chunk_size, window, stats, progress)
+        except Exception as e:
             sys.stderr.write("\n")
-            logging.info("Waiting for result...")
-            count = 0
-            received_any_response = False
-            while count < 10:  # Increased from 5 to 10 attempts
-                count += 1
-                connection.settimeout(30)  # Reduced from 60s to 30s per attempt
-                try:
-                    data = connection.recv(32).decode().strip()
-                    received_any_response = True
-                    logging.info("Result attempt %d: '%s'", count, data)
-
-                    if "OK" in data:
-                        logging.info("Success")
-                        connection.close()
-                        return 0
-                    elif data:  # Got some response but not OK
-                        logging.warning("Unexpected response from device: '%s'", data)
-
-                except socket.timeout:
-                    logging.debug("Timeout waiting for result (attempt %d/10)", count)
-                    continue
-                except Exception as e:
-                    logging.debug("Error receiving result (attempt %d/10): %s", count, str(e))
-                    # Don't return error here, continue trying
+            logging.error("Error Uploading: %s", str(e))
+            stats["error"] = "Error Uploading: %s" % e
+            connection.close()
+            return 1
+
+        stats["phase"] = "result"
+        if last_response_contained_ok:
+            logging.info("Success")
+            stats["phase"] = "done"
+            connection.close()
+            return 0
+
+        sys.stderr.write("\n")
+        logging.info("Waiting for result...")
+        count = 0
+        received_any_response = False
+        responses = ""
+        while count < 10:  # Increased from 5 to 10 attempts
+            count += 1
+            connection.settimeout(30)  # Reduced from 60s to 30s per attempt
+            try:
+                data = connection.recv(32).decode().strip()
+                responses = (responses + data)[-8:]
+                if data.isdigit() and "OK" not in responses:
+                    # Replies to chunks still in flight when the last one was sent
+                    logging.debug("Chunk response: '%s'", data)
+                    count -= 1
                     continue
+                received_any_response = True
+                logging.info("Result attempt %d: '%s'", count, data)
 
-            # After all attempts, provide detailed error information
-            if received_any_response:
-                logging.warning(
-                    "Upload completed but device sent unexpected response(s). This may still be successful."
-                )
-                logging.warning("Device might be rebooting to apply firmware - this is normal.")
-                connection.close()
-                return 0  # Consider it successful if we got any response and upload completed
-            else:
-                logging.error("No response from device after upload completion")
-                logging.error("This could indicate device reboot (normal) or network issues")
-                connection.close()
-                return 1
+                if "OK" in responses:
+                    logging.info("Success")
+                    stats["phase"] = "done"
+                    connection.close()
+                    return 0
+                elif data:  # Got some response but not OK
+                    logging.warning("Unexpected response from device: '%s'", data)
+
+            except socket.timeout:
+                logging.debug("Timeout waiting for result (attempt %d/10)", count)
+                continue
+            except Exception as e:
+                logging.debug("Error receiving result (attempt %d/10): %s", count, str(e))
+                # Don't return error here, continue trying
+                continue
+
+        # After all attempts, provide detailed error information
+        if received_any_response:
+            logging.warning(
+                "Upload completed but device sent unexpected response(s). This may still be successful."
+            )
+            logging.warning("Device might be rebooting to apply firmware - this is normal.")
+            stats["phase"] = "done"
+            connection.close()
+            return 0  # Consider it successful if we got any response and upload completed
+        else:
+            logging.error("No response from device after upload completion")
+            logging.error("This could indicate device reboot (normal) or network issues")
+            stats["error"] = "No response from device after upload completion"
+            connection.close()
+            return 1
     except Exception as e:  # noqa: E722
         logging.error("Error: %s", str(e))
+        stats["error"] = str(e)
     finally:
         connection.close()
 
@@ -531,6 +871,38 @@ def parse_args(unparsed_args):
         help="Show progress output. Does not work for Arduino IDE.",
         default=False,
     )
+    parser.add_argument(
+        "-w",
+        "--wait-ready",
+        dest="ready_timeout",
+        type=float,
+        help="Probe for up to this many seconds until the ESP32 OTA listener answers (use right after an OTA trigger).",
+        default=None,
+    )
+    parser.add_argument(
+        "-z",
+        "--compress",
+        dest="compress",
+        action="store_true",
+        help="Send a gzip-compressed copy of the image (the device must support gzip OTA).",
+        default=False,
+    )
+    parser.add_argument(
+        "-c",
+        "--chunk-size",
+        dest="chunk_size",
+        type=int,
+        help="Bytes per upload chunk. Default: %d" % CHUNK_SIZE,
+        default=CHUNK_SIZE,
+    )
+    parser.add_argument(
+        "-W",
+        "--window",
+        dest="window",
+        type=int,
+        help="Chunks to send before waiting for a device reply. Default: %d (stop-and-wait)" % WINDOW,
+        default=WINDOW,
+    )
     parser.add_argument(
         "-t",
         "--timeout",
@@ -576,6 +948,10 @@ def main(args):
         options.md5_target,
         options.image,
         command,
+        ready_timeout=options.ready_timeout,
+        chunk_size=options.chunk_size,
+        window=max(1, options.window),
+        compress=options.compress,
     )
 
 
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Event loop for deployment-watcher.py's main thread.
+
+MQTT callbacks, signal handlers and worker threads post named events; the
+main thread sleeps in select() on a self-pipe until one arrives or a timer
+is due, then runs that event's handler. Nothing polls, so an idle watcher
+stays asleep until something happens.
+
+Handlers run one at a time on the main thread. Work that takes long (a
+deployment) belongs in a thread that posts an event when it is done.
+"""
+
+import collections
+import heapq
+import itertools
+import os
+import selectors
+import threading
+import time
+import traceback
+
+
+class EventLoop:
+    """post()/call_later() named events; run() dispatches them to on() handlers until stop()."""
+
+    def __init__(self, log=print):
+        self.log = log
+        self._handlers = {}
+        self._events = collections.deque()
+        self._timers = []  # heap of [when, seq, name, args, cancelled]
+        self._seq = itertools.count()
+        self._timer_lock = threading.Lock()
+        self._read_fd, self._write_fd = os.pipe()
+        os.set_blocking(self._read_fd, False)
+        os.set_blocking(self._write_fd, False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._read_fd, selectors.EVENT_READ)
+        self._running = False
+
+    def on(self, name, handler):
+        self._handlers[name] = handler
+
+    def post(self, name, *args):
+        """Queue event name; safe from any thread and from signal handlers."""
+        self._events.append((name, args))
+        self._wake()
+
+    def call_later(self, delay, name, *args):
+        """Post event name after delay seconds. Returns a handle for cancel()."""
+        timer = [time.monotonic() + delay, next(self._seq), name, args, False]
+        with self._timer_lock:
+            heapq.heappush(self._timers, timer)
+        self._wake()
+        return timer
+
+    @staticmethod
+    def cancel(timer):
+        if timer is not None:
+            timer[4] = True
+
+    def stop(self):
+        """Make run() return once the current handler finishes."""
+        self._running = False
+        self._wake()
+
+    def _wake(self):
+        try:
+            os.write(self._write_fd, b'\0')
+        except BlockingIOError:
+            pass  # the pipe is full, so a wake-up is pending anyway
+
+    def _due_timers(self):
+        """Move due timers to the event queue. Returns the seconds until the next one, or None."""
+        now = time.monotonic()
+        with self._timer_lock:
+            while self._timers and self._timers[0][0] <= now:
+                _, _, name, args, cancelled = heapq.heappop(self._timers)
+                if not cancelled:
+                    self._events.append((name, args))
+            return max(0.0, self._timers[0][0] - now) if self._timers else None
+
+    def run(self):
+        """Dispatch events until stop(). A failing handler is logged, not fatal."""
+        self._running = True
+        while self._running:
+            timeout = self._due_timers()
+            if not self._events:
+                self._selector.select(timeout)
+                try:
+                    while os.read(self._read_fd, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+                continue
+            name, args = self._events.popleft()
+            handler = self._handlers.get(name)
+            if handler is None:
+                self.log(f"No handler for event {name}")
+                continue
+            try:
+                handler(*args)
+            except Exception as e:
+                self.log(f"Error handling {name} event: {e}")
+                self.log(traceback.format_exc().rstrip())
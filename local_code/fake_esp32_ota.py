@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Stand-in for an ESP32 running ArduinoOTA, for exercising espota.py without hardware.
+
+Answers the UDP invitation ("OK", or an AUTH challenge when a password is
+set), connects back to the uploader and, like the device, replies to every
+read with the number of bytes written, then "OK" once the whole image
+arrived with the advertised MD5. Gzip images (as sent by espota -z) are
+inflated like the Update library does; .uploads records the flashed size.
+
+Authentication variants (--auth, with --password):
+  md5         pre-3.3.1 MD5 challenge/response (32-char nonce)
+  sha256      3.3.1+ PBKDF2-HMAC-SHA256, password stored as SHA256
+  sha256-md5  3.3.1+ protocol with a legacy MD5-hashed password, so espota's
+              SHA256 attempt fails and it must re-invite with the MD5 hash
+
+Simulated conditions:
+  latency      delay before each reply reaches the uploader (WiFi round trip);
+               reception keeps going meanwhile, as on a real link
+  bandwidth    bytes/second the link delivers (before inflating)
+  write_speed  bytes/second the "flash" accepts, after inflating
+  read_size    bytes per read (ArduinoOTA reads up to 1460)
+  loss         probability that a UDP datagram is dropped, or that a TCP read
+               stalls for rto seconds (a retransmission)
+  seed         makes the loss pattern reproducible
+
+Usage:
+  fake_esp32_ota.py --port 3232 --latency 0.02 --password secret --auth sha256
+  espota.py -i 127.0.0.1 -I 127.0.0.1 -p 3232 -a secret -f firmware.bin
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import queue
+import random
+import socket
+import threading
+import time
+import zlib
+
+OTA_PORT = 3232
+READ_SIZE = 1460
+RTO = 0.2  # stall per "lost" TCP segment
+
+AUTH_MD5 = 'md5'
+AUTH_SHA256 = 'sha256'
+AUTH_SHA256_MD5_PASSWORD = 'sha256-md5'
+AUTH_VARIANTS = (AUTH_MD5, AUTH_SHA256, AUTH_SHA256_MD5_PASSWORD)
+
+AUTH_COMMAND = '200'
+
+
+def expected_auth_response(variant, password, nonce, cnonce):
+    """The response a device with this auth variant accepts (see espota.authenticate)."""
+    if variant == AUTH_MD5:
+        password_hash = hashlib.md5(password.encode()).hexdigest()
+        return hashlib.md5(("%s:%s:%s" % (password_hash, nonce, cnonce)).encode()).hexdigest()
+
+    if variant == AUTH_SHA256_MD5_PASSWORD:
+        password_hash = hashlib.md5(password.encode()).hexdigest()
+    else:
+        password_hash = hashlib.sha256(password.encode()).hexdigest()
+    salt = nonce + ":" + cnonce
+    derived_key = hashlib.pbkdf2_hmac("sha256", password_hash.encode(), salt.encode(), 10000)
+    return hashlib.sha256((derived_key.hex() + ":" + nonce + ":" + cnonce).encode()).hexdigest()
+
+
+class FakeEsp32:
+    """ArduinoOTA responder on a UDP port. Finished uploads are appended to .uploads."""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, write_speed=None, read_size=READ_SIZE,
+                 password=None, auth=AUTH_SHA256, loss=0.0, rto=RTO, seed=None, bandwidth=None):
+        if auth not in AUTH_VARIANTS:
+            raise ValueError(f'Unknown auth variant: {auth}')
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.write_speed = write_speed
+        self.bandwidth = bandwidth
+        self.read_size = read_size
+        self.password = password
+        self.auth = auth
+        self.loss = loss
+        self.rto = rto
+        self.random = random.Random(seed)
+        self.uploads = []
+        self.auth_attempts = 0
+        self.dropped = 0
+        self._udp = None
+        self._running = False
+        self._pending = None  # invitation waiting for its auth response
+
+    def start(self):
+        self._udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._udp.bind((self.host, self.port))
+        self._udp.settimeout(0.5)
+        self.port = self._udp.getsockname()[1]
+        self._running = True
+        threading.Thread(target=self._serve_invitations, name='fake-esp32', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._udp:
+            self._udp.close()
+            self._udp = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _lost(self):
+        return self.loss and self.random.random() < self.loss
+
+    def _reply(self, text, addr):
+        if self._lost():
+            self.dropped += 1
+            return
+        self._udp.sendto(text.encode(), addr)
+
+    def _serve_invitations(self):
+        while self._running:
+            try:
+                data, addr = self._udp.recvfrom(256)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            if self._lost():
+                self.dropped += 1
+                continue
+            fields = data.decode(errors='replace').split()
+
+            if fields and fields[0] == AUTH_COMMAND and len(fields) == 3:
+                self._check_auth(fields[1], fields[2], addr)
+            elif len(fields) == 4:
+                invitation = (int(fields[1]), int(fields[2]), fields[3])
+                if self.password:
+                    # Old protocol nonces are MD5 (32 chars), new ones SHA256 (64 chars)
+                    digest = hashlib.md5 if self.auth == AUTH_MD5 else hashlib.sha256
+                    nonce = digest(os.urandom(16)).hexdigest()
+                    self._pending = (invitation, nonce)
+                    self._reply('AUTH ' + nonce, addr)
+                else:
+                    self._reply('OK', addr)
+                    self._receive(addr[0], *invitation)
+            else:
+                logging.warning("Ignoring malformed datagram %r", data)
+
+    def _check_auth(self, cnonce, response, addr):
+        self.auth_attempts += 1
+        if self._pending is None:
+            self._reply('No invitation', addr)
+            return
+        invitation, nonce = self._pending
+        self._pending = None  # back to idle either way, like OTA_IDLE after a failure
+        if response != expected_auth_response(self.auth, self.password, nonce, cnonce):
+            self._reply('Authentication Failed', addr)
+            return
+        self._reply('OK', addr)
+        self._receive(addr[0], *invitation)
+
+    def _receive(self, host, port, size, expected_md5):
+        """Take one upload over TCP, like ArduinoOTA's _runUpdate()."""
+        started = time.monotonic()
+        result = {'size': size, 'received': 0, 'md5_ok': False, 'duration': None, 'stalls': 0,
+                  'compressed': False, 'flashed': 0}
+        try:
+            connection = socket.create_connection((host, port), timeout=10)
+        except OSError as e:
+            logging.warning("Could not connect back to %s:%d: %s", host, port, e)
+            return
+
+        replies = queue.Queue()
+        sender = threading.Thread(target=self._send_replies, args=(connection, replies), daemon=True)
+        sender.start()
+
+        md5 = hashlib.md5()
+        inflater = None
+        try:
+            while result['received'] < size:
+                data = connection.recv(self.read_size)
+                if not data:
+                    break
+                if result['received'] == 0 and data[:2] == b'\x1f\x8b':
+                    result['compressed'] = True
+                    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                flashed = len(inflater.decompress(data)) if inflater else len(data)
+                result['flashed'] += flashed
+                if self._lost():
+                    result['stalls'] += 1
+                    time.sleep(self.rto)
+                # Reception and flash writes alternate in ArduinoOTA's loop
+                delay = len(data) / self.bandwidth if self.bandwidth else 0
+                if self.write_speed:
+                    delay += flashed / self.write_speed
+                if delay:
+                    time.sleep(delay)
+                md5.update(data)
+                result['received'] += len(data)
+                replies.put((time.monotonic() + self.latency, str(len(data))))
+            result['md5_ok'] = result['received'] == size and md5.hexdigest() == expected_md5
+            replies.put((time.monotonic() + self.latency, 'OK' if result['md5_ok'] else 'ERR'))
+        except OSError as e:
+            logging.warning("Upload interrupted: %s", e)
+        finally:
+            replies.put(None)
+            sender.join(timeout=self.latency + 10)
+            connection.close()
+        result['duration'] = time.monotonic() - started
+        self.uploads.append(result)
+
+    @staticmethod
+    def _send_replies(connection, replies):
+        while True:
+            item = replies.get()
+            if item is None:
+                return
+            due, text = item
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                connection.sendall(text.encode())
+            except OSError:
+                return
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Fake ESP32 ArduinoOTA target for testing espota.py.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on. Default: 127.0.0.1')
+    parser.add_argument('--port', type=int, default=OTA_PORT, help=f'UDP invitation port. Default: {OTA_PORT}')
+    parser.add_argument('--latency', type=float, default=0.0, metavar='SECONDS',
+                        help='Delay before each reply reaches the uploader.')
+    parser.add_argument('--write-speed', type=float, default=None, metavar='BYTES_PER_S',
+                        help='Simulated flash write rate. Default: unlimited')
+    parser.add_argument('--bandwidth', type=float, default=None, metavar='BYTES_PER_S',
+                        help='Simulated link throughput. Default: unlimited')
+    parser.add_argument('--read-size', type=int, default=READ_SIZE, help=f'Bytes per read. Default: {READ_SIZE}')
+    parser.add_argument('--password', default=None, help='Require authentication with this password.')
+    parser.add_argument('--auth', choices=AUTH_VARIANTS, default=AUTH_SHA256,
+                        help=f'Authentication variant when --password is set. Default: {AUTH_SHA256}')
+    parser.add_argument('--loss', type=float, default=0.0, help='Drop/stall probability (0-1). Default: 0')
+    parser.add_argument('--rto', type=float, default=RTO, help=f'Stall per lost TCP segment. Default: {RTO}')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for the loss pattern.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    options = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)-8s %(message)s', datefmt='%H:%M:%S')
+    device = FakeEsp32(options.host, options.port, options.latency, options.write_speed, options.read_size,
+                       options.password, options.auth, options.loss, options.rto, options.seed, options.bandwidth)
+    device.start()
+    logging.info("Fake ESP32 listening on %s:%d%s", device.host, device.port,
+                 f" (auth {device.auth})" if device.password else '')
+    try:
+        seen = 0
+        while True:
+            time.sleep(0.5)
+            for upload in device.uploads[seen:]:
+                logging.info("Upload: %d/%d bytes, md5 %s, %.2fs, %d stall(s)", upload['received'], upload['size'],
+                             'ok' if upload['md5_ok'] else 'MISMATCH', upload['duration'], upload['stalls'])
+            seen = len(device.uploads)
+    except KeyboardInterrupt:
+        device.stop()
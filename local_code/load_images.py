@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Load Docker image tarballs into the local daemon, skipping images it already has.
+
+Each tarball's manifest.json names the image config blob, whose SHA256 is
+the image ID. When the daemon already has that ID under every tag the
+tarball carries, `docker load` is skipped; when it has the ID but not all
+of the tags, the missing tags are added with `docker tag`. The remaining
+tarballs are loaded, up to --parallel at a time, and a summary lists each
+image's outcome and time.
+
+Runs with the system python3 (stdlib only): deploy.sh Step 1 calls it
+before the cantomqtt venv exists on a first deployment.
+
+Usage:
+  load_images.py [--parallel 2] images/*.tar
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_PARALLEL = 2
+INSPECT_TIMEOUT = 30
+LOAD_TIMEOUT = 1800
+
+# Outcomes
+PRESENT = 'present'
+TAGGED = 'tagged'
+LOADED = 'loaded'
+FAILED = 'failed'
+
+
+def read_images(path):
+    """Returns [{'id': 'sha256:...', 'tags': [...]}] for the images in a docker save tarball."""
+    images = []
+    with tarfile.open(path, 'r:') as tar:
+        manifest = json.load(tar.extractfile('manifest.json'))
+        for entry in manifest:
+            config = tar.extractfile(entry['Config'])
+            digest = hashlib.sha256(config.read()).hexdigest()
+            images.append({'id': f'sha256:{digest}', 'tags': entry.get('RepoTags') or []})
+    return images
+
+
+def daemon_tags(image_id):
+    """Tags the daemon has for image_id, or None if it does not have the image."""
+    try:
+        result = subprocess.run(['docker', 'image', 'inspect', '--format', '{{json .RepoTags}}', image_id],
+                                capture_output=True, text=True, timeout=INSPECT_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if result.returncode != 0:
+        return None
+    try:
+        return json.loads(result.stdout) or []
+    except ValueError:
+        return []
+
+
+def plan(path):
+    """
+    What loading path takes: (PRESENT|TAGGED, [(id, tag), ...] to add) or (LOADED, []).
+    Tarballs that cannot be read are loaded, as before.
+    """
+    try:
+        images = read_images(path)
+    except (tarfile.TarError, OSError, KeyError, ValueError):
+        return LOADED, []
+    if not images:
+        return LOADED, []
+    retag = []
+    for image in images:
+        tags = daemon_tags(image['id'])
+        if tags is None:
+            return LOADED, []
+        retag += [(image['id'], tag) for tag in image['tags'] if tag not in tags]
+    return (TAGGED if retag else PRESENT), retag
+
+
+def load(path):
+    """Bring one tarball's images into the daemon. Returns a result dict."""
+    started = time.monotonic()
+    outcome, retag = plan(path)
+    detail = ''
+    if outcome == TAGGED:
+        for image_id, tag in retag:
+            result = subprocess.run(['docker', 'tag', image_id, tag], capture_output=True, text=True)
+            if result.returncode != 0:
+                outcome = LOADED  # fall back to loading the tarball
+                break
+        else:
+            detail = ', '.join(tag for _, tag in retag)
+    if outcome == LOADED:
+        try:
+            result = subprocess.run(['docker', 'load', '-i', path], capture_output=True, text=True,
+                                    timeout=LOAD_TIMEOUT)
+            lines = (result.stdout if result.returncode == 0 else result.stderr or result.stdout).strip().splitlines()
+            detail = lines[-1] if lines else ''
+            if result.returncode != 0:
+                outcome = FAILED
+        except (OSError, subprocess.TimeoutExpired) as e:
+            outcome, detail = FAILED, str(e)
+    return {'path': path, 'outcome': outcome, 'detail': detail, 'seconds': time.monotonic() - started}
+
+
+def load_all(paths, parallel=DEFAULT_PARALLEL, log=print):
+    """Load the tarballs, logging each result as it finishes. Returns the results in input order."""
+    def run(path):
+        result = load(path)
+        detail = f" ({result['detail']})" if result['detail'] else ''
+        log(f"  {os.path.basename(path)}: {result['outcome']} in {result['seconds']:.1f}s{detail}")
+        return result
+
+    with ThreadPoolExecutor(max(1, parallel)) as pool:
+        return list(pool.map(run, paths))
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Load Docker image tarballs the daemon does not already have.')
+    parser.add_argument('tarballs', nargs='*')
+    parser.add_argument('--parallel', type=int, default=DEFAULT_PARALLEL,
+                        help=f'Tarballs loaded at once. Default: {DEFAULT_PARALLEL}')
+    options = parser.parse_args(args)
+
+    paths = [path for path in options.tarballs if os.path.isfile(path)]
+    started = time.monotonic()
+    results = load_all(paths, options.parallel, log=lambda line: print(line, flush=True))
+
+    print("  Image summary:")
+    width = max((len(os.path.basename(r['path'])) for r in results), default=0)
+    for r in results:
+        print(f"    {os.path.basename(r['path']):<{width}}  {r['outcome']:<7}  {r['seconds']:6.1f}s")
+    counts = {outcome: sum(r['outcome'] == outcome for r in results) for outcome in (LOADED, TAGGED, PRESENT, FAILED)}
+    print(f"  Loaded {counts[LOADED]}, re-tagged {counts[TAGGED]}, already present {counts[PRESENT]}, "
+          f"failed {counts[FAILED]} in {time.monotonic() - started:.1f}s")
+    return 1 if counts[FAILED] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Measure espota upload time and robustness across chunk sizes, send windows
+and simulated WiFi conditions.
+
+Uploads a random image to a local fake ESP32 (fake_esp32_ota.py) once per
+(condition, chunk:window) pair and repeat, and prints the median time,
+throughput and how many runs succeeded. Window 1 is the original
+stop-and-wait upload.
+
+Conditions are presets from CONDITIONS (--conditions lan,wifi,weak-wifi) or
+a custom one built from --latency/--bandwidth/--write-speed/--loss.
+
+Usage:
+  ota_benchmark.py --conditions wifi,weak-wifi --repeat 3
+  ota_benchmark.py --settings 1024:1,4096:8 --latency 0.02 --loss 0.01
+  ota_benchmark.py --password secret --auth sha256-md5
+  ota_benchmark.py --image firmware/wired/<type>/firmware.bin --compress
+"""
+
+import argparse
+import contextlib
+import io
+import logging
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+
+import espota
+from fake_esp32_ota import AUTH_SHA256, AUTH_VARIANTS, FakeEsp32
+
+DEFAULT_SETTINGS = '1024:1,1024:8,4096:1,4096:8,8192:16'
+
+# Simulated links: reply latency (s), link and flash write speed (B/s), loss probability
+CONDITIONS = {
+    'lan': {'latency': 0.002, 'bandwidth': None, 'write_speed': None, 'loss': 0.0},
+    'wifi': {'latency': 0.02, 'bandwidth': 500000, 'write_speed': 800000, 'loss': 0.0},
+    'weak-wifi': {'latency': 0.06, 'bandwidth': 150000, 'write_speed': 800000, 'loss': 0.02},
+}
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def parse_settings(text):
+    """'1024:1,4096:8' -> [(1024, 1), (4096, 8)]"""
+    settings = []
+    for item in text.split(','):
+        chunk_size, _, window = item.partition(':')
+        settings.append((int(chunk_size), int(window or 1)))
+    return settings
+
+
+def run_upload(device, image, chunk_size, window, password='', compress=False):
+    """One upload through espota.serve(). Returns (ok, seconds)."""
+    finished = len(device.uploads)
+    started = time.monotonic()
+    with contextlib.redirect_stderr(io.StringIO()):  # espota progress dots
+        rc = espota.serve('127.0.0.1', '127.0.0.1', device.port, free_port(), password, False, image,
+                          espota.FLASH, chunk_size=chunk_size, window=window, compress=compress)
+    elapsed = time.monotonic() - started
+    if rc != 0:
+        return False, elapsed
+    # Let the device record the upload before its result is checked
+    deadline = time.monotonic() + 5
+    while len(device.uploads) == finished and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return len(device.uploads) > finished and device.uploads[-1]['md5_ok'], elapsed
+
+
+def benchmark(size, settings, conditions, repeat=1, password=None, auth=AUTH_SHA256, seed=1, image=None,
+              compress=False):
+    """Returns one result dict per (condition, setting): median seconds, KiB/s and ok/runs.
+
+    Uses a random image of size bytes unless an image path is given.
+    """
+    owned = image is None
+    if owned:
+        fd, image = tempfile.mkstemp(suffix='.bin')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(os.urandom(size))
+    size = os.path.getsize(image)
+    results = []
+    try:
+        for name, condition in conditions:
+            device = FakeEsp32(latency=condition['latency'], write_speed=condition['write_speed'],
+                               loss=condition['loss'], password=password, auth=auth, seed=seed,
+                               bandwidth=condition['bandwidth'])
+            with device:
+                for chunk_size, window in settings:
+                    runs = [run_upload(device, image, chunk_size, window, password or '', compress)
+                            for _ in range(repeat)]
+                    seconds = statistics.median(t for _, t in runs)
+                    results.append({'condition': name, 'chunk_size': chunk_size, 'window': window,
+                                    'seconds': seconds, 'kib_per_s': size / 1024 / seconds,
+                                    'ok': sum(1 for ok, _ in runs if ok), 'runs': repeat})
+    finally:
+        if owned:
+            os.remove(image)
+            if os.path.exists(image + '.gz'):
+                os.remove(image + '.gz')
+    return results
+
+
+def print_results(results):
+    print(f"{'condition':<10} {'chunk':>7} {'window':>6} {'seconds':>8} {'KiB/s':>9} {'speedup':>8} {'ok':>6}")
+    baseline = {}
+    for r in results:
+        base = baseline.setdefault(r['condition'], r['seconds'])
+        print(f"{r['condition']:<10} {r['chunk_size']:>7} {r['window']:>6} {r['seconds']:>8.2f} "
+              f"{r['kib_per_s']:>9.1f} {base / r['seconds']:>7.1f}x {r['ok']:>3}/{r['runs']}")
+
+
+def parse_args(unparsed_args):
+    parser = argparse.ArgumentParser(description='Benchmark espota upload settings against a fake ESP32.')
+    parser.add_argument('--size', type=int, default=1500000, help='Random image size in bytes. Default: 1500000')
+    parser.add_argument('--image', default=None, help='Upload this file instead of a random image.')
+    parser.add_argument('--compress', action='store_true', help='Send the image gzip-compressed (espota -z).')
+    parser.add_argument('--settings', default=DEFAULT_SETTINGS,
+                        help=f'Comma-separated chunk:window pairs. Default: {DEFAULT_SETTINGS}')
+    parser.add_argument('--conditions', default=None,
+                        help=f"Comma-separated presets ({', '.join(CONDITIONS)}). "
+                             "Default: one custom condition from the options below")
+    parser.add_argument('--latency', type=float, default=0.005, metavar='SECONDS',
+                        help='Simulated reply latency. Default: 0.005')
+    parser.add_argument('--bandwidth', type=float, default=None, metavar='BYTES_PER_S',
+                        help='Simulated link throughput. Default: unlimited')
+    parser.add_argument('--write-speed', type=float, default=None, metavar='BYTES_PER_S',
+                        help='Simulated flash write rate. Default: unlimited')
+    parser.add_argument('--loss', type=float, default=0.0, help='Simulated loss probability. Default: 0')
+    parser.add_argument('--password', default=None, help='Make the fake device require this OTA password.')
+    parser.add_argument('--auth', choices=AUTH_VARIANTS, default=AUTH_SHA256,
+                        help=f'Authentication variant with --password. Default: {AUTH_SHA256}')
+    parser.add_argument('--invite-timeout', type=int, default=2,
+                        help='espota invitation timeout per attempt (seconds). Default: 2')
+    parser.add_argument('--seed', type=int, default=1, help='Loss pattern seed. Default: 1')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per setting (median is reported).')
+    return parser.parse_args(unparsed_args)
+
+
+def main(args):
+    options = parse_args(args)
+    logging.basicConfig(level=logging.CRITICAL, format='%(asctime)-8s [%(levelname)s]: %(message)s',
+                        datefmt='%H:%M:%S')
+    espota.TIMEOUT = options.invite_timeout
+
+    if options.conditions:
+        try:
+            conditions = [(name, CONDITIONS[name]) for name in options.conditions.split(',')]
+        except KeyError as e:
+            print(f"Unknown condition {e}; choose from {', '.join(CONDITIONS)}", file=sys.stderr)
+            return 1
+    else:
+        conditions = [('custom', {'latency': options.latency, 'bandwidth': options.bandwidth,
+                                  'write_speed': options.write_speed, 'loss': options.loss})]
+
+    print(f"Image {options.image or f'{options.size} random bytes'}, {options.repeat} run(s) per setting"
+          + (f", auth {options.auth}" if options.password else '') + (', compressed' if options.compress else ''))
+    for name, condition in conditions:
+        print(f"  {name}: latency {condition['latency'] * 1000:.0f} ms, "
+              f"link {condition['bandwidth'] or 'unlimited'} B/s, "
+              f"write {condition['write_speed'] or 'unlimited'} B/s, loss {condition['loss']:.0%}")
+    results = benchmark(options.size, parse_settings(options.settings), conditions, options.repeat,
+                        options.password, options.auth, options.seed, options.image, options.compress)
+    print_results(results)
+    return 0 if all(r['ok'] == r['runs'] for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+asyncio ArduinoOTA client for uploading firmware to many modules from one process.
+
+Each upload is espota.serve() in a worker thread, so the protocol lives in
+espota.py only; this module keeps every setting per call and reports
+progress through callbacks instead of module globals:
+
+    result = await upload('esp32-8F56D8', 'firmware.bin', password='secret',
+                          progress=lambda sent, total: print(sent, total))
+    results = await upload_many(['esp32-8F56D8', 'esp32-1A2B3C'], 'firmware.bin', limit=4)
+
+Each upload listens on its own ephemeral port. Failures are reported in the
+returned UploadResult rather than raised. The default executor bounds how
+many uploads run at once, so keep limit below its worker count.
+
+Usage:
+  ota_client.py -f firmware.bin [-a password] [--parallel 4] esp32-8F56D8 esp32-1A2B3C
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import time
+
+import espota
+
+OTA_PORT = 3232
+CHUNK_SIZE = 4096
+WINDOW = 8
+
+
+class UploadResult:
+    """Outcome of one upload. phase is the last step reached ("done" on success)."""
+
+    def __init__(self, host, size=0):
+        self.host = host
+        self.ok = False
+        self.phase = 'invitation'
+        self.error = None
+        self.auth = None
+        self.auth_rejected = False
+        self.size = size
+        self.bytes_sent = 0
+        self.seconds = 0.0
+        self.upload_seconds = 0.0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def __repr__(self):
+        state = 'ok' if self.ok else f'failed in {self.phase}: {self.error}'
+        return f'<UploadResult {self.host} {state}, {self.bytes_sent}/{self.size} bytes, {self.seconds:.1f}s>'
+
+
+def _serve(host, image, port, local_addr, local_port, password, command, chunk_size, window, md5_password,
+           ready_timeout, ready_event, progress):
+    """espota.serve() for one host, in a worker thread. Returns an UploadResult."""
+    result = UploadResult(host, image.size)
+    stats = {}
+    started = time.monotonic()
+    try:
+        rc = espota.serve(host, local_addr, port, local_port, password, md5_password, image, command,
+                          ready_timeout, ready_event, chunk_size, window, stats, progress=progress)
+    except Exception as e:
+        rc = 1
+        stats['error'] = str(e) or e.__class__.__name__
+    result.seconds = time.monotonic() - started
+    result.ok = rc == 0
+    result.phase = stats.get('phase', result.phase)
+    result.error = None if result.ok else stats.get('error') or 'Upload failed'
+    result.auth = stats.get('auth')
+    result.auth_rejected = stats.get('auth_rejected', False)
+    result.bytes_sent = stats.get('bytes_sent', 0)
+    result.upload_seconds = stats.get('upload_seconds', 0.0)
+    return result
+
+
+async def _open_image(image, compress):
+    loop = asyncio.get_running_loop()
+    if compress:
+        image = await loop.run_in_executor(None, espota.compress_image, image)
+    opened = await loop.run_in_executor(None, espota.FirmwareImage, image)
+    await loop.run_in_executor(None, lambda: opened.md5)  # hash once, off the event loop
+    return opened
+
+
+async def upload(host, image, port=OTA_PORT, password='', command=espota.FLASH, chunk_size=CHUNK_SIZE,
+                 window=WINDOW, md5_password=False, compress=False, local_addr='0.0.0.0', local_port=0,
+                 ready_timeout=None, ready_event=None, progress=None):
+    """
+    Upload image (a path or an open espota.FirmwareImage) to host. Returns an UploadResult.
+
+    ready_timeout probes the module until its OTA listener answers (use right
+    after an OTA trigger); setting the threading.Event ready_event wakes the next
+    probe immediately. progress(sent_bytes, total_bytes) is called on the event
+    loop after each chunk.
+    """
+    loop = asyncio.get_running_loop()
+    owned = not isinstance(image, espota.FirmwareImage)
+    if owned:
+        try:
+            image = await _open_image(image, compress)
+        except OSError as e:
+            result = UploadResult(host)
+            result.error = str(e)
+            return result
+    report = (lambda sent, total: loop.call_soon_threadsafe(progress, sent, total)) if progress else None
+    try:
+        return await loop.run_in_executor(None, _serve, host, image, port, local_addr, local_port, password,
+                                          command, chunk_size, window, md5_password, ready_timeout, ready_event,
+                                          report)
+    finally:
+        if owned:
+            image.close()
+
+
+async def upload_many(hosts, image, limit=4, progress=None, compress=False, **options):
+    """
+    Upload one image to every host, at most limit at a time. Returns UploadResults in host order.
+
+    progress(host, sent_bytes, total_bytes) is called after each chunk; other
+    options are passed to upload().
+    """
+    try:
+        opened = await _open_image(image, compress) if not isinstance(image, espota.FirmwareImage) else image
+    except OSError as e:
+        results = [UploadResult(host) for host in hosts]
+        for result in results:
+            result.error = str(e)
+        return results
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def one(host):
+        async with semaphore:
+            report = (lambda sent, total: progress(host, sent, total)) if progress else None
+            return await upload(host, opened, progress=report, **options)
+
+    try:
+        return await asyncio.gather(*(one(host) for host in hosts))
+    finally:
+        if opened is not image:
+            opened.close()
+
+
+def parse_args(unparsed_args):
+    parser = argparse.ArgumentParser(description='Upload firmware to ESP32 modules concurrently over OTA.')
+    parser.add_argument('hosts', nargs='+', help='Module hostnames or IP addresses.')
+    parser.add_argument('-f', '--file', dest='image', required=True, help='Image file.')
+    parser.add_argument('-p', '--port', type=int, default=OTA_PORT, help=f'ESP32 OTA port. Default: {OTA_PORT}')
+    parser.add_argument('-a', '--auth', default='', help='OTA password.')
+    parser.add_argument('-m', '--md5-target', action='store_true', help='Use the legacy MD5 password hash.')
+    parser.add_argument('-z', '--compress', action='store_true', help='Send the image gzip-compressed.')
+    parser.add_argument('-c', '--chunk-size', type=int, default=CHUNK_SIZE,
+                        help=f'Bytes per upload chunk. Default: {CHUNK_SIZE}')
+    parser.add_argument('-W', '--window', type=int, default=WINDOW,
+                        help=f'Chunks in flight per device reply. Default: {WINDOW}')
+    parser.add_argument('-w', '--wait-ready', dest='ready_timeout', type=float, default=None,
+                        help='Probe for up to this many seconds until each module answers.')
+    parser.add_argument('--parallel', type=int, default=4, help='Concurrent uploads. Default: 4')
+    parser.add_argument('-d', '--debug', action='store_true', help='Show debug output.')
+    return parser.parse_args(unparsed_args)
+
+
+def main(args):
+    options = parse_args(args)
+    logging.basicConfig(level=logging.DEBUG if options.debug else logging.INFO,
+                        format='%(asctime)-8s %(message)s', datefmt='%H:%M:%S')
+    reported = {}
+
+    def progress(host, sent, total):
+        percent = sent * 100 // total if total else 100
+        if percent // 25 != reported.get(host, -1):
+            reported[host] = percent // 25
+            logging.info('%s: %d%%', host, percent)
+
+    results = asyncio.run(upload_many(
+        options.hosts, options.image, limit=options.parallel, progress=progress, compress=options.compress,
+        port=options.port, password=options.auth, md5_password=options.md5_target,
+        chunk_size=options.chunk_size, window=options.window, ready_timeout=options.ready_timeout))
+    for r in results:
+        print(f"  {'ok' if r.ok else 'failed':<7} {r.host} {r.seconds:.1f}s"
+              + (f" - {r.error}" if r.error else f", auth {r.auth}"))
+    return 0 if all(r.ok for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
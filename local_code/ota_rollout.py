@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Roll out MCU firmware over OTA to many modules concurrently.
+
+Replaces the serial per-module loop in deploy.sh Step 7. For each enabled
+module with a firmware image (firmware/wired/<type>/firmware.bin) it sends
+the OTA trigger over CAN and uploads with espota.serve(), which probes
+the module with the OTA invitation until its listener answers instead of
+sleeping a fixed time. Up to --parallel modules are flashed at once, each
+upload listening on its own local port. Uploads keep several chunks in
+flight (--chunk-size/--window); failed uploads are retried with backoff by
+ota_session.OtaSession (--attempts), and --compress sends gzip images.
+Modules recorded (deployed_firmware.py) as already running their image
+are skipped unless --force; --verify-running confirms that over CAN first.
+A per-module summary with transfer statistics is printed at the end, and
+with --trace-deployment each module's outcome is added to the deployment
+trace as an 'ota' span (see deploy_trace.py).
+
+Usage:
+  ota_rollout.py --modules '[{"hostname": "esp32-8F56D8", "type": "...", "name": "..."}]'
+  echo "$MODULES" | ota_rollout.py --modules -
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+import espota
+from can_frames import (
+    CAN_DEVICE_ACK_ID, CAN_OTA_TRIGGER_ID, OTA_ACK_READY, OTA_ACK_TRIGGERED, extract_mac_from_hostname,
+    ota_trigger_frame, parse_device_ack
+)
+from can_transport import TRANSPORT_MODES, load_mqtt_settings, open_transport
+from deploy_trace import TRACE_FILE, DeploymentTrace
+from deployed_firmware import (
+    DEFAULT_STATE_PATH, image_digests, is_unchanged, load_deployed, query_running_digest, record_flash,
+    save_deployed
+)
+from ota_session import MAX_ATTEMPTS, OtaSession
+
+ESP_OTA_PORT = 3232
+DEFAULT_PARALLEL = 3
+OTA_READY_TIMEOUT = 60  # longest a module may take to join WiFi and start its OTA listener
+STREAM_CHUNK_SIZE = 4096
+STREAM_WINDOW = 8
+
+# Module outcomes
+OK = 'ok'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+def detect_upload_ip(fallback=None):
+    """Outbound IP of this host, which the modules connect back to for the upload."""
+    try:
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.connect(('8.8.8.8', 80))
+        ip = s.getsockname()[0]
+        s.close()
+        return ip
+    except OSError:
+        pass
+    try:
+        ip = socket.gethostbyname(socket.gethostname())
+        if ip != '127.0.0.1':
+            return ip
+    except OSError:
+        pass
+    return fallback
+
+
+def firmware_path_for(firmware_dir, module_type):
+    return os.path.join(firmware_dir, module_type, 'firmware.bin')
+
+
+def watch_ota_acks(listener, ready_event, timeout):
+    """Log the trigger acknowledgement and set ready_event on the "OTA ready" frame."""
+    deadline = time.monotonic() + timeout
+    while not ready_event.is_set():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        frame = listener.get(min(remaining, 0.5))
+        if frame is None:
+            continue
+        ack = parse_device_ack(frame[1])
+        if ack and ack['msg_type'] == OTA_ACK_TRIGGERED:
+            logging.info("Trigger acknowledged")
+        elif ack and ack['msg_type'] == OTA_ACK_READY:
+            logging.info("Module reports OTA listener ready")
+            ready_event.set()
+
+
+def flash_module(link, module, image, upload_ip, local_port, password,
+                 chunk_size=STREAM_CHUNK_SIZE, window=STREAM_WINDOW, attempts=MAX_ATTEMPTS):
+    """Trigger and upload one module. Returns a result dict for the summary."""
+    hostname = module['hostname']
+    threading.current_thread().name = hostname
+    result = {'hostname': hostname, 'name': module.get('name', hostname), 'status': FAILED, 'error': None,
+              'stats': None, 'port': local_port}
+    started = time.monotonic()
+
+    try:
+        can_id, data = ota_trigger_frame(hostname)
+        ack_prefix = extract_mac_from_hostname(hostname) + [CAN_OTA_TRIGGER_ID]
+        ready_event = threading.Event()
+
+        with link.listen(CAN_DEVICE_ACK_ID, ack_prefix) as listener:
+            logging.info("Triggering OTA mode for %s", result['name'])
+            link.send(can_id, data)
+            threading.Thread(target=watch_ota_acks, args=(listener, ready_event, OTA_READY_TIMEOUT),
+                             daemon=True).start()
+
+            # The invitation doubles as the readiness probe: the upload starts as
+            # soon as the module answers (or its CAN "ready" frame wakes the prober)
+            logging.info("Uploading %s (listening on %s:%d)", image.filename, upload_ip, local_port)
+            session = OtaSession(hostname, image, upload_ip, local_port, password, ESP_OTA_PORT,
+                                 chunk_size, window, max_attempts=attempts,
+                                 ready_timeout=OTA_READY_TIMEOUT, ready_event=ready_event)
+            rc = session.run()
+            result['stats'] = session.stats
+            ready_event.set()  # stops the ack watcher
+        if rc == 0:
+            result['status'] = OK
+        else:
+            result['error'] = 'upload failed'
+    except Exception as e:
+        result['error'] = str(e)
+        logging.error("%s", e)
+
+    result['duration'] = time.monotonic() - started
+    logging.info("Finished: %s", result['status'])
+    return result
+
+
+def rollout(modules, firmware_dir, upload_ip, parallel=DEFAULT_PARALLEL, base_port=None,
+            password='', transport='auto', chunk_size=STREAM_CHUNK_SIZE, window=STREAM_WINDOW,
+            attempts=MAX_ATTEMPTS, compress=False, state_path=DEFAULT_STATE_PATH, force=False,
+            verify_running=False):
+    """
+    Flash every module that has an image, up to parallel at a time. Returns result dicts.
+
+    Modules the record at state_path says already run their image are skipped
+    unless force is set; verify_running asks those modules over CAN and flashes
+    the ones reporting a different image. state_path None disables the record.
+    """
+    if base_port is None:
+        base_port = random.randint(10000, 60000 - len(modules))
+
+    def skipped(module, reason):
+        return {'hostname': module['hostname'], 'name': module.get('name', module['hostname']),
+                'status': SKIPPED, 'error': reason, 'duration': 0.0, 'stats': None}
+
+    jobs = [(module, firmware_path_for(firmware_dir, module['type'])) for module in modules]
+    digests = {path: image_digests(path) for _, path in jobs if os.path.isfile(path)}
+    deployed = load_deployed(state_path) if state_path else {}
+
+    # results keep module order; None marks a module still to be flashed
+    results = []
+    unchanged = []
+    for i, (module, path) in enumerate(jobs):
+        if path not in digests:
+            results.append(skipped(module, f"no firmware for type {module['type']}"))
+        elif not force and is_unchanged(deployed, module['hostname'], digests[path]):
+            results.append(skipped(module, 'already running this image'))
+            unchanged.append(i)
+        else:
+            results.append(None)
+    if None not in results and not (verify_running and unchanged):
+        return results
+
+    # One warm CAN transport shared by every trigger, and one mapped image (and
+    # digest) per firmware type shared by its uploads
+    images = {}
+    with open_transport(transport, load_mqtt_settings) as link, ExitStack() as stack:
+        logging.info("Sending OTA triggers via %s", link.name)
+        with ThreadPoolExecutor(max_workers=max(1, parallel)) as pool:
+            if verify_running and unchanged:
+                running = pool.map(lambda i: query_running_digest(link, jobs[i][0]['hostname']), unchanged)
+                for i, reported in zip(unchanged, running):
+                    module, path = jobs[i]
+                    expected = digests[path]['app_sha256']
+                    if reported is None or expected is None:
+                        continue  # no answer (older firmware) or no digest to compare: trust the record
+                    if expected.startswith(reported):
+                        results[i]['error'] += ' (confirmed over CAN)'
+                    else:
+                        logging.info("%s reports a different running image, flashing it", module['hostname'])
+                        results[i] = None
+
+            pending = {}
+            for i, (module, path) in enumerate(jobs):
+                if results[i] is not None:
+                    continue
+                if path not in images:
+                    upload_path = espota.compress_image(path) if compress else path
+                    images[path] = stack.enter_context(espota.FirmwareImage(upload_path))
+                pending[i] = pool.submit(flash_module, link, module, images[path], upload_ip, base_port + i,
+                                         password, chunk_size, window, attempts)
+            for i, future in pending.items():
+                results[i] = future.result()
+                if results[i]['status'] == OK:
+                    module, path = jobs[i]
+                    record_flash(deployed, module['hostname'], module['type'], digests[path])
+
+    if state_path and pending:
+        try:
+            save_deployed(deployed, state_path)
+        except OSError as e:
+            logging.warning("Could not save firmware record %s: %s", state_path, e)
+    return results
+
+
+def print_summary(results):
+    print("")
+    print("OTA rollout summary:")
+    for r in results:
+        line = f"  {r['status']:<8} {r['name']} ({r['hostname']}) {r['duration']:.1f}s"
+        stats = r['stats']
+        if stats and stats['attempts']:
+            line += f", {len(stats['attempts'])} attempt(s), {stats['bytes_sent'] / 1024:.0f} KiB sent"
+            if stats['kib_per_s']:
+                line += f", {stats['kib_per_s']:.0f} KiB/s"
+            if stats['auth']:
+                line += f", auth {stats['auth']}"
+        if r['error']:
+            line += f" - {r['error']}"
+        print(line)
+    counts = {status: sum(1 for r in results if r['status'] == status) for status in (OK, FAILED, SKIPPED)}
+    print(f"  {counts[OK]} succeeded, {counts[FAILED]} failed, {counts[SKIPPED]} skipped")
+
+
+def trace_results(results, trace):
+    """Add one 'ota' span per module to trace (a deploy_trace.DeploymentTrace)."""
+    for r in results:
+        trace.add('ota', r['duration'], r['status'], label=r['hostname'], module=r['name'], port=r.get('port'))
+
+
+def parse_args(unparsed_args):
+    parser = argparse.ArgumentParser(description="Flash firmware to enabled modules over OTA in parallel.")
+    parser.add_argument("--modules", required=True,
+                        help="JSON list of {hostname, type, name} objects, or '-' to read it from stdin.")
+    parser.add_argument("--firmware-dir", default="firmware/wired",
+                        help="Directory containing <type>/firmware.bin. Default: firmware/wired")
+    parser.add_argument("--parallel", type=int, default=DEFAULT_PARALLEL,
+                        help=f"Maximum concurrent uploads. Default: {DEFAULT_PARALLEL}")
+    parser.add_argument("--base-port", type=int, default=None,
+                        help="First local upload port; upload N uses base+N. Default: random")
+    parser.add_argument("--host-ip", default=None, help="IP the modules connect back to. Default: auto-detect")
+    parser.add_argument("--fallback-host", default=None,
+                        help="Address to use if the host IP cannot be detected (e.g. TLS_CERT_HOSTNAME).")
+    parser.add_argument("-a", "--auth", default="", help="OTA password.")
+    parser.add_argument("--chunk-size", type=int, default=STREAM_CHUNK_SIZE,
+                        help=f"Bytes per upload chunk. Default: {STREAM_CHUNK_SIZE}")
+    parser.add_argument("--window", type=int, default=STREAM_WINDOW,
+                        help=f"Chunks in flight per device reply; 1 = stop-and-wait. Default: {STREAM_WINDOW}")
+    parser.add_argument("--compress", action="store_true",
+                        help="Send gzip-compressed images (cached as firmware.bin.gz; needs gzip OTA support).")
+    parser.add_argument("--attempts", type=int, default=MAX_ATTEMPTS,
+                        help=f"Upload attempts per module (with backoff). Default: {MAX_ATTEMPTS}")
+    parser.add_argument("--state", default=DEFAULT_STATE_PATH,
+                        help=f"Record of the image each module was flashed with. Default: {DEFAULT_STATE_PATH}")
+    parser.add_argument("--force", action="store_true",
+                        help="Flash every module, even those recorded as running the image already.")
+    parser.add_argument("--verify-running", action="store_true",
+                        help="Ask modules recorded as up to date for their running image over CAN first.")
+    parser.add_argument("--transport", choices=TRANSPORT_MODES, default="auto",
+                        help="How to send OTA triggers. Default: auto (can, then bridge, then mqtt).")
+    parser.add_argument("--trace-deployment", default=None, metavar="ID",
+                        help=f"Add a span per module to the trace of deployment ID in {TRACE_FILE}.")
+    parser.add_argument("--trace-version", default="unknown", help="Version recorded with the trace spans.")
+    parser.add_argument("--trace-run", type=int, default=None,
+                        help="Watcher run the spans belong to. Default: a new run")
+    parser.add_argument("-d", "--debug", action="store_true", help="Show debug output.")
+    return parser.parse_args(unparsed_args)
+
+
+def main(args):
+    options = parse_args(args)
+    logging.basicConfig(level=logging.DEBUG if options.debug else logging.INFO,
+                        format="%(asctime)-8s [%(threadName)s] %(message)s", datefmt="%H:%M:%S")
+
+    raw = sys.stdin.read() if options.modules == '-' else options.modules
+    try:
+        modules = json.loads(raw)
+    except ValueError as e:
+        logging.critical("Invalid --modules JSON: %s", e)
+        return 1
+
+    upload_ip = options.host_ip or detect_upload_ip(options.fallback_host)
+    if not upload_ip:
+        logging.critical("Could not determine the host IP for OTA uploads")
+        return 1
+
+    try:
+        results = rollout(modules, options.firmware_dir, upload_ip, options.parallel, options.base_port,
+                          options.auth, options.transport, options.chunk_size, max(1, options.window),
+                          max(1, options.attempts), options.compress, options.state, options.force,
+                          options.verify_running)
+    except (ConnectionError, ValueError) as e:
+        # No CAN transport could be opened, or MQTT_BROKER_URL is malformed
+        logging.critical("Cannot send OTA triggers: %s", e)
+        return 1
+    print_summary(results)
+    if options.trace_deployment:
+        trace_results(results, DeploymentTrace(options.trace_deployment, options.trace_version, TRACE_FILE,
+                                               log=logging.warning, run=options.trace_run))
+    return 0 if all(r['status'] != FAILED for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
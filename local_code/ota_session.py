@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+OTA upload session for one module: retries failed uploads with backoff.
+
+ArduinoOTA cannot resume an image part way, so a dropped WiFi link means
+a new invitation and a full upload. OtaSession makes that automatic:
+
+  - failed attempts are retried with exponential backoff, probing the
+    module with the invitation until it answers again (it may reboot)
+  - the auth variant the module accepted is remembered, so retries with a
+    legacy MD5-hashed password skip the SHA256 attempt and its extra
+    invitation (nonces are single use, so the response itself is not reused)
+  - after two windowed uploads break off, retries use stop-and-wait
+  - wrong passwords are not retried
+  - every attempt is recorded in .stats for the rollout summary
+"""
+
+import logging
+import time
+
+import espota
+
+MAX_ATTEMPTS = 4
+BACKOFF = 2.0
+MAX_BACKOFF = 30.0
+RETRY_READY_TIMEOUT = 60
+
+
+class OtaSession:
+    """Upload one image to one module, retrying failed attempts."""
+
+    def __init__(self, hostname, image, upload_ip, local_port, password='', remote_port=3232,
+                 chunk_size=espota.CHUNK_SIZE, window=espota.WINDOW, max_attempts=MAX_ATTEMPTS,
+                 backoff=BACKOFF, max_backoff=MAX_BACKOFF, ready_timeout=None, ready_event=None):
+        self.hostname = hostname
+        self.image = image
+        self.upload_ip = upload_ip
+        self.local_port = local_port
+        self.password = password
+        self.remote_port = remote_port
+        self.chunk_size = chunk_size
+        self.window = window
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.ready_timeout = ready_timeout
+        self.ready_event = ready_event
+        self.auth = None  # variant the module accepted, reused on retries
+        self.stats = {'attempts': [], 'bytes_sent': 0, 'seconds': 0.0, 'auth': None, 'kib_per_s': None}
+
+    def _attempt(self, ready_timeout):
+        attempt = {}
+        started = time.monotonic()
+        rc = espota.serve(self.hostname, self.upload_ip, self.remote_port, self.local_port, self.password,
+                          self.auth == espota.AUTH_SHA256_MD5_PASSWORD, self.image, espota.FLASH,
+                          ready_timeout=ready_timeout, ready_event=self.ready_event,
+                          chunk_size=self.chunk_size, window=self.window, stats=attempt)
+        attempt['seconds'] = time.monotonic() - started
+        attempt['ok'] = rc == 0
+        attempt['window'] = self.window
+        self.stats['attempts'].append(attempt)
+        self.stats['bytes_sent'] += attempt['bytes_sent']
+        self.stats['seconds'] += attempt['seconds']
+        if attempt['auth']:
+            self.auth = self.stats['auth'] = attempt['auth']
+        return attempt
+
+    def run(self):
+        """Returns 0 once an attempt succeeds, 1 when attempts are exhausted."""
+        ready_timeout = self.ready_timeout
+        delay = self.backoff
+        windowed_failures = 0
+        for number in range(1, self.max_attempts + 1):
+            attempt = self._attempt(ready_timeout)
+            if attempt['ok']:
+                self.stats['kib_per_s'] = self.image.size / 1024 / max(attempt['upload_seconds'], 1e-6)
+                return 0
+
+            logging.warning("Attempt %d/%d failed during %s (%d of %d bytes sent)", number, self.max_attempts,
+                            attempt['phase'], attempt['bytes_sent'], self.image.size)
+            if attempt['auth_rejected']:
+                logging.error("Authentication rejected, not retrying")
+                return 1
+            if number == self.max_attempts:
+                break
+
+            if attempt['phase'] in ('upload', 'result') and self.window > 1:
+                windowed_failures += 1
+                if windowed_failures == 2:
+                    logging.warning("Falling back to stop-and-wait uploads")
+                    self.chunk_size, self.window = espota.CHUNK_SIZE, 1
+            logging.info("Retrying in %.0fs", delay)
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_backoff)
+            # The module may have rebooted after the failure: probe until it answers again
+            ready_timeout = ready_timeout or RETRY_READY_TIMEOUT
+        return 1
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+"""
+Resumable download of deployment packages, used by deployment-watcher.py.
+
+Packages are fetched into DOWNLOAD_DIR as <sha256>.part, with the byte
+ranges received so far recorded next to it in <sha256>.part.json. A dropped
+link or a watcher restart continues with an HTTP Range request instead of
+starting from zero, and the retained deployment message after a restart
+picks the partial file up again. With segments > 1 the package is split
+into that many ranges fetched over parallel connections (servers that
+ignore Range get a single stream).
+
+The SHA256 is computed incrementally over the contiguous prefix received
+so far; bytes from an earlier run, or from segments that finished ahead of
+it, are read back from disk once. The same in-order stream can be passed to
+stream_to (package_stage.StagedExtraction) to extract while downloading. The package only gets its final name when
+the digest matches; on a mismatch the partial file is discarded.
+
+Each connection is pipelined: the fetching thread reads the socket with
+readinto() into a few reusable buffers while a writer thread writes and
+hashes the previous one, so network I/O and SHA256 overlap. Reads start at
+CHUNK_SIZE and double up to MAX_CHUNK_SIZE while they fill quickly, and
+shrink again on a slow link so progress and saved state stay current.
+download_benchmark.py compares this with one serial loop. A throttle
+(download_policy.DownloadPolicy) is asked before every read, so it can
+limit the rate or hold the download while it must not run.
+
+Usage:
+  package_download.py URL SHA256 [--segments 4] [--output package.zip]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import queue
+import tempfile
+import threading
+import time
+from http.client import HTTPException
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+DOWNLOAD_DIR = os.path.join(os.path.expanduser('~'), '.deployment-watcher-downloads')
+CHUNK_SIZE = 65536  # first (and smallest) read per connection
+MAX_CHUNK_SIZE = 1024 * 1024
+PIPELINE_BUFFERS = 4  # per connection: one being read, the rest queued for the writer
+FAST_READ = 0.02  # seconds; a full read quicker than this doubles the read size
+SLOW_READ = 0.5  # a read slower than this halves it
+HASH_BLOCK = 1024 * 1024
+READ_TIMEOUT = 60
+MIN_SEGMENT_SIZE = 4 * 1024 * 1024
+SAVE_INTERVAL = 2.0  # seconds between saves of the received ranges
+MAX_STALLED_ROUNDS = 5  # consecutive attempts without new bytes before giving up
+BACKOFF = 2.0
+MAX_BACKOFF = 60.0
+
+# HTTP errors worth retrying; anything else (401, 404, ...) fails the download at once
+RETRY_HTTP_CODES = (408, 429, 500, 502, 503, 504)
+
+
+class DownloadError(Exception):
+    """The package could not be downloaded."""
+
+
+class ChecksumMismatch(DownloadError):
+    def __init__(self, expected, computed, size):
+        super().__init__(f"SHA256 mismatch: expected {expected}, got {computed} ({size} bytes)")
+        self.expected = expected
+        self.computed = computed
+        self.size = size
+
+
+class _RangeIgnored(Exception):
+    """The server answered a Range request with the whole body."""
+
+
+def _range_complete(rng):
+    start, end, done = rng
+    return end is not None and start + done >= end
+
+
+class PackageDownload:
+    """One package download; run() fetches (or resumes) it and returns the verified path."""
+
+    def __init__(self, url, expected_sha256, total_size=0, headers=None, segments=1, download_dir=DOWNLOAD_DIR,
+                 progress=None, log=print, timeout=READ_TIMEOUT, stream_to=None, exclusive=True, pipeline=True,
+                 throttle=None, should_stop=None):
+        self.url = url
+        self.expected_sha256 = expected_sha256.lower()
+        self.total_size = total_size or 0
+        self.headers = dict(headers or {})
+        self.segments = max(1, segments)
+        self.download_dir = download_dir
+        self.progress = progress
+        self.log = log
+        self.timeout = timeout
+        self.stream_to = stream_to  # gets the verified-order byte stream: feed(data), reset()
+        self.exclusive = exclusive  # the only download in download_dir: remove other partial files
+        self.pipeline = pipeline  # False: read, write and hash in one loop per connection
+        self.throttle = throttle  # consume(count, should_stop) before each read; may block, or raise to stop
+        self.should_stop = should_stop or (lambda: False)
+        self.part_path = os.path.join(download_dir, self.expected_sha256 + '.part')
+        self.state_path = self.part_path + '.json'
+        self.received = 0
+        self.size = 0
+        self._ranges = []  # [start, end, done]; end None = until the server closes
+        self._ranges_supported = True
+        self._fd = None
+        self._lock = threading.Lock()
+        self._progress_lock = threading.Lock()
+        self._sha256 = hashlib.sha256()
+        self._hashed = 0
+        self._saved = 0.0
+
+    # --- persisted state ---
+
+    def _save_state(self):
+        """Record the received ranges (call with _lock held)."""
+        fd, tmp = tempfile.mkstemp(dir=self.download_dir, prefix='.state-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'url': self.url, 'size': self.total_size, 'ranges': self._ranges}, f)
+        os.replace(tmp, self.state_path)
+        self._saved = time.monotonic()
+
+    def _new_ranges(self):
+        size = self.total_size
+        count = min(self.segments, size // MIN_SEGMENT_SIZE) if size and self._ranges_supported else 1
+        if count <= 1:
+            return [[0, size or None, 0]]
+        step = -(-size // count)
+        return [[start, min(start + step, size), 0] for start in range(0, size, step)]
+
+    def _reset(self):
+        os.ftruncate(self._fd, 0)
+        if self.stream_to:
+            self.stream_to.reset()
+        with self._lock:
+            self._ranges = self._new_ranges()
+            self._sha256 = hashlib.sha256()
+            self._hashed = 0
+            self.received = 0
+            self._save_state()
+
+    def _resume(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+            ranges = state['ranges']
+        except (OSError, ValueError, KeyError):
+            self._reset()
+            return
+        if state.get('size') != self.total_size and self.total_size:
+            self._reset()
+            return
+        self.total_size = state.get('size') or self.total_size
+        if self.stream_to:
+            self.stream_to.reset()  # replayed from disk by _catch_up()
+        with self._lock:
+            self._ranges = ranges
+            self.received = sum(done for _, _, done in ranges)
+            self.log(f"Resuming download at {self.received}/{self.total_size or '?'} bytes")
+            self._catch_up()  # hash what earlier runs received
+
+    def _remove_stale(self):
+        """Drop partial downloads of other packages (one deployment runs at a time)."""
+        for entry in os.listdir(self.download_dir):
+            path = os.path.join(self.download_dir, entry)
+            if entry.endswith(('.part', '.part.json')) and not path.startswith(self.part_path):
+                try:
+                    os.remove(path)
+                    self.log(f"Removed stale partial download {entry}")
+                except OSError:
+                    pass
+
+    # --- hashing and progress ---
+
+    def _contiguous(self):
+        """End of the prefix received without gaps."""
+        position = 0
+        for start, end, done in self._ranges:
+            if start != position:
+                break
+            position = start + done
+            if end is None or position < end:
+                break
+        return position
+
+    def _catch_up(self):
+        """Hash received bytes beyond the hashed prefix from disk (call with _lock held)."""
+        target = self._contiguous()
+        while self._hashed < target:
+            data = os.pread(self._fd, min(HASH_BLOCK, target - self._hashed), self._hashed)
+            if not data:
+                break
+            self._sha256.update(data)
+            self._hashed += len(data)
+            if self.stream_to:
+                self.stream_to.feed(data)
+
+    def _advance(self, rng, position, chunk):
+        """Account for chunk, already written at position within rng."""
+        with self._lock:
+            rng[2] += len(chunk)
+            self.received += len(chunk)
+            if position == self._hashed:
+                self._sha256.update(chunk)
+                self._hashed += len(chunk)
+                if self.stream_to:
+                    self.stream_to.feed(chunk)
+            if _range_complete(rng):
+                self._catch_up()  # later ranges may already be on disk
+            if time.monotonic() - self._saved >= SAVE_INTERVAL:
+                self._save_state()
+            received = self.received
+        if self.progress:
+            with self._progress_lock:
+                self.progress(received, self.total_size)
+
+    # --- fetching ---
+
+    def _fetch(self, rng):
+        start, end, done = rng
+        position = start + done
+        request = Request(self.url, headers=self.headers)
+        partial = position > 0 or len(self._ranges) > 1
+        if partial:
+            request.add_header('Range', f"bytes={position}-{'' if end is None else end - 1}")
+        with urlopen(request, timeout=self.timeout) as response:
+            if response.status != 206 and partial:
+                raise _RangeIgnored()
+            if end is None:
+                # Learn the size for progress reporting: "bytes a-b/total" or Content-Length
+                match = re.match(r'bytes \d+-\d+/(\d+)', response.headers.get('Content-Range', ''))
+                length = response.headers.get('Content-Length')
+                if match:
+                    end = int(match.group(1))
+                elif length and not partial:
+                    end = int(length)
+                if end is not None:
+                    with self._lock:
+                        rng[1] = end
+                        self.total_size = self.total_size or end
+
+            position = self._stream(response, rng, position, end)
+
+        if end is None:
+            with self._lock:
+                rng[1] = position
+        elif position < end:
+            raise DownloadError(f"connection closed at {position} of {end} bytes")
+
+    def _stream(self, response, rng, position, end):
+        """Copy the response body to the file from position. Returns the position after the last byte."""
+        size = CHUNK_SIZE
+        limit = MAX_CHUNK_SIZE if end is None else max(1, min(MAX_CHUNK_SIZE, end - position))
+        free = queue.Queue()  # reusable buffers, allocated on first use
+        allocated = 0
+        filled = queue.Queue()  # (buffer, position, length) for the writer; None ends it
+        failed = []
+
+        def write(buffer, at, length):
+            view = memoryview(buffer)[:length]
+            os.pwrite(self._fd, view, at)
+            self._advance(rng, at, view)
+
+        def writer():
+            while True:
+                item = filled.get()
+                if item is None:
+                    return
+                try:
+                    if not failed:
+                        write(*item)
+                except Exception as e:
+                    failed.append(e)
+                finally:
+                    free.put(item[0])
+
+        thread = None
+        if self.pipeline and limit > CHUNK_SIZE:
+            thread = threading.Thread(target=writer, daemon=True)
+            thread.start()
+        try:
+            while (end is None or position < end) and not failed:
+                if free.empty() and allocated < (PIPELINE_BUFFERS if thread else 1):
+                    free.put(bytearray(limit if thread else CHUNK_SIZE))
+                    allocated += 1
+                buffer = free.get()
+                wanted = min(size, len(buffer)) if end is None else min(size, len(buffer), end - position)
+                started = time.monotonic()
+                if self.throttle:
+                    self.throttle.consume(wanted, self.should_stop)
+                count = response.readinto(memoryview(buffer)[:wanted])
+                if not count:
+                    free.put(buffer)
+                    break
+                if thread:
+                    filled.put((buffer, position, count))
+                    elapsed = time.monotonic() - started
+                    if count == wanted and elapsed < FAST_READ:
+                        size = min(size * 2, limit)
+                    elif elapsed > SLOW_READ:
+                        size = max(size // 2, CHUNK_SIZE)
+                else:
+                    write(buffer, position, count)
+                    free.put(buffer)
+                position += count
+        finally:
+            if thread:
+                filled.put(None)  # after the queued buffers, so what was read is still written
+                thread.join()
+        if failed:
+            raise failed[0]
+        return position
+
+    def _fetch_all(self, pending):
+        """Fetch the pending ranges, in parallel if there are several. Returns the errors."""
+        errors = []
+
+        def worker(rng):
+            try:
+                self._fetch(rng)
+            except Exception as e:
+                errors.append(e)
+
+        if len(pending) == 1:
+            worker(pending[0])
+        else:
+            threads = [threading.Thread(target=worker, args=(rng,), daemon=True) for rng in pending]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        return errors
+
+    def run(self, dest_path):
+        """Download (or resume) into dest_path, verifying the SHA256. Raises DownloadError/HTTPError."""
+        os.makedirs(self.download_dir, exist_ok=True)
+        if self.exclusive:
+            self._remove_stale()
+        self._fd = os.open(self.part_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            self._resume()
+            stalled = 0
+            delay = BACKOFF
+            while True:
+                pending = [rng for rng in self._ranges if not _range_complete(rng)]
+                if not pending:
+                    break
+                before = self.received
+                errors = self._fetch_all(pending)
+                if not errors:
+                    continue
+                if any(isinstance(e, _RangeIgnored) for e in errors) or \
+                        any(isinstance(e, HTTPError) and e.code == 416 for e in errors):
+                    self.log("Server does not honour the requested ranges, downloading from the start")
+                    self._ranges_supported = False
+                    self._reset()
+                    continue
+                fatal = [e for e in errors if not isinstance(e, (OSError, HTTPException, DownloadError))
+                         or (isinstance(e, HTTPError) and e.code not in RETRY_HTTP_CODES)]
+                if fatal:
+                    raise fatal[0]
+                if self.received > before:
+                    stalled, delay = 0, BACKOFF
+                else:
+                    stalled += 1
+                    if stalled >= MAX_STALLED_ROUNDS:
+                        raise DownloadError(f"no progress after {stalled} attempts: {errors[0]}")
+                self.log(f"Download interrupted at {self.received}/{self.total_size or '?'} bytes "
+                         f"({str(errors[0]) or type(errors[0]).__name__}), resuming in {delay:.0f}s")
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_BACKOFF)
+
+            with self._lock:
+                self._catch_up()
+                self._save_state()
+                computed = self._sha256.hexdigest()
+                self.size = self._hashed
+        except BaseException:
+            try:
+                with self._lock:
+                    self._save_state()  # keep what was received for the next attempt
+            except OSError:
+                pass
+            raise
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+        if computed != self.expected_sha256:
+            self.discard()
+            raise ChecksumMismatch(self.expected_sha256, computed, self.size)
+        os.replace(self.part_path, dest_path)
+        os.remove(self.state_path)
+        return dest_path
+
+    def discard(self):
+        """Delete the partial download and its state."""
+        for path in (self.part_path, self.state_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Download a deployment package with resume support.')
+    parser.add_argument('url')
+    parser.add_argument('sha256')
+    parser.add_argument('--size', type=int, default=0, help='Expected size in bytes (for progress/segments).')
+    parser.add_argument('--segments', type=int, default=1, help='Parallel range requests. Default: 1')
+    parser.add_argument('--header', action='append', default=[], metavar='NAME:VALUE', help='Extra request header.')
+    parser.add_argument('--output', default=None, help='Destination. Default: <sha256>.zip in the download dir')
+    parser.add_argument('--download-dir', default=DOWNLOAD_DIR, help=f'Partial files. Default: {DOWNLOAD_DIR}')
+    options = parser.parse_args(args)
+
+    headers = dict(h.split(':', 1) for h in options.header)
+    started = time.monotonic()
+    download = PackageDownload(options.url, options.sha256, options.size, {k: v.strip() for k, v in headers.items()},
+                               options.segments, options.download_dir)
+    try:
+        path = download.run(options.output or os.path.join(options.download_dir, options.sha256 + '.zip'))
+    except (DownloadError, URLError) as e:
+        print(f"Download failed: {e}", file=sys.stderr)
+        return 1
+    elapsed = time.monotonic() - started
+    print(f"{path}: {download.size} bytes in {elapsed:.1f}s ({download.received / 1e6 / max(elapsed, 1e-6):.1f} MB/s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Extract a deployment zip into a staging directory while it downloads.
+
+PackageDownload feeds the package bytes in order (the same stream it
+hashes) to StagedExtraction.feed(), which walks the zip local file headers
+and inflates each member into the staging directory as it arrives, checking
+every member's CRC. Nothing outside the staging directory is touched, so
+there is no second pass over the zip; once the package has passed its
+SHA256 check, releases.Releases.install() moves the staging directory into
+a release directory of its own.
+
+Zips the stream parser cannot handle (encryption, unusual compression,
+stored members with trailing data descriptors) are extracted from the
+finished file with zipfile instead (extract_from()).
+
+Usage:
+  package_stage.py package.zip STAGING_DIR   # stream-extract a local zip (testing)
+"""
+
+import os
+import shutil
+import struct
+import sys
+import zipfile
+import zlib
+
+LOCAL_HEADER = b'PK\x03\x04'
+CENTRAL_HEADER = b'PK\x01\x02'
+END_OF_CENTRAL_DIR = b'PK\x05\x06'
+DATA_DESCRIPTOR = b'PK\x07\x08'
+LOCAL_HEADER_FORMAT = '<4sHHHHHIIIHH'
+LOCAL_HEADER_SIZE = struct.calcsize(LOCAL_HEADER_FORMAT)
+ZIP64_EXTRA_ID = 0x0001
+FLAG_ENCRYPTED = 0x1
+FLAG_DATA_DESCRIPTOR = 0x8
+FLAG_UTF8 = 0x800
+STORED = 0
+DEFLATED = 8
+
+# Parser states
+HEADER = 'header'
+DATA = 'data'
+DESCRIPTOR = 'descriptor'
+DONE = 'done'            # reached the central directory: every member is staged
+ABANDONED = 'abandoned'  # fall back to extract_from() after the download
+
+
+class _Unsupported(Exception):
+    pass
+
+
+class StagedExtraction:
+    """Streaming zip extraction into staging_dir; feed() never raises."""
+
+    def __init__(self, staging_dir, log=print):
+        self.staging_dir = os.path.abspath(staging_dir)
+        self.log = log
+        self.state = HEADER
+        self.members = 0
+        self.bytes_written = 0
+        self._buffer = bytearray()
+        self._entry = None
+        self._file = None
+        self.reset()
+
+    @property
+    def complete(self):
+        """True once every member was extracted and CRC-checked from the stream."""
+        return self.state == DONE
+
+    def reset(self):
+        """Start over with an empty staging directory (new or restarted download)."""
+        self._close_file()
+        self.discard()
+        os.makedirs(self.staging_dir)
+        self.state = HEADER
+        self.members = 0
+        self.bytes_written = 0
+        self._buffer = bytearray()
+        self._entry = None
+
+    def discard(self):
+        self._close_file()
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+    # --- streaming ---
+
+    def feed(self, data):
+        if self.state in (DONE, ABANDONED):
+            return
+        self._buffer += data
+        try:
+            while self._step():
+                pass
+        except (_Unsupported, OSError, zlib.error, ValueError) as e:
+            self._close_file()
+            self.state = ABANDONED
+            self._buffer = bytearray()
+            self.log(f"Streaming extraction stopped ({e}), will extract after download")
+
+    def _step(self):
+        """Process buffered bytes; returns True if another step can make progress."""
+        if self.state == HEADER:
+            return self._read_header()
+        if self.state == DATA:
+            return self._read_data()
+        if self.state == DESCRIPTOR:
+            return self._read_descriptor()
+        return False
+
+    def _read_header(self):
+        buffer = self._buffer
+        if len(buffer) < 4:
+            return False
+        signature = bytes(buffer[:4])
+        if signature in (CENTRAL_HEADER, END_OF_CENTRAL_DIR):
+            self.state = DONE
+            self._buffer = bytearray()
+            return False
+        if signature != LOCAL_HEADER:
+            raise _Unsupported(f"unexpected signature {signature!r}")
+        if len(buffer) < LOCAL_HEADER_SIZE:
+            return False
+        (_, _, flags, method, _, _, crc, compressed_size, size, name_length,
+         extra_length) = struct.unpack_from(LOCAL_HEADER_FORMAT, buffer)
+        header_end = LOCAL_HEADER_SIZE + name_length + extra_length
+        if len(buffer) < header_end:
+            return False
+
+        raw_name = bytes(buffer[LOCAL_HEADER_SIZE:LOCAL_HEADER_SIZE + name_length])
+        name = raw_name.decode('utf-8' if flags & FLAG_UTF8 else 'cp437')
+        extra = bytes(buffer[LOCAL_HEADER_SIZE + name_length:header_end])
+        del buffer[:header_end]
+
+        zip64 = self._zip64_field(extra) is not None
+        if compressed_size == 0xFFFFFFFF or size == 0xFFFFFFFF:
+            size, compressed_size = self._zip64_sizes(extra, size, compressed_size)
+        if flags & FLAG_ENCRYPTED:
+            raise _Unsupported(f"{name} is encrypted")
+        if method not in (STORED, DEFLATED):
+            raise _Unsupported(f"{name} uses compression method {method}")
+        descriptor = bool(flags & FLAG_DATA_DESCRIPTOR)
+        if descriptor and method == STORED:
+            raise _Unsupported(f"{name} is stored with a data descriptor")
+
+        path = self._target(name)
+        self._entry = {'name': name, 'crc': crc, 'size': size, 'descriptor': descriptor, 'zip64': zip64,
+                       'remaining': None if descriptor else compressed_size, 'computed_crc': 0, 'written': 0,
+                       'inflater': zlib.decompressobj(-15) if method == DEFLATED else None}
+        if name.endswith('/'):
+            os.makedirs(path, exist_ok=True)
+            self._finish_entry()
+            return True
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path, 'wb')
+        self.state = DATA
+        return True
+
+    @staticmethod
+    def _zip64_field(extra):
+        offset = 0
+        while offset + 4 <= len(extra):
+            field_id, length = struct.unpack_from('<HH', extra, offset)
+            if field_id == ZIP64_EXTRA_ID:
+                return extra[offset + 4:offset + 4 + length]
+            offset += 4 + length
+        return None
+
+    def _zip64_sizes(self, extra, size, compressed_size):
+        values = self._zip64_field(extra)
+        if values is None:
+            raise _Unsupported("zip64 sizes missing")
+        position = 0
+        if size == 0xFFFFFFFF:
+            size, = struct.unpack_from('<Q', values, position)
+            position += 8
+        if compressed_size == 0xFFFFFFFF:
+            compressed_size, = struct.unpack_from('<Q', values, position)
+        return size, compressed_size
+
+    def _target(self, name):
+        """Staging path for a member, refusing names that escape the staging directory."""
+        path = os.path.normpath(os.path.join(self.staging_dir, name))
+        if os.path.isabs(name) or not (path + os.sep).startswith(os.path.join(self.staging_dir, '')):
+            raise _Unsupported(f"unsafe member name {name!r}")
+        return path
+
+    def _write(self, data):
+        entry = self._entry
+        if data:
+            self._file.write(data)
+            entry['computed_crc'] = zlib.crc32(data, entry['computed_crc'])
+            entry['written'] += len(data)
+            self.bytes_written += len(data)
+
+    def _read_data(self):
+        entry = self._entry
+        buffer = self._buffer
+        if not buffer:
+            return False
+        inflater = entry['inflater']
+
+        if entry['remaining'] is None:
+            # Deflate stream of unknown length: it ends itself
+            self._write(inflater.decompress(bytes(buffer)))
+            leftover = inflater.unused_data
+            self._buffer = bytearray(leftover)
+            if not inflater.eof:
+                return False
+            self._close_file()
+            self.state = DESCRIPTOR
+            return True
+
+        count = min(len(buffer), entry['remaining'])
+        chunk = bytes(buffer[:count])
+        del buffer[:count]
+        entry['remaining'] -= count
+        self._write(inflater.decompress(chunk) if inflater else chunk)
+        if entry['remaining']:
+            return False
+        if inflater:
+            self._write(inflater.flush())
+        self._close_file()
+        self._finish_entry()
+        return True
+
+    def _read_descriptor(self):
+        entry = self._entry
+        sizes = 16 if entry['zip64'] else 8
+        buffer = self._buffer
+        if len(buffer) < 4:
+            return False
+        length = 4 + sizes + (4 if bytes(buffer[:4]) == DATA_DESCRIPTOR else 0)
+        if len(buffer) < length:
+            return False
+        crc, = struct.unpack_from('<I', buffer, length - sizes - 4)
+        entry['crc'] = crc
+        entry['size'] = entry['written']
+        del buffer[:length]
+        self._finish_entry()
+        return True
+
+    def _finish_entry(self):
+        entry = self._entry
+        if entry['written'] != entry['size'] or entry['computed_crc'] != entry['crc']:
+            raise _Unsupported(f"CRC/size mismatch in {entry['name']}")
+        self.members += 1
+        self._entry = None
+        self.state = HEADER
+
+    def _close_file(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    # --- fallback ---
+
+    def extract_from(self, zip_path):
+        """Extract the finished zip into the staging directory (when streaming was abandoned)."""
+        self.reset()
+        with zipfile.ZipFile(zip_path, 'r') as zf:
+            zf.extractall(self.staging_dir)
+        self.state = DONE
+
+
+def main(args):
+    if len(args) != 2:
+        print(__doc__.strip().splitlines()[-1], file=sys.stderr)
+        return 2
+    zip_path, staging_dir = args
+    stage = StagedExtraction(os.path.abspath(staging_dir))
+    with open(zip_path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            stage.feed(block)
+    print(f"{stage.state}: {stage.members} members, {stage.bytes_written} bytes staged")
+    return 0 if stage.complete else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Versioned release directories with an atomic switch, used by deployment-watcher.py.
+
+Each deployment is installed into its own directory under RELEASES_DIR and
+made active by replacing the `current` symlink there in one rename:
+
+  ~/.deployment-releases/
+      1.2.0-abc123/            a complete package tree
+      1.3.0-def456/
+      current -> 1.3.0-def456
+      releases.json            install history, newest last
+  ~/images -> .deployment-releases/current/images
+  ~/docker-compose.yml -> .deployment-releases/current/docker-compose.yml
+  ...
+
+The package entries in ~ are symlinks through `current`, so deploy.sh, docker
+compose and the relative paths they use see either the old release or the new
+one, never a mix. local_code/ is the exception: it also holds the cantomqtt
+venv, .env and ca.pem, so the release's files are copied over it. data/ and
+.env are not part of a package and are left alone.
+
+The previous releases (KEEP_RELEASES in total) stay on disk; rollback() flips
+`current` back without downloading or extracting anything.
+
+Usage:
+  releases.py                 # list releases
+  releases.py rollback [NAME] [--deploy]
+  releases.py install DIR --name NAME [--deploy]   # an extracted package, moved in
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HOME_DIR = os.path.expanduser('~')
+RELEASES_DIR = os.path.join(HOME_DIR, '.deployment-releases')
+KEEP_RELEASES = 3
+CURRENT = 'current'
+HISTORY_FILE = 'releases.json'
+MUTABLE_ENTRIES = ('local_code',)  # copied into ~ instead of linked
+
+# History statuses
+INSTALLED = 'installed'
+ROLLED_BACK = 'rolled-back'  # deploying it failed; not retried automatically
+
+
+class ReleaseError(Exception):
+    pass
+
+
+def release_name(deployment_id, version):
+    """Directory name for a deployment: '<version>-<id>' with unsafe characters replaced."""
+    return re.sub(r'[^A-Za-z0-9._-]', '_', f"{version}-{deployment_id}")
+
+
+class Releases:
+    """The release directories under root and the ~ entries that point into them."""
+
+    def __init__(self, root=RELEASES_DIR, home=HOME_DIR, keep=KEEP_RELEASES, log=print):
+        self.root = root
+        self.home = home
+        self.keep = max(2, keep)
+        self.log = log
+        self.current_link = os.path.join(root, CURRENT)
+        self.history_path = os.path.join(root, HISTORY_FILE)
+
+    # --- history ---
+
+    def history(self):
+        """[{'name', 'version', 'deployment_id', 'installed_at', 'status'}], oldest first."""
+        try:
+            with open(self.history_path) as f:
+                history = json.load(f)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as e:
+            self.log(f"Ignoring unreadable release history {self.history_path}: {e}")
+            return []
+        return [entry for entry in history if isinstance(entry, dict) and entry.get('name')]
+
+    def _save_history(self, history):
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix='.releases-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(history, f, indent=2)
+        os.replace(tmp, self.history_path)
+
+    def current(self):
+        """Name of the active release, or None before the first release install."""
+        try:
+            return os.path.basename(os.readlink(self.current_link))
+        except OSError:
+            return None
+
+    def status(self, name):
+        for entry in self.history():
+            if entry['name'] == name:
+                return entry.get('status')
+        return None
+
+    def mark(self, name, status):
+        history = self.history()
+        for entry in history:
+            if entry['name'] == name:
+                entry['status'] = status
+        self._save_history(history)
+
+    # --- switching ---
+
+    def _switch(self, name):
+        """Point `current` at name atomically, then make sure ~ links through it."""
+        tmp = self.current_link + '.new'
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        os.symlink(name, tmp)
+        os.replace(tmp, self.current_link)
+        self._link_home(os.path.join(self.root, name))
+        self._sync_local_code(os.path.join(self.root, name))
+
+    def _link_home(self, release_dir):
+        """Make the release's top-level entries in ~ symlinks through `current`."""
+        prefix = os.path.join(os.path.relpath(self.root, self.home), CURRENT)
+        entries = set(os.listdir(release_dir)) - set(MUTABLE_ENTRIES)
+        for entry in sorted(entries):
+            path = os.path.join(self.home, entry)
+            target = os.path.join(prefix, entry)
+            if os.path.islink(path) and os.readlink(path) == target:
+                continue
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)  # copy from an overlay install, before release directories
+            elif os.path.lexists(path):
+                os.remove(path)
+            os.symlink(target, path)
+        # Entries of an older release that this one no longer ships
+        for entry in os.listdir(self.home):
+            path = os.path.join(self.home, entry)
+            if entry not in entries and os.path.islink(path) and \
+                    os.readlink(path).startswith(prefix + os.sep):
+                os.remove(path)
+
+    def _sync_local_code(self, release_dir):
+        """Copy the release's local_code over ~/local_code, one atomic replace per file."""
+        for entry in MUTABLE_ENTRIES:
+            src_dir = os.path.join(release_dir, entry)
+            if not os.path.isdir(src_dir):
+                continue
+            dst_dir = os.path.join(self.home, entry)
+            if os.path.islink(dst_dir):
+                os.remove(dst_dir)
+            for root, dirs, files in os.walk(src_dir):
+                target_root = os.path.join(dst_dir, os.path.relpath(root, src_dir))
+                os.makedirs(target_root, exist_ok=True)
+                for name in files:
+                    fd, tmp = tempfile.mkstemp(dir=target_root, prefix='.release-')
+                    os.close(fd)
+                    shutil.copy2(os.path.join(root, name), tmp)
+                    os.replace(tmp, os.path.join(target_root, name))
+
+    # --- install and rollback ---
+
+    def install(self, staging_dir, name, version='unknown', deployment_id=None):
+        """Move staging_dir into the releases directory and make it current. Returns its path."""
+        os.makedirs(self.root, exist_ok=True)
+        if name == CURRENT or name == HISTORY_FILE:
+            raise ReleaseError(f"invalid release name {name!r}")
+        if name == self.current():
+            name = f"{name}-{int(time.time())}"  # reinstalling the running release
+        release_dir = os.path.join(self.root, name)
+        if os.path.exists(release_dir):
+            shutil.rmtree(release_dir)  # left by an earlier attempt
+        os.rename(staging_dir, release_dir)
+
+        history = [entry for entry in self.history() if entry['name'] != name]
+        history.append({'name': name, 'version': version, 'deployment_id': deployment_id,
+                        'installed_at': int(time.time()), 'status': INSTALLED})
+        self._save_history(history)
+        self._switch(name)
+        self._prune(history)
+        return release_dir
+
+    def previous(self):
+        """Newest release before the current one that did not fail, or None."""
+        current = self.current()
+        candidates = [entry['name'] for entry in self.history()
+                      if entry['name'] != current and entry.get('status') != ROLLED_BACK
+                      and os.path.isdir(os.path.join(self.root, entry['name']))]
+        return candidates[-1] if candidates else None
+
+    def rollback(self, name=None):
+        """Make name (default: the previous release) current again. Returns its name or None."""
+        name = name or self.previous()
+        if not name:
+            return None
+        if not os.path.isdir(os.path.join(self.root, name)):
+            raise ReleaseError(f"release {name} is not on disk")
+        failed = self.current()
+        self._switch(name)
+        if failed and failed != name:
+            self.mark(failed, ROLLED_BACK)
+        return name
+
+    def _prune(self, history):
+        """Delete the oldest release directories beyond keep (never the current one)."""
+        current = self.current()
+        names = [entry['name'] for entry in history]
+        for name in names[:-self.keep]:
+            if name == current:
+                continue
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+            self.log(f"Removed old release {name}")
+        kept = [entry for entry in history if entry['name'] in names[-self.keep:] or entry['name'] == current]
+        if len(kept) != len(history):
+            self._save_history(kept)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='List deployed releases or roll back to an earlier one.')
+    parser.add_argument('command', nargs='?', choices=['list', 'rollback', 'install'], default='list')
+    parser.add_argument('target', nargs='?',
+                        help='rollback: release to switch to (default: the previous one). install: extracted package')
+    parser.add_argument('--name', help='install: release name, e.g. the package version')
+    parser.add_argument('--deploy', action='store_true', help='Run deploy.sh after switching.')
+    parser.add_argument('--root', default=RELEASES_DIR, help=f'Releases directory. Default: {RELEASES_DIR}')
+    options = parser.parse_args(args)
+
+    releases = Releases(options.root)
+    if options.command in ('rollback', 'install'):
+        try:
+            if options.command == 'install':
+                if not options.target or not options.name or not os.path.isdir(options.target):
+                    parser.error('install needs an extracted package directory and --name')
+                name = os.path.basename(releases.install(options.target, release_name('manual', options.name),
+                                                         options.name))
+            else:
+                name = releases.rollback(options.target)
+        except (ReleaseError, OSError) as e:
+            print(f"{options.command.capitalize()} failed: {e}", file=sys.stderr)
+            return 1
+        if not name:
+            print("No earlier release to roll back to", file=sys.stderr)
+            return 1
+        print(f"Current release is now {name}")
+        if options.deploy:
+            return subprocess.call(['bash', os.path.join(releases.home, 'deploy.sh')], cwd=releases.home)
+        return 0
+
+    current = releases.current()
+    for entry in reversed(releases.history()):
+        marker = '*' if entry['name'] == current else ' '
+        installed = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry.get('installed_at', 0)))
+        print(f"{marker} {entry['name']:<40} {installed}  {entry.get('status', '')}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Background deployment status reporting for deployment-watcher.py.
+
+report() only queues the message; a worker thread POSTs it to
+{cloud_url}/api/deployments/status over one kept-alive HTTP(S) connection,
+so a slow cloud API never stalls the download or deploy that reported it.
+
+  - progress updates coalesce: a queued progress report is replaced by a
+    newer one for the same deployment and status
+  - state changes are never dropped by coalescing; a state change that could
+    not be sent is only skipped once a newer one for the same deployment is queued
+  - terminal states (completed/failed) are spooled to disk until the cloud
+    accepts them, and retried with backoff, also after a restart (deploy.sh
+    restarts the watcher mid-deployment)
+"""
+
+import collections
+import http.client
+import json
+import os
+import ssl
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+SPOOL_FILE = os.path.join(os.path.expanduser('~'), '.deployment-watcher-status-spool.json')
+TERMINAL_STATUSES = ('completed', 'failed')
+REQUEST_TIMEOUT = 10
+RETRY_DELAY = 5.0
+MAX_RETRY_DELAY = 300.0
+
+
+class _RetryLater(Exception):
+    """The report could not be delivered now; keep it queued."""
+
+
+class StatusReporter:
+    """Queue of status messages delivered by a worker thread."""
+
+    def __init__(self, get_config, log=print, spool_path=SPOOL_FILE):
+        self.get_config = get_config  # returns the current cloud config dict (or None)
+        self.log = log
+        self.spool_path = spool_path
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self._connection = None
+        self._origin = None
+        self._load_spool()
+
+    # --- public API ---
+
+    def start(self):
+        """Start the worker (no-op if it is already running)."""
+        if self._thread and self._thread.is_alive():
+            return self
+        self._thread = threading.Thread(target=self._run, name='status-reporter', daemon=True)
+        self._thread.start()
+        return self
+
+    def report(self, deployment_id, status, version='unknown', progress=None, **extra):
+        """Queue a status message; returns immediately."""
+        msg = {
+            'deploymentId': deployment_id,
+            'status': status,
+            'version': version,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        }
+        if progress is not None:
+            msg['progress'] = progress
+        msg.update(extra)
+
+        with self._cond:
+            last = self._queue[-1] if self._queue else None
+            if progress is not None and last and last.get('progress') is not None and \
+                    last['deploymentId'] == deployment_id and last['status'] == status:
+                self._queue[-1] = msg  # latest progress wins
+            else:
+                self._queue.append(msg)
+            if status in TERMINAL_STATUSES:
+                self._save_spool()
+            self._cond.notify()
+
+    def flush(self, timeout):
+        """Wait up to timeout seconds for the queue to drain. Returns True if it did."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._queue:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stop(self, timeout=5.0):
+        """Try to deliver what is queued, then stop the worker. Spooled reports survive."""
+        self.flush(timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._close()
+
+    # --- spool ---
+
+    def _load_spool(self):
+        try:
+            with open(self.spool_path) as f:
+                spooled = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            self.log(f"Ignoring unreadable status spool {self.spool_path}: {e}")
+            return
+        if spooled:
+            self.log(f"Resending {len(spooled)} undelivered status report(s)")
+            self._queue.extend(spooled)
+
+    def _save_spool(self):
+        """Persist the queued terminal reports (call with _cond held)."""
+        spooled = [msg for msg in self._queue if msg['status'] in TERMINAL_STATUSES]
+        try:
+            if not spooled:
+                if os.path.exists(self.spool_path):
+                    os.remove(self.spool_path)
+                return
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.spool_path), prefix='.status-spool-')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(spooled, f)
+            os.replace(tmp, self.spool_path)
+        except OSError as e:
+            self.log(f"Warning: Could not write status spool: {e}")
+
+    # --- delivery ---
+
+    def _close(self):
+        if self._connection:
+            self._connection.close()
+        self._connection = None
+
+    def _post(self, msg):
+        config = self.get_config()
+        if not config or not config.get('cloud_url') or not config.get('cloud_api_key'):
+            raise _RetryLater('cloud config not available')
+
+        url = urlparse(config['cloud_url'].rstrip('/'))
+        origin = (url.scheme, url.hostname, url.port)
+        if origin != self._origin:
+            self._close()
+            self._origin = origin
+        body = json.dumps(msg).encode('utf-8')
+        headers = {'Authorization': config['cloud_api_key'], 'Content-Type': 'application/json'}
+
+        while True:
+            reused = self._connection is not None
+            if not reused:
+                if url.scheme == 'https':
+                    self._connection = http.client.HTTPSConnection(
+                        url.hostname, url.port, timeout=REQUEST_TIMEOUT, context=ssl.create_default_context())
+                else:
+                    self._connection = http.client.HTTPConnection(url.hostname, url.port, timeout=REQUEST_TIMEOUT)
+            try:
+                self._connection.request('POST', url.path + '/api/deployments/status', body, headers)
+                response = self._connection.getresponse()
+                response.read()  # consume the body so the connection can be reused
+                break
+            except (OSError, http.client.HTTPException) as e:
+                self._close()
+                if not reused:
+                    raise _RetryLater(str(e) or type(e).__name__)
+                # The server closed the idle keep-alive connection: retry once on a new one
+        if response.will_close:
+            self._close()
+        if response.status >= 500 or response.status in (408, 429):
+            raise _RetryLater(f"HTTP {response.status}")
+        return response.status
+
+    def _describe(self, msg):
+        progress = msg.get('progress')
+        return f"'{msg['status']}'{f' ({progress}%)' if progress is not None else ''} " \
+               f"for deployment {msg['deploymentId']}"
+
+    def _run(self):
+        delay = RETRY_DELAY
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+                msg = self._queue[0]
+
+            try:
+                status = self._post(msg)
+                if status >= 400:
+                    self.log(f"Status report {self._describe(msg)} rejected: HTTP {status}")
+                else:
+                    self.log(f"Reported status {self._describe(msg)}")
+                delay = RETRY_DELAY
+                retry = False
+            except _RetryLater as e:
+                self.log(f"Failed to report status {self._describe(msg)} (will retry): {e}")
+                retry = True
+
+            with self._cond:
+                if not retry or msg['status'] not in TERMINAL_STATUSES and any(
+                        later['deploymentId'] == msg['deploymentId'] for later in list(self._queue)[1:]):
+                    # Delivered, or superseded by a newer report for the same deployment
+                    if self._queue and self._queue[0] is msg:
+                        self._queue.popleft()
+                    if msg['status'] in TERMINAL_STATUSES:
+                        self._save_spool()
+                    self._cond.notify_all()
+                    continue
+                self._cond.wait(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Acknowledged WiFi credential provisioning over CAN.
+
+Sends the Start / SSID / Password / End sequence from can_frames.py and
+tracks the per-module acknowledgement frames (CAN_DEVICE_ACK_ID) for each
+of them:
+
+  1. Start is repeated until every expected module has acknowledged it
+     (modules that answer define the participant set when none are given).
+     Start resets the module's receive state, so it is never resent later.
+  2. Chunks are sent paced by the observed ACK latency, then only the
+     chunks still missing an ACK from some participant are retransmitted.
+  3. End is repeated for modules that have not acknowledged it; its status
+     byte reports whether the module's checksum matched.
+
+If no module acknowledges Start at all (firmware without ACK support), the
+sequence is sent once with the original blind 50 ms spacing and the result
+is reported as unconfirmed.
+"""
+
+import time
+
+from can_frames import (
+    CAN_DEVICE_ACK_ID, CAN_WIFI_CONFIG_ID, WIFI_MSG_END, WIFI_MSG_START, parse_device_ack,
+    wifi_credential_frames
+)
+
+LEGACY_INTER_MESSAGE_DELAY = 0.05  # 50ms blind spacing, matching mqtt.js
+MIN_FRAME_DELAY = 0.002
+MAX_FRAME_DELAY = 0.05
+INITIAL_ACK_TIMEOUT = 0.5
+MAX_ROUNDS = 4
+
+# Module outcomes
+ACCEPTED = 'accepted'
+REJECTED = 'rejected'        # End ACK with non-zero status (checksum mismatch)
+INCOMPLETE = 'incomplete'    # chunks or End never acknowledged
+NO_RESPONSE = 'no_response'  # expected module never acknowledged Start
+UNCONFIRMED = 'unconfirmed'  # legacy firmware, no ACKs at all
+
+
+def frame_key(data):
+    """Key identifying a provisioning frame: (msg_type, index)."""
+    if data[0] in (WIFI_MSG_START, WIFI_MSG_END):
+        return data[0], 0
+    return data[0], data[1]
+
+
+class WifiProvisioner:
+    """Runs one acknowledged provisioning pass over an open CanTransport."""
+
+    def __init__(self, transport, expected_modules=None, ack_timeout=INITIAL_ACK_TIMEOUT,
+                 max_rounds=MAX_ROUNDS, log=print):
+        self.transport = transport
+        self.expected = set(expected_modules or [])
+        self.ack_timeout = ack_timeout
+        self.max_rounds = max_rounds
+        self.log = log
+        self.sent_at = {}
+        self.send_count = {}
+        self.acked = {}     # {hostname: {frame_key: status}}
+        self.srtt = None    # smoothed ACK latency (seconds)
+        self.frames_sent = 0
+        self.listener = None
+
+    # --- ACK bookkeeping ---
+
+    def _record_ack(self, data):
+        ack = parse_device_ack(data)
+        if not ack or ack['can_id'] != CAN_WIFI_CONFIG_ID:
+            return
+        key = (ack['msg_type'], ack['index'])
+        module_acks = self.acked.setdefault(ack['hostname'], {})
+        # Karn's rule: retransmitted frames give ambiguous latency samples
+        if self.send_count.get(key) == 1 and key not in module_acks:
+            sample = time.monotonic() - self.sent_at[key]
+            self.srtt = sample if self.srtt is None else 0.875 * self.srtt + 0.125 * sample
+        module_acks[key] = ack['status']
+
+    def _missing(self, modules, keys):
+        return {key for key in keys for host in modules if key not in self.acked.get(host, {})}
+
+    def _drain(self, modules, keys, timeout):
+        """Collect ACKs until every module acked every key, or timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            if modules and not self._missing(modules, keys):
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            frame = self.listener.get(remaining)
+            if frame is None:
+                return
+            self._record_ack(frame[1])
+
+    def _poll(self):
+        """Record ACKs that have already arrived, without waiting."""
+        while True:
+            frame = self.listener.get(0)
+            if frame is None:
+                return
+            self._record_ack(frame[1])
+
+    def _wait_timeout(self):
+        """ACK wait: a few smoothed round trips once we have samples."""
+        if self.srtt is None:
+            return self.ack_timeout
+        return min(self.ack_timeout, max(4 * self.srtt, 0.05))
+
+    def _frame_delay(self):
+        """Spacing between back-to-back frames, adapted to ACK latency."""
+        if self.srtt is None:
+            return MAX_FRAME_DELAY
+        return min(max(self.srtt / 2, MIN_FRAME_DELAY), MAX_FRAME_DELAY)
+
+    def _send(self, data):
+        key = frame_key(data)
+        self.sent_at[key] = time.monotonic()
+        self.send_count[key] = self.send_count.get(key, 0) + 1
+        self.transport.send(CAN_WIFI_CONFIG_ID, data)
+        self.frames_sent += 1
+
+    # --- Phases ---
+
+    def _send_legacy(self, frames):
+        for i, data in enumerate(frames):
+            if i:
+                time.sleep(LEGACY_INTER_MESSAGE_DELAY)
+            self._send(data)
+
+    def provision(self, ssid, password):
+        """Run the sequence. Returns {hostname: outcome}. Raises ValueError on bad input."""
+        frames = wifi_credential_frames(ssid, password)
+        start, chunks, end = frames[0], frames[1:-1], frames[-1]
+        start_key, end_key = frame_key(start), frame_key(end)
+        chunk_by_key = {frame_key(data): data for data in chunks}
+
+        with self.transport.listen(CAN_DEVICE_ACK_ID) as self.listener:
+            # 1. Start: establish participants
+            for _ in range(self.max_rounds):
+                self._send(start)
+                self._drain(self.expected, {start_key}, self.ack_timeout)
+                responders = {h for h, acks in self.acked.items() if start_key in acks}
+                if responders and responders >= self.expected:
+                    break
+
+            participants = {h for h, acks in self.acked.items() if start_key in acks}
+            if not participants:
+                self.log('No module acknowledged Start, sending without confirmation')
+                self._send_legacy(frames[1:])
+                return {host: UNCONFIRMED for host in self.expected} or {'*': UNCONFIRMED}
+
+            # 2. Chunks: paced send, then retransmit only what is missing
+            pending = set(chunk_by_key)
+            for round_number in range(self.max_rounds):
+                if not pending:
+                    break
+                if round_number:
+                    self.log(f'Retransmitting {len(pending)} unacknowledged chunk(s)')
+                for key in sorted(pending):
+                    self._send(chunk_by_key[key])
+                    time.sleep(self._frame_delay())
+                    self._poll()
+                self._drain(participants, pending, self._wait_timeout())
+                pending = self._missing(participants, pending)
+
+            # 3. End: only modules holding every chunk can verify the checksum
+            complete = {h for h in participants if not self._missing({h}, chunk_by_key)}
+            for _ in range(self.max_rounds):
+                waiting = {h for h in complete if end_key not in self.acked.get(h, {})}
+                if not waiting:
+                    break
+                self._send(end)
+                self._drain(waiting, {end_key}, self._wait_timeout())
+
+        results = {}
+        for host in participants | self.expected:
+            acks = self.acked.get(host, {})
+            if start_key not in acks:
+                results[host] = NO_RESPONSE
+            elif end_key not in acks:
+                results[host] = INCOMPLETE
+            else:
+                results[host] = ACCEPTED if acks[end_key] == 0 else REJECTED
+        return results